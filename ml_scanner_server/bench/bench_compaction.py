@@ -0,0 +1,134 @@
+"""旧 OK 图片归档：打包速度、文件数和占用空间的变化、单张读取延迟
+
+在临时目录中建立一个工位的检测结果索引，写入 --images 张 OK 图片（--width x --height
+的 JPEG，检测时间分布在 --days 天前起的三天内），然后用 ImageCompactor.run_once()
+按 --after-days/--quality/--max-dimension 归档，I/O 额度为 --io-mb MB/s；--busy-seconds
+模拟开始时图片写入线程池有排队，--retention-days 时同时删除过期的段文件。报告：
+  * 归档前后的文件数和字节数、归档耗时和限速等待时间
+  * 随机读取单张图片的延迟：归档前读单独的文件，归档后通过 mmap 读段文件
+  * 不重新压缩时逐字节校验归档后的图片，重新压缩时检查能否解码
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_compaction.py --images 2000 --quality 60 --io-mb 64
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'server'))
+
+from bench_review import make_jpeg  # noqa: E402
+from line_simulator import percentile  # noqa: E402
+from image_archive import ImageArchive, ImageCompactor, ArchivePolicy, is_archived  # noqa: E402
+from result_store import ResultStore, VERDICT_OK  # noqa: E402
+
+
+def disk_usage(root):
+    files = 0
+    total = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.endswith(('.jpg', '.seg', '.idx')):
+                files += 1
+                total += os.path.getsize(os.path.join(directory, name))
+    return files, total
+
+
+def read_latencies(read, keys, samples):
+    latencies = []
+    for key in random.sample(keys, min(samples, len(keys))):
+        started = time.perf_counter()
+        read(key)
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=2000, help='OK 图片数')
+    parser.add_argument('--width', type=int, default=1224, help='图片宽度')
+    parser.add_argument('--height', type=int, default=1024, help='图片高度')
+    parser.add_argument('--days', type=float, default=10.0, help='最早的图片是几天前的')
+    parser.add_argument('--after-days', type=float, default=7.0, help='归档多少天以前的图片')
+    parser.add_argument('--quality', type=int, default=None, help='重新压缩的 JPEG 质量')
+    parser.add_argument('--max-dimension', type=int, default=None, help='重新压缩时的最长边像素')
+    parser.add_argument('--retention-days', type=float, default=None, help='删除多少天以前的段文件')
+    parser.add_argument('--io-mb', type=float, default=64.0, help='I/O 额度（MB/s），0 为不限')
+    parser.add_argument('--busy-seconds', type=float, default=0.0, help='模拟开始时实时写入繁忙的秒数')
+    parser.add_argument('--samples', type=int, default=500, help='读取延迟的采样数')
+    args = parser.parse_args()
+
+    image = make_jpeg(args.width, args.height, quality=80)
+    with tempfile.TemporaryDirectory() as work_dir:
+        root = Path(work_dir) / 'Images'
+        store = ResultStore(root / 'results.db', root)
+        archive = ImageArchive(root / 'archive')
+        now = time.time()
+        originals = {}
+        for i in range(args.images):
+            created_at = now - args.days * 86400 + i * (3 * 86400 / args.images)
+            path = store.image_path_for(f'OK{i:06d}', VERDICT_OK, created_at)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(image)
+            result_id = store.record(f'OK{i:06d}', VERDICT_OK, created_at, image_path=path, image_size=len(image))
+            originals[result_id] = path
+        files_before, bytes_before = disk_usage(root)
+        loose = list(originals.values())
+        loose_reads = read_latencies(lambda path: path.read_bytes(), loose, args.samples)
+
+        busy_until = time.monotonic() + args.busy_seconds
+        compactor = ImageCompactor(busy=lambda: time.monotonic() < busy_until,
+                                   io_budget=args.io_mb * 1024 * 1024, batch_size=64)
+        policy = ArchivePolicy(args.after_days, quality=args.quality, max_dimension=args.max_dimension,
+                               retention_days=args.retention_days)
+        compactor.add('bench', store, archive, policy)
+        started = time.monotonic()
+        compactor.run_once()
+        elapsed = time.monotonic() - started
+        stats = compactor.stats()
+        files_after, bytes_after = disk_usage(root)
+
+        archived = {}
+        for result_id in originals:
+            image_path = store.get(result_id)['image_path']
+            if is_archived(image_path):
+                archived[result_id] = image_path
+        mmap_reads = read_latencies(archive.read, list(archived.values()), args.samples)
+        mismatched = 0
+        for result_id, image_path in archived.items():
+            data = archive.read(image_path)
+            if args.quality is None and args.max_dimension is None:
+                mismatched += data != image
+            else:
+                with Image.open(io.BytesIO(data)) as decoded:
+                    decoded.load()
+        segments = archive.stats()
+        archive.close()
+
+    print(f"{args.images} 张 {args.width}x{args.height} OK 图片（{len(image) // 1024} KB），归档 {args.after_days:g} 天以前的，"
+          f"质量 {args.quality or '不变'}，最长边 {args.max_dimension or '不变'}，I/O 额度 "
+          f"{f'{args.io_mb:g} MB/s' if args.io_mb else '不限'}")
+    print(f"归档: {stats['archived']} 张，耗时 {elapsed:.1f} 秒（{stats['archived'] / elapsed:.0f} 张/秒），"
+          f"限速/避让等待 {stats['throttled_seconds']} 秒，避让次数 {stats['backoffs']}")
+    print(f"读取 {stats['bytes_read'] / 1024 / 1024:.1f} MB，写入 {stats['bytes_written'] / 1024 / 1024:.1f} MB，"
+          f"过期删除段文件 {stats['segments_removed']} 个（{stats['expired']} 张）")
+    print(f"文件数: {files_before} -> {files_after}，占用: {bytes_before / 1024 / 1024:.1f} MB -> "
+          f"{bytes_after / 1024 / 1024:.1f} MB，段文件 {segments['segments']} 个")
+    print(f"单张读取 (us)   {'p50':>8}{'p95':>8}")
+    print(f"  单独文件      {statistics.median(loose_reads):>8.0f}{percentile(loose_reads, 95):>8.0f}")
+    if mmap_reads:
+        print(f"  段文件 mmap   {statistics.median(mmap_reads):>8.0f}{percentile(mmap_reads, 95):>8.0f}")
+    print(f"校验: {len(archived)} 张，不一致 {mismatched}")
+
+
+if __name__ == '__main__':
+    main()
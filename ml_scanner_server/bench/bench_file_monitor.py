@@ -0,0 +1,88 @@
+"""测量 InputFileMonitor 从写入 input.txt 到回调触发的延迟
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_file_monitor.py --rounds 50
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'server'))
+
+from file_monitor import InputFileMonitor  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_backend(backend, rounds, atomic):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'input.txt')
+        Path(file_path).touch()
+
+        received = threading.Event()
+        monitor = InputFileMonitor(file_path, watcher_backend=backend)
+        monitor.start_monitoring(lambda content: received.set())
+        time.sleep(0.2)
+
+        latencies = []
+        content = ""
+        for i in range(rounds):
+            received.clear()
+            barcode = f"BOARD{i:06d}\n"
+            content += barcode
+            # 随机化写入相位，避免与轮询周期对齐
+            time.sleep(0.05 + (i % 7) * 0.013)
+            start = time.perf_counter()
+            if atomic:
+                tmp_path = file_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                os.replace(tmp_path, file_path)
+            else:
+                with open(file_path, 'a', encoding='utf-8') as f:
+                    f.write(barcode)
+            if received.wait(timeout=5):
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        monitor.stop_monitoring()
+        return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=30)
+    parser.add_argument('--atomic', action='store_true', help='使用写临时文件后 rename 的方式更新 input.txt')
+    parser.add_argument('--backends', default='polling,inotify')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f"{'backend':<10}{'n':>5}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}{'mean(ms)':>10}")
+    for backend in args.backends.split(','):
+        try:
+            latencies = run_backend(backend, args.rounds, args.atomic)
+        except OSError as e:
+            print(f"{backend:<10} 不可用: {e}")
+            continue
+        if not latencies:
+            print(f"{backend:<10} 未收到任何回调")
+            continue
+        print(f"{backend:<10}{len(latencies):>5}"
+              f"{percentile(latencies, 50):>10.2f}{percentile(latencies, 95):>10.2f}"
+              f"{max(latencies):>10.2f}{statistics.mean(latencies):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""对比同步日志与队列日志在大量日志下对周期延迟的影响
+
+模拟服务器的热路径：一个"周期"线程按固定节奏执行一次周期（PLC读取、文件
+监控启停、读到内容、发送信号等约 --logs-per-cycle 条日志），同时 --noise-threads
+个线程各以 --noise-rate 条/秒输出日志（模拟请求线程和文件监控线程）。分别在以下配置下统计
+每个周期的耗时：
+  sync   旧配置：调用线程直接写 FileHandler + StreamHandler
+  queued 新配置：QueueHandler 入队，后台线程写文件并轮转压缩
+  limited 新配置并按调用位置限频（默认配置）
+
+日志写到临时目录，控制台输出写到 --console 指定的文件（默认 /dev/null）。
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_logging.py --cycles 500 --noise-threads 4
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'server'))
+
+import logger_config  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_cycle(logger, cycle, logs_per_cycle, payload):
+    for i in range(logs_per_cycle):
+        logger.info(f"周期 {cycle} 步骤 {i} 线程 {threading.current_thread().name} 内容: {payload}")
+
+
+def noise(logger, stop, payload, rate):
+    """每 10 毫秒输出一批日志，使每个线程的日志量约为 rate 条/秒"""
+    n = 0
+    batch = max(1, int(rate / 100))
+    while not stop.is_set():
+        for _ in range(batch):
+            logger.info(f"读取到文件内容: {payload} #{n}")
+            n += 1
+        time.sleep(0.01)
+
+
+def measure(mode, args, console):
+    with tempfile.TemporaryDirectory() as log_dir:
+        sys.stderr = console
+        try:
+            logger_config.setup_logging(log_dir, queued=(mode != 'sync'),
+                                        rate_limit=logger_config.DEFAULT_RATE_LIMIT if mode == 'limited' else None,
+                                        max_bytes=args.max_bytes)
+            cycle_logger = logger_config.get_logger("BenchCycle")
+            noise_logger = logger_config.get_logger("BenchNoise")
+            payload = 'X' * args.payload
+            stop = threading.Event()
+            noise_threads = [threading.Thread(target=noise, args=(noise_logger, stop, payload, args.noise_rate), daemon=True)
+                             for _ in range(args.noise_threads)]
+            for t in noise_threads:
+                t.start()
+
+            durations = []
+            for cycle in range(args.cycles):
+                start = time.perf_counter()
+                run_cycle(cycle_logger, cycle, args.logs_per_cycle, payload)
+                durations.append((time.perf_counter() - start) * 1000)
+                time.sleep(args.interval)
+
+            stop.set()
+            for t in noise_threads:
+                t.join()
+            stats = logger_config.logging_stats()
+            logger_config.shutdown_logging()
+            files = sorted(p.name for p in Path(log_dir).iterdir())
+        finally:
+            sys.stderr = sys.__stderr__
+    return durations, stats, files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=300)
+    parser.add_argument('--logs-per-cycle', type=int, default=12)
+    parser.add_argument('--noise-threads', type=int, default=4)
+    parser.add_argument('--noise-rate', type=int, default=2000, help='每个干扰线程每秒的日志条数')
+    parser.add_argument('--payload', type=int, default=200, help='每条日志的内容长度')
+    parser.add_argument('--interval', type=float, default=0.005, help='两个周期之间的间隔（秒）')
+    parser.add_argument('--max-bytes', type=int, default=5 * 1024 * 1024, help='日志轮转大小')
+    parser.add_argument('--console', default='/dev/null', help='控制台日志输出到的文件')
+    args = parser.parse_args()
+
+    print(f"{'mode':<8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'mean(ms)':>10}"
+          f"{'suppressed':>12}{'dropped':>9}  files")
+    with open(args.console, 'w') as console:
+        for mode in ('sync', 'queued', 'limited'):
+            durations, stats, files = measure(mode, args, console)
+            print(f"{mode:<8}{statistics.median(durations):>10.3f}{percentile(durations, 95):>10.3f}"
+                  f"{percentile(durations, 99):>10.3f}{max(durations):>10.3f}{statistics.mean(durations):>10.3f}"
+                  f"{stats['suppressed']:>12}{stats['dropped']:>9}  {len(files)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""测量 PLCManager 从PLC发出 '7' 到触发处理函数被调用的延迟
+
+不需要真实PLC：--transport pty 使用伪终端对（PLCManager 打开从端，本脚本向
+主端写入），--transport loop 使用 pyserial 的 loop:// 回环端口。--legacy 同时
+测量旧的 in_waiting + sleep(0.1) 轮询读取方式作为对比。
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_plc_reader.py --rounds 50 --transport pty --legacy
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'server'))
+
+from plc_manager import PLCManager  # noqa: E402
+from plc_protocol import FrameType  # noqa: E402
+
+
+class LegacyReader:
+    """旧实现：检查 in_waiting 后固定 sleep 0.1 秒，块中含 b'7' 即视为触发"""
+
+    def __init__(self, serial_port, on_trigger):
+        self.serial_port = serial_port
+        self.on_trigger = on_trigger
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            if self.serial_port.in_waiting:
+                data = self.serial_port.read(self.serial_port.in_waiting)
+                if b'7' in data:
+                    self.on_trigger(None)
+            time.sleep(0.1)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def open_transport(transport):
+    """返回 (PLCManager 使用的端口, 向该端口发送字节的函数, 清理函数)"""
+    if transport == 'pty':
+        master, slave = os.openpty()
+        port = os.ttyname(slave)
+        return port, lambda data: os.write(master, data), lambda: (os.close(master), os.close(slave))
+    return 'loop://', None, lambda: None
+
+
+def measure(reader_name, transport, rounds, frame):
+    port, write, cleanup = open_transport(transport)
+    dispatched = threading.Event()
+    received_at = []
+
+    def on_trigger(_frame):
+        received_at.append(time.perf_counter())
+        dispatched.set()
+
+    manager = PLCManager(port=port, handlers={FrameType.TRIGGER: on_trigger} if reader_name == 'framed' else None)
+    manager.start()
+    if not manager.wait_connected(timeout=5):
+        raise RuntimeError(f"无法连接端口 {port}")
+    if reader_name == 'framed':
+        serial_port = manager.serial_port
+        close = manager.close
+    else:
+        # 停掉新的读取线程，换成旧的轮询读取
+        serial_port = manager.serial_port
+        manager._stop_event.set()
+        manager.running = False
+        manager.read_thread.join()
+        legacy = LegacyReader(serial_port, on_trigger)
+
+        def close():
+            legacy.close()
+            serial_port.close()
+
+    if write is None:
+        write = serial_port.write
+
+    latencies = []
+    try:
+        for i in range(rounds):
+            dispatched.clear()
+            received_at.clear()
+            # 随机化发送相位，避免与轮询周期对齐
+            time.sleep(0.02 + (i % 9) * 0.011)
+            start = time.perf_counter()
+            write(frame)
+            if dispatched.wait(timeout=2):
+                latencies.append((received_at[0] - start) * 1000)
+    finally:
+        close()
+        cleanup()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=30)
+    parser.add_argument('--transport', choices=('pty', 'loop'), default='pty')
+    parser.add_argument('--frame', default='7  ', help="PLC发送的触发数据，默认为现场PLC的 '7  '")
+    parser.add_argument('--legacy', action='store_true', help='同时测量旧的轮询读取方式')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    readers = ['framed'] + (['legacy'] if args.legacy else [])
+    print(f"{'reader':<10}{'n':>5}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}{'mean(ms)':>10}")
+    for reader_name in readers:
+        latencies = measure(reader_name, args.transport, args.rounds, args.frame.encode('latin-1'))
+        if not latencies:
+            print(f"{reader_name:<10} 未收到任何触发")
+            continue
+        print(f"{reader_name:<10}{len(latencies):>5}{percentile(latencies, 50):>10.2f}"
+              f"{percentile(latencies, 95):>10.2f}{max(latencies):>10.2f}{statistics.mean(latencies):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""对比检测结果的三种上传方式：往返延迟和服务器每块板的 CPU 时间
+
+  http-json    原有方式：每块板一个 HTTP POST，图片 base64 放在 JSON 中
+  http-binary  每块板一个 HTTP POST，请求体为 JPEG（X-Board-Id 等请求头）
+  socketio     复用接收 start_detection 的 Socket.IO 连接，detection_result 事件
+               带二进制附件，服务器在放行命令发送到PLC后 ack
+
+服务器以子进程方式运行，PLC 为伪终端上的模拟PLC。每种方式依次处理 --boards 块板：
+PLC 发 '7'、写入条码、客户端收到 start_detection 后上传结果。报告：
+  rtt          上传开始到收到 HTTP 响应或 Socket.IO ack 的时间
+  release      上传开始到模拟PLC收到放行命令的时间
+  cpu/board    服务器进程（用户态 + 内核态）CPU 时间除以板卡数
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_result_channel.py --boards 200 --image-kb 500
+"""
+import argparse
+import base64
+import io
+import os
+import queue
+import signal
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from line_simulator import PtyPLC, SubprocessServer, wait_ready, percentile, INPUT_FILE  # noqa: E402
+
+MODES = ('http-json', 'http-binary', 'socketio')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def process_cpu_seconds(pid):
+    """进程累计的用户态 + 内核态 CPU 时间（秒）"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+class Client:
+    """一个检测客户端：收到的 start_detection 放入队列，由主线程按选定方式上传结果"""
+
+    def __init__(self, base_url):
+        import socketio
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.starts = queue.Queue()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('start_detection', self._on_start_detection)
+        self.sio.connect(base_url, auth={'name': 'bench-client', 'acks': True}, wait_timeout=5)
+
+    def _on_start_detection(self, data):
+        self.starts.put(data)
+        return True
+
+    def upload(self, mode, data, image, has_defect):
+        barcode = data['data']
+        if mode == 'socketio':
+            ack = self.sio.call('detection_result', {'board_id': barcode, 'has_defect': has_defect,
+                                                     'cycle_id': data.get('cycle_id'), 'image': image}, timeout=30)
+            if ack.get('message') != 'Success':
+                raise RuntimeError(ack)
+            return
+        if mode == 'http-json':
+            response = self.session.post(self.base_url + '/detection_result', timeout=30, json={
+                'board_id': barcode, 'has_defect': has_defect, 'cycle_id': data.get('cycle_id'),
+                'image': base64.b64encode(image).decode('ascii')})
+        else:
+            headers = {'Content-Type': 'image/jpeg', 'X-Board-Id': barcode,
+                       'X-Has-Defect': '1' if has_defect else '0', 'X-Cycle-Id': str(data.get('cycle_id'))}
+            response = self.session.post(self.base_url + '/detection_result', data=io.BytesIO(image),
+                                         headers=headers, timeout=30)
+        response.raise_for_status()
+
+    def close(self):
+        self.sio.disconnect()
+
+
+def run_mode(mode, client, plc, releases, server_pid, args, image, run_id):
+    rtts = []
+    release_latencies = []
+    cpu_before = process_cpu_seconds(server_pid)
+    for seq in range(args.boards):
+        barcode = f'RC{run_id}{mode[0]}{mode[-1]}{seq:06d}'
+        plc.trigger(args.frame.encode('latin-1'))
+        with open(INPUT_FILE, 'a', encoding='utf-8') as f:
+            f.write(barcode + '\n')
+        data = client.starts.get(timeout=10)
+        started = time.monotonic()
+        client.upload(mode, data, image, seq % 10 == 0)
+        rtts.append((time.monotonic() - started) * 1000)
+        released_at = releases.get(timeout=10)
+        release_latencies.append((released_at - started) * 1000)
+    cpu = process_cpu_seconds(server_pid) - cpu_before
+    return rtts, release_latencies, cpu / args.boards * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--boards', type=int, default=200, help='每种方式的板卡数')
+    parser.add_argument('--image-kb', type=int, default=500, help='图片大小（KB）')
+    parser.add_argument('--modes', default=','.join(MODES), help='要测试的方式，逗号分隔')
+    parser.add_argument('--workers', type=int, default=32, help='服务器工作线程数')
+    parser.add_argument('--frame', default='7  ', help="PLC触发数据，默认为现场PLC的 '7  '")
+    args = parser.parse_args()
+    modes = [m for m in args.modes.split(',') if m]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f'未知的方式: {mode}')
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    image = os.urandom(args.image_kb * 1024)
+    run_id = datetime.now().strftime('%H%M%S')
+    releases = queue.Queue()
+    original_input = INPUT_FILE.read_bytes() if INPUT_FILE.exists() else b''
+    plc = server = client = None
+    results = {}
+    try:
+        plc = PtyPLC(releases.put)
+        server = SubprocessServer(plc.port, args.workers, {})
+        wait_ready(server.base_url)
+        client = Client(server.base_url)
+        for mode in modes:
+            # 预热：建立 HTTP 连接、加载代码路径
+            run_mode(mode, client, plc, releases, server.proc.pid, argparse.Namespace(**{**vars(args), 'boards': 5}),
+                     image, run_id + 'w')
+            results[mode] = run_mode(mode, client, plc, releases, server.proc.pid, args, image, run_id)
+    finally:
+        if client is not None:
+            client.close()
+        if server is not None:
+            server.close()
+        if plc is not None:
+            plc.close()
+        INPUT_FILE.write_bytes(original_input)
+
+    print(f"{args.boards} 块板/方式，图片 {args.image_kb} KB")
+    print(f"{'mode':<13}{'rtt p50':>9}{'rtt p95':>9}{'rtt p99':>9}{'release p50':>13}{'release p95':>13}"
+          f"{'cpu/board(ms)':>15}")
+    for mode, (rtts, release_latencies, cpu_ms) in results.items():
+        print(f"{mode:<13}{statistics.median(rtts):>9.2f}{percentile(rtts, 95):>9.2f}{percentile(rtts, 99):>9.2f}"
+              f"{statistics.median(release_latencies):>13.2f}{percentile(release_latencies, 95):>13.2f}"
+              f"{cpu_ms:>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
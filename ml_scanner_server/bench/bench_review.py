@@ -0,0 +1,201 @@
+"""NG 复查对产线的影响：浏览缩略图时的 trigger->release 延迟
+
+服务器以子进程方式运行（一个工位，图片和缩略图缓存在临时目录），PLC 为伪终端上的
+模拟PLC，检测客户端上传 --width x --height 的 JPEG，--defect-rate 的板卡判为 NG。
+两个阶段各驱动 --boards 块板：
+  baseline  只有产线
+  review    同时有 --viewers 个复查用户反复拉取 /review 图库第一页和其中每张缩略图
+            （每个用户一种尺寸，带 If-None-Match），新的 NG 图片不断加入，缩略图
+            持续有冷启动生成
+报告两个阶段的 trigger->release 延迟和丢板数，以及缩略图请求的延迟（200 包括生成
+和缓存命中）、304 和 503 次数和服务器的缩略图缓存计数。
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_review.py --boards 120 --rate 120 --viewers 4
+"""
+import argparse
+import io
+import signal
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import requests
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from line_simulator import (PtyPLC, LineStats, InspectionClient, SubprocessServer,  # noqa: E402
+                            drive_line, percentile)
+from bench_stations import write_config, wait_stations_ready  # noqa: E402
+
+STATION = 'review'
+SIZES = (160, 320, 640)
+
+
+def make_jpeg(width, height, quality=90):
+    """有纹理的测试图片（纯随机噪声的 JPEG 过大，不像产线图片）"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = ((x // 16 + y // 16) % 2 * 80 + 60).astype(np.uint8)
+    pixels = np.stack([base, base // 2 + 40, 255 - base], axis=-1)
+    pixels = np.clip(pixels + rng.normal(0, 8, pixels.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+class Viewer(threading.Thread):
+    """复查用户：循环刷新图库第一页并拉取其中的缩略图"""
+
+    def __init__(self, base_url, size, page_size, stop_event):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.size = size
+        self.page_size = page_size
+        self.stop_event = stop_event
+        self.session = requests.Session()
+        self.etags = {}
+        self.fetched = []
+        self.not_modified = []
+        self.busy = 0
+        self.errors = 0
+
+    def run(self):
+        gallery_etag = None
+        items = []
+        while not self.stop_event.is_set():
+            headers = {'Accept': 'application/json'}
+            if gallery_etag:
+                headers['If-None-Match'] = gallery_etag
+            response = self.session.get(self.base_url + '/review', headers=headers,
+                                        params={'page_size': self.page_size, 'size': self.size}, timeout=30)
+            if response.status_code == 200:
+                gallery_etag = response.headers.get('ETag')
+                items = [r['thumbnail_url'] for r in response.json()['results'] if r['thumbnail_url']]
+            for url in items:
+                if self.stop_event.is_set():
+                    break
+                self.fetch(url)
+            time.sleep(0.2)
+
+    def fetch(self, url):
+        headers = {}
+        etag = self.etags.get(url)
+        if etag:
+            headers['If-None-Match'] = etag
+        started = time.monotonic()
+        response = self.session.get(self.base_url + url, headers=headers, timeout=30)
+        elapsed = (time.monotonic() - started) * 1000
+        if response.status_code == 304:
+            self.not_modified.append(elapsed)
+        elif response.status_code == 200:
+            self.etags[url] = response.headers.get('ETag')
+            self.fetched.append(elapsed)
+        elif response.status_code == 503:
+            self.busy += 1
+        else:
+            self.errors += 1
+
+
+def run_phase(name, plc_stats, plc, server, args, image, viewers_count, run_id, input_file):
+    stats = LineStats()
+    plc_stats['current'] = stats
+    client = InspectionClient(server.base_url, stats, image, (50, 150), args.defect_rate, f'{name}-client',
+                              station=STATION)
+    stop_event = threading.Event()
+    viewers = [Viewer(server.base_url, SIZES[i % len(SIZES)], args.page_size, stop_event)
+               for i in range(viewers_count)]
+    try:
+        for viewer in viewers:
+            viewer.start()
+        drive_line(plc, stats, [60.0 / args.rate] * args.boards, 0.05, args.frame.encode('latin-1'),
+                   f'{run_id}{name[0]}', input_file)
+        deadline = time.monotonic() + 10
+        while stats.pending() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        time.sleep(0.5)
+    finally:
+        stop_event.set()
+        for viewer in viewers:
+            viewer.join(timeout=30)
+        client.close()
+    return stats, viewers
+
+
+def summarize(values):
+    if not values:
+        return f"{'-':>9}{'-':>9}"
+    return f"{statistics.median(values):>9.1f}{percentile(values, 95):>9.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--boards', type=int, default=120, help='每个阶段的板卡数')
+    parser.add_argument('--rate', type=float, default=120.0, help='触发速率（块/分钟）')
+    parser.add_argument('--viewers', type=int, default=4, help='复查阶段的并发用户数')
+    parser.add_argument('--page-size', type=int, default=48, help='图库每页条数')
+    parser.add_argument('--width', type=int, default=2448, help='检测图片宽度')
+    parser.add_argument('--height', type=int, default=2048, help='检测图片高度')
+    parser.add_argument('--defect-rate', type=float, default=0.5, help='判为 NG 的比例')
+    parser.add_argument('--workers', type=int, default=32, help='服务器工作线程数')
+    parser.add_argument('--frame', default='7  ', help="PLC触发数据，默认为现场PLC的 '7  '")
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    image = make_jpeg(args.width, args.height)
+    run_id = datetime.now().strftime('%H%M%S')
+    plc_stats = {'current': LineStats()}
+    results = {}
+    plc = server = None
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            plc = PtyPLC(lambda at: plc_stats['current'].on_release(at))
+            config = write_config(work_dir, [STATION], [plc])
+            server = SubprocessServer(None, args.workers, {'ML_SCANNER_STATIONS': str(config),
+                                                          'ML_SCANNER_THUMB_DIR': str(Path(work_dir) / 'thumbs')})
+            wait_stations_ready(server.base_url, 1)
+            input_file = Path(work_dir) / 'input' / f'{STATION}.txt'
+            print(f"图片 {args.width}x{args.height}（{len(image) // 1024} KB），每阶段 {args.boards} 块板，"
+                  f"{args.rate:g} 块/分钟，复查用户 {args.viewers} 个")
+            for name, viewers_count in (('baseline', 0), ('review', args.viewers)):
+                results[name] = run_phase(name, plc_stats, plc, server, args, image, viewers_count, run_id,
+                                          input_file)
+            thumbnails = requests.get(server.base_url + '/metrics', timeout=5).text
+        finally:
+            if server is not None:
+                server.close()
+            if plc is not None:
+                plc.close()
+
+    print(f"\n{'phase':<10}{'done':>6}{'dropped':>9}{'release p50':>13}{'p95':>9}{'p99':>9}")
+    for name, (stats, _) in results.items():
+        boards = stats.order
+        done = [b for b in boards if b.results]
+        dropped = [b for b in boards if b.scanned_at is not None and not b.results]
+        latencies = [(b.released_at - b.triggered_at) * 1000 for b in boards if b.released_at]
+        p50 = statistics.median(latencies) if latencies else float('nan')
+        print(f"{name:<10}{len(done):>6}{len(dropped):>9}{p50:>13.1f}{percentile(latencies, 95):>9.1f}"
+              f"{percentile(latencies, 99):>9.1f}")
+
+    viewers = results['review'][1]
+    fetched = [v for viewer in viewers for v in viewer.fetched]
+    not_modified = [v for viewer in viewers for v in viewer.not_modified]
+    print(f"\n缩略图请求{'':<6}{'count':>7}{'p50(ms)':>9}{'p95(ms)':>9}")
+    print(f"{'200':<16}{len(fetched):>7}{summarize(fetched)}")
+    print(f"{'304':<16}{len(not_modified):>7}{summarize(not_modified)}")
+    print(f"503: {sum(v.busy for v in viewers)}，错误: {sum(v.errors for v in viewers)}")
+    print("\n服务器缩略图计数:")
+    for line in thumbnails.splitlines():
+        if line.startswith('ml_scanner_thumbnails_'):
+            print('  ' + line[len('ml_scanner_thumbnails_'):])
+
+
+if __name__ == '__main__':
+    main()
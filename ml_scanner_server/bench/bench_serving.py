@@ -0,0 +1,156 @@
+"""对比不同运行模式下 /detection_result 的吞吐量
+
+为每种模式（--mode dev / threaded）和每个 Socket.IO 客户端数单独启动 server.py
+子进程，先连接 --sio-clients 个 Socket.IO 客户端占用长连接，再用多个线程并发上传
+二进制图片，统计每秒请求数、延迟分位数和失败数（包括 503）。最后向服务器发送
+SIGTERM，统计退出用时。PLC 使用 loop:// 回环端口，不需要真实硬件。
+
+--sio-clients 可以是逗号分隔的多个值，用于查看打开的 Socket.IO 连接数超过
+--workers 时检测结果上传的延迟是否受影响。
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_serving.py --concurrency 16 --duration 10 --sio-clients 4
+    python bench/bench_serving.py --modes threaded --sio-clients 0,16,48 --workers 32
+"""
+import argparse
+import io
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / 'server'
+
+MODES = ('dev', 'threaded')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def wait_ready(base_url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + '/results/summary', timeout=0.5)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError('服务器未能启动')
+
+
+def connect_sio_clients(base_url, count):
+    if count <= 0:
+        return []
+    import socketio
+    clients = []
+    for _ in range(count):
+        client = socketio.Client(reconnection=False)
+        client.connect(base_url, wait_timeout=5)
+        clients.append(client)
+    return clients
+
+
+def upload_worker(base_url, image, deadline, worker_id, latencies, errors):
+    session = requests.Session()
+    i = 0
+    while time.perf_counter() < deadline:
+        board_id = f'BENCH{worker_id:03d}_{i:06d}'
+        start = time.perf_counter()
+        try:
+            response = session.post(base_url + '/detection_result', data=io.BytesIO(image), timeout=30,
+                                    headers={'Content-Type': 'image/jpeg', 'X-Board-Id': board_id,
+                                             'X-Has-Defect': '0'})
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(response.status_code)
+        except requests.RequestException as e:
+            errors.append(type(e).__name__)
+        i += 1
+
+
+def run_mode(mode, sio_clients, args, image):
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, ML_SCANNER_PLC_PORT='loop://')
+    # dev 模式的 reloader 会再启动一个子进程，放在单独的进程组里便于一起结束
+    proc = subprocess.Popen([sys.executable, 'server.py', '--mode', mode, '--host', '127.0.0.1',
+                             '--port', str(port), '--workers', str(args.workers),
+                             '--socketio-workers', str(args.socketio_workers)],
+                            cwd=SERVER_DIR, env=env, start_new_session=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    clients = []
+    try:
+        wait_ready(base_url)
+        clients = connect_sio_clients(base_url, sio_clients)
+        latencies, errors = [], []
+        deadline = time.perf_counter() + args.duration
+        threads = [threading.Thread(target=upload_worker, args=(base_url, image, deadline, i, latencies, errors))
+                   for i in range(args.concurrency)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        for client in clients:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+        stop_started = time.perf_counter()
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        stop_seconds = time.perf_counter() - stop_started
+    return latencies, errors, elapsed, stop_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--concurrency', type=int, default=16, help='并发上传线程数')
+    parser.add_argument('--duration', type=float, default=10.0, help='每种模式的压测秒数')
+    parser.add_argument('--size-kb', type=int, default=500, help='每张图片的大小（KB）')
+    parser.add_argument('--sio-clients', default='2', help='压测期间保持连接的 Socket.IO 客户端数，可用逗号分隔多个值')
+    parser.add_argument('--workers', type=int, default=32, help='threaded 模式的工作线程数')
+    parser.add_argument('--socketio-workers', type=int, default=128, help='threaded 模式的 Socket.IO 连接线程数')
+    args = parser.parse_args()
+
+    image = os.urandom(args.size_kb * 1024)
+    print(f"{'mode':<10}{'sio':>5}{'req/s':>9}{'ok':>7}{'err':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+          f"{'stop(s)':>9}")
+    for mode in args.modes.split(','):
+        for sio_clients in (int(v) for v in args.sio_clients.split(',')):
+            latencies, errors, elapsed, stop_seconds = run_mode(mode, sio_clients, args, image)
+            if not latencies:
+                print(f"{mode:<10}{sio_clients:>5} 没有成功的请求，错误: {errors[:5]}")
+                continue
+            ms = [v * 1000 for v in latencies]
+            print(f"{mode:<10}{sio_clients:>5}{len(latencies) / elapsed:>9.1f}{len(latencies):>7}{len(errors):>6}"
+                  f"{statistics.median(ms):>10.1f}{percentile(ms, 95):>10.1f}{percentile(ms, 99):>10.1f}"
+                  f"{stop_seconds:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
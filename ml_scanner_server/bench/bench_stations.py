@@ -0,0 +1,189 @@
+"""多工位模式压测：一个服务器进程同时驱动 --stations 条模拟产线
+
+每个工位一个伪终端模拟PLC、一个扫码枪输入文件、一个图片目录和 --clients-per-station
+个检测客户端（连接时指定工位），工位配置写入临时目录中的 stations.yaml，服务器以
+子进程方式运行（ML_SCANNER_STATIONS）。所有产线同时按 --rate 驱动，结束时按工位
+报告完成数、放行命令数、丢失、串线（客户端收到其他工位的条码）和 trigger->release
+延迟，以及服务器进程的内存和线程数。--baseline 时另外启动一个单工位服务器，估算
+每条产线一个进程时的总内存。
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_stations.py --stations 8 --rate 60 --boards 30
+"""
+import argparse
+import os
+import signal
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import requests
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from line_simulator import (PtyPLC, LineStats, InspectionClient, SubprocessServer,  # noqa: E402
+                            drive_line, percentile)
+
+
+def process_status(pid):
+    """进程的常驻内存（MB）和线程数"""
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.strip()
+    return int(status['VmRSS'].split()[0]) / 1024.0, int(status['Threads'])
+
+
+def wait_stations_ready(base_url, count, timeout=30):
+    """等待服务器可以访问并且所有工位的PLC都已连接"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            stations = requests.get(base_url + '/stations', timeout=0.5).json()['stations']
+            if len(stations) == count and all(s['plc_connected'] for s in stations):
+                return
+        except (requests.ConnectionError, ValueError, KeyError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('服务器未能启动或有工位的PLC未连接')
+
+
+def write_config(work_dir, station_ids, plcs):
+    config = {
+        'stations': [
+            {'id': station_id, 'plc_port': plc.port, 'input_file': f'input/{station_id}.txt',
+             'images_dir': f'Images/{station_id}'}
+            for station_id, plc in zip(station_ids, plcs)
+        ]
+    }
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+    path = Path(work_dir) / 'stations.yaml'
+    path.write_text(yaml.safe_dump(config, allow_unicode=True), encoding='utf-8')
+    return path
+
+
+def measure_baseline(work_dir, workers):
+    """单工位服务器空闲时的内存和线程数"""
+    plc = PtyPLC(lambda at: None)
+    config = write_config(Path(work_dir) / 'baseline', ['baseline'], [plc])
+    server = SubprocessServer(None, workers, {'ML_SCANNER_STATIONS': str(config)})
+    try:
+        wait_stations_ready(server.base_url, 1)
+        time.sleep(1.0)
+        return process_status(server.proc.pid)
+    finally:
+        server.close()
+        plc.close()
+
+
+def report(station_ids, line_stats, elapsed, rss_mb, threads, baseline):
+    print(f"\n{'station':<10}{'boards':>8}{'done':>7}{'release':>9}{'dropped':>9}{'crossed':>9}"
+          f"{'errors':>8}{'p50(ms)':>10}{'p95(ms)':>10}")
+    totals = {'boards': 0, 'done': 0, 'release': 0, 'dropped': 0, 'crossed': 0, 'errors': 0}
+    all_latencies = []
+    for station_id, stats in zip(station_ids, line_stats):
+        boards = stats.order
+        done = [b for b in boards if b.results]
+        dropped = [b for b in boards if b.scanned_at is not None and not b.results]
+        latencies = [(b.released_at - b.triggered_at) * 1000 for b in boards if b.released_at]
+        all_latencies.extend(latencies)
+        row = {'boards': len(boards), 'done': len(done), 'release': stats.releases, 'dropped': len(dropped),
+               'crossed': len(stats.unknown_payloads), 'errors': len(stats.errors)}
+        for key, value in row.items():
+            totals[key] += value
+        p50 = f"{statistics.median(latencies):>10.1f}" if latencies else f"{'-':>10}"
+        p95 = f"{percentile(latencies, 95):>10.1f}" if latencies else f"{'-':>10}"
+        print(f"{station_id:<10}{row['boards']:>8}{row['done']:>7}{row['release']:>9}{row['dropped']:>9}"
+              f"{row['crossed']:>9}{row['errors']:>8}{p50}{p95}")
+    p50 = f"{statistics.median(all_latencies):>10.1f}" if all_latencies else f"{'-':>10}"
+    p95 = f"{percentile(all_latencies, 95):>10.1f}" if all_latencies else f"{'-':>10}"
+    print(f"{'total':<10}{totals['boards']:>8}{totals['done']:>7}{totals['release']:>9}{totals['dropped']:>9}"
+          f"{totals['crossed']:>9}{totals['errors']:>8}{p50}{p95}")
+    if elapsed > 0:
+        print(f"\n总产能: {totals['done'] / elapsed * 60:.1f} 块/分钟（{elapsed:.1f} 秒）")
+    print(f"服务器进程: {rss_mb:.1f} MB, {threads} 个线程（{len(station_ids)} 个工位）")
+    if baseline:
+        base_rss, base_threads = baseline
+        print(f"单工位进程: {base_rss:.1f} MB, {base_threads} 个线程；每条产线一个进程约 "
+              f"{base_rss * len(station_ids):.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stations', type=int, default=8, help='工位（产线）数')
+    parser.add_argument('--rate', type=float, default=60.0, help='每条产线的触发速率（块/分钟）')
+    parser.add_argument('--boards', type=int, default=30, help='每条产线的板卡数')
+    parser.add_argument('--clients-per-station', type=int, default=1, help='每个工位的检测客户端数')
+    parser.add_argument('--scan-delay', type=float, default=0.05, help='触发到扫码枪写入条码的秒数')
+    parser.add_argument('--image-kb', type=int, default=200, help='上传图片大小（KB）')
+    parser.add_argument('--think-ms', default='50,150', help='客户端检测耗时范围（毫秒），如 50,150')
+    parser.add_argument('--defect-rate', type=float, default=0.1, help='判为有缺陷的比例')
+    parser.add_argument('--settle', type=float, default=10.0, help='最后一次触发后等待未完成板卡的秒数')
+    parser.add_argument('--workers', type=int, default=64, help='服务器工作线程数')
+    parser.add_argument('--frame', default='7  ', help="PLC触发数据，默认为现场PLC的 '7  '")
+    parser.add_argument('--baseline', action='store_true', help='同时测量单工位服务器的内存作为对比')
+    args = parser.parse_args()
+
+    think = tuple(float(v) for v in args.think_ms.split(','))
+    think_ms = (think[0], think[-1])
+    frame = args.frame.encode('latin-1')
+    image = os.urandom(args.image_kb * 1024)
+    run_id = datetime.now().strftime('%H%M%S')
+    station_ids = [f'line{i + 1}' for i in range(args.stations)]
+    intervals = [60.0 / args.rate] * args.boards
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    line_stats = [LineStats() for _ in station_ids]
+    plcs = []
+    clients = []
+    server = None
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            baseline = measure_baseline(work_dir, args.workers) if args.baseline else None
+            plcs = [PtyPLC(stats.on_release) for stats in line_stats]
+            config = write_config(work_dir, station_ids, plcs)
+            server = SubprocessServer(None, args.workers, {'ML_SCANNER_STATIONS': str(config)})
+            wait_stations_ready(server.base_url, len(station_ids))
+            for station_id, stats in zip(station_ids, line_stats):
+                for i in range(args.clients_per_station):
+                    clients.append(InspectionClient(server.base_url, stats, image, think_ms, args.defect_rate,
+                                                    f'{station_id}-client-{i}', station=station_id))
+
+            print(f"模拟 {len(station_ids)} 条产线 x {args.boards} 块板，每条 {args.rate:g} 块/分钟，"
+                  f"每个工位 {args.clients_per_station} 个客户端，服务器: {server.base_url}")
+            started = time.monotonic()
+            lines = [threading.Thread(target=drive_line,
+                                      args=(plc, stats, intervals, args.scan_delay, frame, f'{run_id}{station_id}',
+                                            Path(work_dir) / 'input' / f'{station_id}.txt'))
+                     for station_id, plc, stats in zip(station_ids, plcs, line_stats)]
+            for line in lines:
+                line.start()
+            for line in lines:
+                line.join()
+            settle_deadline = time.monotonic() + args.settle
+            while any(stats.pending() for stats in line_stats) and time.monotonic() < settle_deadline:
+                time.sleep(0.1)
+            # 等待最后的放行命令
+            time.sleep(0.5)
+            elapsed = time.monotonic() - started
+            rss_mb, threads = process_status(server.proc.pid)
+        finally:
+            for client in clients:
+                client.close()
+            if server is not None:
+                server.close()
+            for plc in plcs:
+                plc.close()
+
+    report(station_ids, line_stats, elapsed, rss_mb, threads, baseline)
+
+
+if __name__ == '__main__':
+    main()
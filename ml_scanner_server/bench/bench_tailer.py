@@ -0,0 +1,86 @@
+"""测量 FileTailer 在 input.txt 持续增长时的单次读取耗时和内存占用
+
+向临时文件逐条追加条码，每次追加后读取新增内容，按区间统计平均读取耗时和
+tracemalloc 记录的内存；增量读取的耗时和内存应与文件长度无关。--legacy
+同时测量旧的整文件读取 + 内容切片方式作为对比。
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_tailer.py --count 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'server'))
+
+from file_tailer import FileTailer  # noqa: E402
+
+
+class LegacyReader:
+    """旧实现：每次读取整个文件并保留完整副本"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.last_content = ""
+
+    def read_new(self):
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            current_content = f.read()
+        new_content = current_content[len(self.last_content):]
+        self.last_content = current_content
+        return new_content, None
+
+
+def run(reader_cls, count, buckets):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'input.txt')
+        Path(file_path).touch()
+        reader = reader_cls(file_path)
+
+        tracemalloc.start()
+        bucket_size = max(1, count // buckets)
+        rows = []
+        elapsed = 0.0
+        with open(file_path, 'a', encoding='utf-8') as writer:
+            for i in range(count):
+                barcode = f"PCB{i:010d}\n"
+                writer.write(barcode)
+                writer.flush()
+
+                start = time.perf_counter()
+                text, _ = reader.read_new()
+                elapsed += time.perf_counter() - start
+                assert text == barcode, (i, text)
+
+                if (i + 1) % bucket_size == 0:
+                    current, _peak = tracemalloc.get_traced_memory()
+                    rows.append((i + 1, os.path.getsize(file_path), elapsed / bucket_size * 1e6, current))
+                    elapsed = 0.0
+        tracemalloc.stop()
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--buckets', type=int, default=10)
+    parser.add_argument('--legacy', action='store_true', help='同时测量旧的整文件读取方式')
+    args = parser.parse_args()
+
+    readers = [('tailer', FileTailer)]
+    if args.legacy:
+        readers.append(('legacy', LegacyReader))
+
+    for name, reader_cls in readers:
+        print(f"[{name}]")
+        print(f"{'lines':>10}{'file(KB)':>12}{'read(us)':>12}{'mem(KB)':>12}")
+        for lines, size, per_read_us, mem in run(reader_cls, args.count, args.buckets):
+            print(f"{lines:>10}{size / 1024:>12.1f}{per_read_us:>12.2f}{mem / 1024:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""对比 /detection_result 的 base64 JSON 上传与二进制流式上传
+
+为每种上传方式单独启动一个服务器子进程，以指定大小的随机 JPEG 负载连续发送
+请求，统计请求延迟和服务器进程的峰值内存（/proc/<pid>/status 中的 VmHWM）。
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/bench_upload.py --sizes 500,2000,8000 --requests 30
+"""
+import argparse
+import base64
+import io
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / 'server'
+
+SERVER_SNIPPET = """
+import logging, sys
+from server import app
+logging.getLogger().setLevel(logging.WARNING)
+app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)
+"""
+
+MODES = ('json', 'raw', 'multipart')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def read_hwm_kb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return 0
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def wait_ready(base_url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + '/', timeout=0.5)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError('服务器未能启动')
+
+
+def post(session, base_url, mode, board_id, image):
+    url = base_url + '/detection_result'
+    if mode == 'json':
+        payload = {'has_defect': False, 'board_id': board_id, 'image': base64.b64encode(image).decode('ascii')}
+        return session.post(url, json=payload)
+    if mode == 'raw':
+        return session.post(url, data=io.BytesIO(image),
+                            headers={'Content-Type': 'image/jpeg', 'X-Board-Id': board_id, 'X-Has-Defect': '0'})
+    return session.post(url, data={'board_id': board_id, 'has_defect': 'false'},
+                        files={'image': (f'{board_id}.jpg', image, 'image/jpeg')})
+
+
+def run_mode(mode, size_kb, count):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, '-c', SERVER_SNIPPET, str(port)], cwd=SERVER_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_ready(base_url)
+        image = os.urandom(size_kb * 1024)
+        session = requests.Session()
+        post(session, base_url, mode, f'bench-warmup-{mode}', image[:1024]).raise_for_status()
+        baseline_kb = read_hwm_kb(proc.pid)
+
+        latencies = []
+        for i in range(count):
+            start = time.perf_counter()
+            response = post(session, base_url, mode, f'bench-{mode}-{size_kb}-{i}', image)
+            latencies.append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+        peak_kb = read_hwm_kb(proc.pid)
+        return latencies, baseline_kb, peak_kb
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='500,2000,8000', help='图片大小列表（KB）')
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--modes', default=','.join(MODES))
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'size(KB)':>9}{'p50(ms)':>10}{'p95(ms)':>10}{'mean(ms)':>10}{'RSS base(MB)':>14}{'RSS peak(MB)':>14}")
+    for size_kb in (int(s) for s in args.sizes.split(',')):
+        for mode in args.modes.split(','):
+            latencies, baseline_kb, peak_kb = run_mode(mode, size_kb, args.requests)
+            print(f"{mode:<10}{size_kb:>9}{percentile(latencies, 50):>10.1f}{percentile(latencies, 95):>10.1f}"
+                  f"{statistics.mean(latencies):>10.1f}{baseline_kb / 1024:>14.1f}{peak_kb / 1024:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
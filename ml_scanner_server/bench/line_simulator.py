@@ -0,0 +1,523 @@
+"""不需要硬件的产线模拟器：对完整检测流程做压测
+
+模拟的三个部分：
+  * PLC：--transport pty 时创建伪终端对，服务器（子进程）通过 ML_SCANNER_PLC_PORT
+    打开从端，模拟器向主端写入 '7' 到位信号并统计服务器发回的放行命令；
+    --transport loop 时在本进程内启动服务器，PLC 使用 loop:// 回环端口
+    （此时无法统计放行命令）。
+  * 扫码枪：每次触发后经过 --scan-delay 秒向 input/input.txt 追加一行条码。
+  * 检测客户端：--clients 个 Socket.IO 客户端，收到 start_detection 后用 ack
+    确认，等待 --think-ms 毫秒，再以二进制方式 POST /detection_result（图片大小
+    --image-kb）。服务器每块板只下发给一个客户端；--stall-clients 个客户端只确认
+    不返回结果，--disconnect-after 秒后第一个客户端断开，用于验证改派。
+
+触发节奏为固定速率（--rate，块/分钟），或用 --replay 从已有的 logs/server.log
+中解析触发时间间隔，按 --speed 倍速回放。结束时报告持续产能（块/分钟）、各阶段
+延迟分位数、丢失和重复的板卡，以及服务器 /metrics 中的阶段耗时。
+
+用法（在 ml_scanner_server 目录下）:
+    python bench/line_simulator.py --rate 120 --boards 100 --clients 1 --image-kb 500
+    python bench/line_simulator.py --replay logs/server.log --speed 10
+"""
+import argparse
+import io
+import os
+import random
+import re
+import select
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tty
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SERVER_DIR = BASE_DIR / 'server'
+INPUT_FILE = BASE_DIR / 'input' / 'input.txt'
+
+RELEASE_BYTE = 0x08
+
+# 日志中表示收到或模拟发送 '7' 信号的行
+TRIGGER_LOG_PATTERN = re.compile(
+    r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) .*(检测到'7'信号|模拟PLC发送检测信号|模拟PLC发送'7'信号)")
+LOG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S,%f'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def load_replay_intervals(log_path, speed, max_gap):
+    """从日志中解析相邻两次触发的时间间隔（秒），超过 max_gap 的间隔视为服务重启而跳过"""
+    stamps = []
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            match = TRIGGER_LOG_PATTERN.match(line)
+            if match:
+                stamps.append(datetime.strptime(match.group(1), LOG_TIME_FORMAT).timestamp())
+    intervals = [b - a for a, b in zip(stamps, stamps[1:]) if 0 <= b - a <= max_gap]
+    return [interval / speed for interval in intervals]
+
+
+class PtyPLC:
+    """伪终端上的模拟PLC：主端写入触发信号，读取服务器发回的放行命令"""
+
+    def __init__(self, on_release):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.on_release = on_release
+        self.running = True
+        self.thread = threading.Thread(target=self._read, name="SimPLCReader", daemon=True)
+        self.thread.start()
+
+    def trigger(self, frame):
+        os.write(self.master, frame)
+
+    def _read(self):
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.2)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master, 256)
+            except OSError:
+                # 服务器关闭从端时主端读取会返回 EIO
+                time.sleep(0.05)
+                continue
+            now = time.monotonic()
+            for byte in data:
+                if byte == RELEASE_BYTE:
+                    self.on_release(now)
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class LoopPLC:
+    """本进程内服务器的 loop:// 回环端口：写入的数据由服务器自己的读取线程读到"""
+
+    def __init__(self, plc_manager):
+        self.plc_manager = plc_manager
+
+    def trigger(self, frame):
+        self.plc_manager.serial_port.write(frame)
+
+    def close(self):
+        pass
+
+
+class Board:
+    __slots__ = ("barcode", "triggered_at", "scanned_at", "emitted", "posted_at", "results", "released_at")
+
+    def __init__(self, barcode, triggered_at):
+        self.barcode = barcode
+        self.triggered_at = triggered_at
+        self.scanned_at = None
+        self.emitted = []
+        self.posted_at = None
+        self.results = []
+        self.released_at = None
+
+
+class LineStats:
+    """按条码记录每块板在各阶段的时间"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.boards = {}
+        self.order = []
+        self.unknown_payloads = []
+        self.errors = []
+        self.releases = 0
+        self.awaiting_release = []
+
+    def add_board(self, board):
+        with self.lock:
+            self.boards[board.barcode] = board
+            self.order.append(board)
+
+    def on_scanned(self, barcode, at):
+        with self.lock:
+            self.boards[barcode].scanned_at = at
+
+    def on_emitted(self, barcode, at):
+        with self.lock:
+            board = self.boards.get(barcode)
+            if board is None:
+                self.unknown_payloads.append(barcode)
+                return False
+            board.emitted.append(at)
+            return True
+
+    def on_posting(self, barcode, at):
+        """放行命令在服务器返回响应之前发出，因此按开始上传的顺序等待放行"""
+        with self.lock:
+            board = self.boards[barcode]
+            if board.posted_at is None:
+                board.posted_at = at
+                self.awaiting_release.append(board)
+
+    def on_result(self, barcode, at):
+        with self.lock:
+            self.boards[barcode].results.append(at)
+
+    def on_error(self, error):
+        with self.lock:
+            self.errors.append(error)
+
+    def on_release(self, at):
+        """放行命令不带板号，按开始上传的顺序对应"""
+        with self.lock:
+            self.releases += 1
+            if self.awaiting_release:
+                self.awaiting_release.pop(0).released_at = at
+
+    def pending(self):
+        with self.lock:
+            return sum(1 for board in self.order if board.scanned_at is not None and not board.results)
+
+
+class InspectionClient:
+    """模拟检测客户端：收到 start_detection 后按思考时间上传检测结果"""
+
+    def __init__(self, base_url, stats, image, think_ms, defect_rate, name, stalled=False, station=None):
+        import socketio
+        self.base_url = base_url
+        self.stats = stats
+        self.image = image
+        self.think_ms = think_ms
+        self.defect_rate = defect_rate
+        self.name = name
+        self.stalled = stalled
+        self.station = station
+        self.connected = True
+        self.received = 0
+        self.answered = 0
+        self.session = requests.Session()
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('start_detection', self._on_start_detection)
+        # 每块板卡的结果在独立线程中上传，可以同时处理两块；start_detection 的返回值作为 ack
+        auth = {'name': name, 'pipeline': 2, 'acks': True}
+        if station is not None:
+            auth['station'] = station
+        self.client.connect(base_url, auth=auth, wait_timeout=5)
+
+    def _on_start_detection(self, data):
+        received_at = time.monotonic()
+        barcode = data.get('data')
+        self.received += 1
+        if self.stats.on_emitted(barcode, received_at) and not self.stalled:
+            threading.Thread(target=self._answer, args=(barcode, data.get('cycle_id')), daemon=True).start()
+        # 返回值作为 Socket.IO ack 发回服务器
+        return True
+
+    def _answer(self, barcode, cycle_id):
+        low, high = self.think_ms
+        time.sleep(random.uniform(low, high) / 1000.0)
+        headers = {
+            'Content-Type': 'image/jpeg',
+            'X-Board-Id': barcode,
+            'X-Has-Defect': '1' if random.random() < self.defect_rate else '0',
+        }
+        if cycle_id is not None:
+            headers['X-Cycle-Id'] = str(cycle_id)
+        if self.station is not None:
+            headers['X-Station-Id'] = self.station
+        if not self.connected:
+            return
+        self.answered += 1
+        self.stats.on_posting(barcode, time.monotonic())
+        try:
+            response = self.session.post(self.base_url + '/detection_result', data=io.BytesIO(self.image),
+                                         headers=headers, timeout=30)
+            if response.status_code == 200:
+                self.stats.on_result(barcode, time.monotonic())
+            else:
+                self.stats.on_error(response.status_code)
+        except requests.RequestException as e:
+            self.stats.on_error(type(e).__name__)
+
+    def close(self):
+        self.connected = False
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+class SubprocessServer:
+    """以子进程方式运行 server.py，PLC 端口指向模拟PLC的伪终端"""
+
+    def __init__(self, plc_port, workers, env_overrides):
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        env = dict(os.environ, **env_overrides)
+        if plc_port is not None:
+            env['ML_SCANNER_PLC_PORT'] = plc_port
+        self.proc = subprocess.Popen([sys.executable, 'server.py', '--mode', 'threaded', '--host', '127.0.0.1',
+                                      '--port', str(self.port), '--workers', str(workers)],
+                                     cwd=SERVER_DIR, env=env, start_new_session=True,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def close(self):
+        os.killpg(self.proc.pid, signal.SIGTERM)
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+            self.proc.wait()
+
+
+class InProcessServer:
+    """在本进程内运行服务器，PLC 使用 loop:// 回环端口"""
+
+    def __init__(self, workers, env_overrides):
+        os.environ['ML_SCANNER_PLC_PORT'] = 'loop://'
+        os.environ.update(env_overrides)
+        sys.path.insert(0, str(SERVER_DIR))
+        import server
+        from serving import PooledWSGIServer
+        self.module = server
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.httpd = PooledWSGIServer('127.0.0.1', self.port, server.app, workers=workers)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="SimServer", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.httpd.drain(5)
+        self.module.shutdown_services()
+
+
+def wait_ready(base_url, timeout=20):
+    """等待服务器可以访问并且PLC已连接"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + '/plc/stats', timeout=0.5).json().get('connected'):
+                return
+        except (requests.ConnectionError, ValueError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('服务器未能启动或PLC未连接')
+
+
+def drive_line(plc, stats, intervals, scan_delay, frame, run_id, input_file=INPUT_FILE):
+    """按触发间隔驱动产线：PLC 发 '7'，扫码枪延迟 scan_delay 秒后写入条码"""
+    timers = []
+    next_at = time.monotonic()
+    for seq, interval in enumerate(intervals):
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        barcode = f'SIM{run_id}{seq:06d}'
+        board = Board(barcode, time.monotonic())
+        stats.add_board(board)
+        plc.trigger(frame)
+
+        def scan(barcode=barcode):
+            with open(input_file, 'a', encoding='utf-8') as f:
+                f.write(barcode + '\n')
+            stats.on_scanned(barcode, time.monotonic())
+
+        timer = threading.Timer(scan_delay, scan)
+        timer.start()
+        timers.append(timer)
+        next_at += interval
+    for timer in timers:
+        timer.join()
+
+
+def fetch_client_stats(base_url):
+    try:
+        return requests.get(base_url + '/clients', timeout=5).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def fetch_server_quantiles(base_url):
+    """从 /metrics 中取出服务器记录的各阶段耗时分位数"""
+    quantiles = {}
+    try:
+        text = requests.get(base_url + '/metrics', timeout=5).text
+    except requests.RequestException:
+        return quantiles
+    pattern = re.compile(r'^ml_scanner_stage_latency_recent_seconds\{stage="([^"]+)",quantile="([^"]+)"(?:,station="[^"]*")?\} (\S+)$')
+    for line in text.splitlines():
+        match = pattern.match(line)
+        if match:
+            stage, q, value = match.groups()
+            quantiles.setdefault(stage, {})[q] = float(value)
+    return quantiles
+
+
+def report(stats, elapsed, has_release_counter, server_quantiles, clients, client_stats):
+    boards = stats.order
+    scanned = [b for b in boards if b.scanned_at is not None]
+    completed = [b for b in boards if b.results]
+    dropped = [b for b in scanned if not b.results]
+    duplicate_emits = sum(1 for b in boards if len(b.emitted) > 1)
+    duplicate_results = sum(1 for b in boards if len(b.results) > 1)
+    finished_at = max((b.results[0] for b in completed), default=None)
+    span = (finished_at - boards[0].triggered_at) if completed else elapsed
+
+    print(f"触发: {len(boards)}  扫码: {len(scanned)}  完成: {len(completed)}  丢失: {len(dropped)}  "
+          f"重复下发: {duplicate_emits}  重复结果: {duplicate_results}  无法识别的条码: {len(stats.unknown_payloads)}  "
+          f"请求错误: {len(stats.errors)}")
+    if has_release_counter:
+        print(f"放行命令: {stats.releases}")
+    if span > 0:
+        print(f"持续产能: {len(completed) / span * 60:.1f} 块/分钟（{span:.1f} 秒）")
+    if stats.unknown_payloads:
+        samples = [payload if len(payload) <= 64 else payload[:64] + '...' for payload in stats.unknown_payloads[:3]]
+        print(f"无法识别的条码示例（多个条码被合并读取）: {samples}")
+
+    stages = [
+        ('trigger->scan', lambda b: b.scanned_at and b.scanned_at - b.triggered_at),
+        ('scan->start_detection', lambda b: b.emitted and b.scanned_at and b.emitted[0] - b.scanned_at),
+        ('start_detection->post', lambda b: b.posted_at and b.emitted and b.posted_at - b.emitted[0]),
+        ('post->response', lambda b: b.results and b.posted_at and b.results[0] - b.posted_at),
+    ]
+    if has_release_counter:
+        stages.append(('post->release', lambda b: b.released_at and b.released_at - b.posted_at))
+        stages.append(('trigger->release', lambda b: b.released_at and b.released_at - b.triggered_at))
+    else:
+        stages.append(('trigger->result', lambda b: b.results and b.results[0] - b.triggered_at))
+
+    print(f"\n{'stage':<26}{'n':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for name, extract in stages:
+        values = [v * 1000 for v in (extract(b) for b in boards) if isinstance(v, float)]
+        if not values:
+            print(f"{name:<26}{0:>6}")
+            continue
+        print(f"{name:<26}{len(values):>6}{statistics.median(values):>10.1f}{percentile(values, 95):>10.1f}"
+              f"{percentile(values, 99):>10.1f}{max(values):>10.1f}")
+
+    if client_stats:
+        server_clients = {c['name']: c for c in client_stats['clients']}
+        print(f"\n{'client':<14}{'received':>10}{'answered':>10}{'completed':>11}{'reassigned':>12}"
+              f"{'ack_p50':>9}{'insp_p50':>10}")
+        for client in clients:
+            c = server_clients.get(client.name, {})
+            print(f"{client.name:<14}{client.received:>10}{client.answered:>10}{c.get('completed', '-'):>11}"
+                  f"{c.get('reassigned', '-'):>12}{str(c.get('ack_p50_ms', '-')):>9}{str(c.get('inspect_p50_ms', '-')):>10}")
+        print(f"服务器分配统计: {client_stats['stats']}")
+
+    if server_quantiles:
+        print(f"\n服务器 /metrics（最近周期）")
+        print(f"{'stage':<40}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+        for stage, values in sorted(server_quantiles.items()):
+            cells = ''.join(f"{values.get(q, float('nan')) * 1000:>10.1f}" for q in ('0.5', '0.95', '0.99'))
+            print(f"{stage:<40}{cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transport', choices=('pty', 'loop'), default='pty')
+    parser.add_argument('--rate', type=float, default=60.0, help='触发速率（块/分钟）')
+    parser.add_argument('--boards', type=int, default=50, help='固定速率时的板卡数')
+    parser.add_argument('--replay', help='从该日志文件回放触发时间间隔，代替 --rate/--boards')
+    parser.add_argument('--speed', type=float, default=1.0, help='回放倍速')
+    parser.add_argument('--max-gap', type=float, default=60.0, help='回放时忽略超过该秒数的间隔')
+    parser.add_argument('--limit', type=int, help='回放时最多模拟的板卡数')
+    parser.add_argument('--scan-delay', type=float, default=0.05, help='触发到扫码枪写入条码的秒数')
+    parser.add_argument('--clients', type=int, default=1, help='Socket.IO 检测客户端数')
+    parser.add_argument('--stall-clients', type=int, default=0, help='只确认、不返回结果的客户端数')
+    parser.add_argument('--disconnect-after', type=float, help='第一个客户端在开始后多少秒断开')
+    parser.add_argument('--policy', choices=('least_loaded', 'round_robin'), default='least_loaded',
+                        help='服务器的客户端分配策略')
+    parser.add_argument('--inspect-timeout', type=float, default=3.0, help='服务器改派未返回结果的板卡的秒数')
+    parser.add_argument('--image-kb', type=int, default=500, help='上传图片大小（KB）')
+    parser.add_argument('--think-ms', default='50,150', help='客户端检测耗时范围（毫秒），如 50,150')
+    parser.add_argument('--defect-rate', type=float, default=0.1, help='判为有缺陷的比例')
+    parser.add_argument('--settle', type=float, default=10.0, help='最后一次触发后等待未完成板卡的秒数')
+    parser.add_argument('--workers', type=int, default=32, help='服务器工作线程数')
+    parser.add_argument('--frame', default='7  ', help="PLC触发数据，默认为现场PLC的 '7  '")
+    args = parser.parse_args()
+
+    if args.replay:
+        intervals = load_replay_intervals(args.replay, args.speed, args.max_gap)
+        if not intervals:
+            parser.error(f'{args.replay} 中没有找到触发记录')
+        if args.limit:
+            intervals = intervals[:args.limit - 1]
+        intervals.append(0.0)
+    else:
+        intervals = [60.0 / args.rate] * args.boards
+    think = tuple(float(v) for v in args.think_ms.split(','))
+    think_ms = (think[0], think[-1])
+    frame = args.frame.encode('latin-1')
+    image = os.urandom(args.image_kb * 1024)
+    run_id = datetime.now().strftime('%H%M%S')
+
+    # 被 SIGTERM 结束时也要执行清理，恢复 input.txt 并关闭服务器
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    stats = LineStats()
+    env_overrides = {'ML_SCANNER_DISPATCH_POLICY': args.policy,
+                     'ML_SCANNER_INSPECT_TIMEOUT': str(args.inspect_timeout)}
+    original_input = INPUT_FILE.read_bytes() if INPUT_FILE.exists() else b''
+    server = plc = None
+    clients = []
+    try:
+        if args.transport == 'pty':
+            plc = PtyPLC(stats.on_release)
+            server = SubprocessServer(plc.port, args.workers, env_overrides)
+        else:
+            server = InProcessServer(args.workers, env_overrides)
+        wait_ready(server.base_url)
+        if plc is None:
+            plc = LoopPLC(server.module.get_station().plc_manager)
+        clients = [InspectionClient(server.base_url, stats, image, think_ms, args.defect_rate,
+                                    f'sim-client-{i}', stalled=i >= args.clients - args.stall_clients)
+                   for i in range(args.clients)]
+        if args.disconnect_after is not None:
+            threading.Timer(args.disconnect_after, clients[0].close).start()
+
+        print(f"模拟 {len(intervals)} 块板，传输: {args.transport}，客户端: {args.clients}，"
+              f"图片: {args.image_kb} KB，服务器: {server.base_url}")
+        started = time.monotonic()
+        drive_line(plc, stats, intervals, args.scan_delay, frame, run_id)
+        settle_deadline = time.monotonic() + args.settle
+        while stats.pending() and time.monotonic() < settle_deadline:
+            time.sleep(0.1)
+        # 等待最后的放行命令
+        time.sleep(0.5)
+        elapsed = time.monotonic() - started
+        server_quantiles = fetch_server_quantiles(server.base_url)
+        client_stats = fetch_client_stats(server.base_url)
+    finally:
+        for client in clients:
+            client.close()
+        if server is not None:
+            server.close()
+        if plc is not None:
+            plc.close()
+        INPUT_FILE.write_bytes(original_input)
+
+    report(stats, elapsed, args.transport == 'pty', server_quantiles, clients, client_stats)
+
+
+if __name__ == '__main__':
+    main()
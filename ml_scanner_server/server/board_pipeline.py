@@ -0,0 +1,347 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from logger_config import get_logger
+
+logger = get_logger("BoardPipeline")
+
+# 板卡任务状态
+JOB_SCANNED = "scanned"            # 已读到条码，等待PLC触发或等待空闲的检测位
+JOB_DISPATCHED = "dispatched"      # start_detection 已发出，等待检测结果
+JOB_RESULT = "result_received"     # 已收到检测结果，等待前面的板卡放行
+JOB_RELEASED = "released"          # 放行命令已交给PLC线程
+JOB_TIMED_OUT = "timed_out"        # 超时未收到检测结果，按不合格放行
+JOB_DROPPED = "dropped"            # 未配对（只有条码没有触发）或队列溢出被丢弃
+
+# 同时等待检测结果的板卡数
+DEFAULT_MAX_INFLIGHT = 1
+# 未下发的板卡和未配对的触发各自最多保留的数量
+DEFAULT_MAX_PENDING = 32
+# 条码与触发互相等待的最长时间
+DEFAULT_PAIR_TIMEOUT = 30.0
+# 下发后等待检测结果的最长时间
+DEFAULT_RESULT_TIMEOUT = 30.0
+# 已放行的任务保留一段时间，用于识别重复的检测结果
+RECENT_JOBS = 256
+
+
+class BoardJob:
+    """一块板卡；signalled 在放行命令发送到PLC后由 release 回调的调用方完成"""
+
+    __slots__ = ("job_id", "board_id", "cycle_id", "state", "scanned_at", "triggered_at",
+                 "dispatched_at", "result_at", "released_at", "has_defect", "signalled")
+
+    def __init__(self, job_id, board_id, scanned_at):
+        self.job_id = job_id
+        self.board_id = board_id
+        self.cycle_id = None
+        self.state = JOB_SCANNED
+        self.scanned_at = scanned_at
+        self.triggered_at = None
+        self.dispatched_at = None
+        self.result_at = None
+        self.released_at = None
+        self.has_defect = None
+        self.signalled = Future()
+
+    @property
+    def paired(self):
+        return self.triggered_at is not None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "board_id": self.board_id,
+            "cycle_id": self.cycle_id,
+            "state": self.state,
+            "has_defect": self.has_defect,
+        }
+
+
+class BoardPipeline:
+    """常驻的板卡流水线：扫码与PLC触发按先进先出配对，逐块下发检测并按顺序放行
+
+    扫码枪每读到一行条码调用 on_scan()，PLC '7' 信号调用 on_trigger()，两者先到
+    的一方排队等待另一方。配对后的板卡在检测中的数量少于 max_inflight 时通过
+    dispatch(job) 下发；收到检测结果后，队首连续已有结果的板卡依次通过
+    release(job) 放行，保证放行顺序与板卡在传送带上的顺序一致。后台线程处理
+    配对超时和检测超时，检测超时的板卡通过 on_timeout(job) 通知调用方，并在
+    原来的位置按不合格（has_defect=True）放行：PLC放行信号不带板号、按顺序
+    对应治具中的板卡，不能跳过它先放行后面的板卡。
+    dispatch/release 回调在锁外按顺序调用。
+    """
+
+    def __init__(self, dispatch, release, max_inflight=DEFAULT_MAX_INFLIGHT, max_pending=DEFAULT_MAX_PENDING,
+                 pair_timeout=DEFAULT_PAIR_TIMEOUT, result_timeout=DEFAULT_RESULT_TIMEOUT, check_interval=0.5,
+                 on_timeout=None):
+        self.dispatch = dispatch
+        self.release = release
+        self.on_timeout = on_timeout
+        self.max_inflight = max_inflight
+        self.max_pending = max_pending
+        self.pair_timeout = pair_timeout
+        self.result_timeout = result_timeout
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # 保证回调按状态变化的顺序执行；可重入，回调中可以再调用流水线
+        self._callback_lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._jobs = deque()
+        self._triggers = deque()
+        self._recent = OrderedDict()
+        self._counters = {
+            "scans": 0, "triggers": 0, "dispatched": 0, "results": 0, "released": 0,
+            "duplicate_results": 0, "late_results": 0, "unknown_results": 0, "timed_out": 0,
+            "dropped_scans": 0, "dropped_triggers": 0,
+        }
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch_timeouts, name="BoardPipeline", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        with self._lock:
+            pending = len(self._jobs)
+        if pending:
+            logger.warning(f"关闭流水线时仍有 {pending} 块板卡未放行")
+
+    def set_max_inflight(self, max_inflight):
+        """调整同时检测的板卡数（例如检测客户端数量变化时），放宽后立即下发排队的板卡"""
+        with self._callback_lock:
+            with self._lock:
+                self.max_inflight = max(1, max_inflight)
+                to_dispatch = self._collect_dispatch()
+            self._run_dispatch(to_dispatch)
+
+    def on_trigger(self, cycle_id, at=None):
+        """PLC 到位信号：与最早一个未配对的条码配对，没有时排队等待条码"""
+        at = time.monotonic() if at is None else at
+        with self._callback_lock:
+            with self._lock:
+                self._counters["triggers"] += 1
+                job = next((j for j in self._jobs if j.state == JOB_SCANNED and not j.paired), None)
+                if job is not None:
+                    self._pair(job, cycle_id, at)
+                else:
+                    if len(self._triggers) >= self.max_pending:
+                        dropped_cycle, _ = self._triggers.popleft()
+                        self._counters["dropped_triggers"] += 1
+                        logger.warning(f"未配对的触发过多，丢弃最早的触发 - 周期: {dropped_cycle}")
+                    self._triggers.append((cycle_id, at))
+                    logger.info(f"触发等待条码 - 周期: {cycle_id}, 等待中的触发: {len(self._triggers)}")
+                to_dispatch = self._collect_dispatch()
+            self._run_dispatch(to_dispatch)
+
+    def on_scan(self, board_id, at=None):
+        """读到一个条码：与最早一个未配对的触发配对，没有时排队等待触发"""
+        at = time.monotonic() if at is None else at
+        with self._callback_lock:
+            with self._lock:
+                self._counters["scans"] += 1
+                waiting = [j for j in self._jobs if j.state == JOB_SCANNED]
+                if len(waiting) >= self.max_pending:
+                    # 优先丢弃还没配对的条码（多半是误读），其次是最早的板卡
+                    victim = next((j for j in waiting if not j.paired), waiting[0])
+                    self._drop(victim, "等待下发的板卡过多")
+                job = BoardJob(next(self._ids), board_id, at)
+                self._jobs.append(job)
+                if self._triggers:
+                    cycle_id, triggered_at = self._triggers.popleft()
+                    self._pair(job, cycle_id, triggered_at)
+                else:
+                    logger.info(f"条码等待触发 - 板号: {board_id}, 任务: {job.job_id}")
+                to_dispatch = self._collect_dispatch()
+            self._run_dispatch(to_dispatch)
+            return job
+
+    def on_result(self, board_id, has_defect, cycle_id=None, at=None):
+        """收到检测结果，返回 (任务, 是否为新结果)；找不到对应任务时返回 (None, False)
+
+        优先按周期 id 查找，其次按板号查找最早一个等待结果的任务。
+        """
+        at = time.monotonic() if at is None else at
+        with self._callback_lock:
+            with self._lock:
+                job = self._find(board_id, cycle_id)
+                if job is None:
+                    self._counters["unknown_results"] += 1
+                    return None, False
+                if job.state == JOB_TIMED_OUT:
+                    self._counters["late_results"] += 1
+                    logger.warning(f"检测结果在超时之后才到达，板卡已按不合格放行 - 板号: {board_id}, 任务: {job.job_id}")
+                    return job, False
+                if job.state == JOB_DROPPED:
+                    self._counters["late_results"] += 1
+                    logger.warning(f"检测结果对应的板卡已被丢弃，不放行 - 板号: {board_id}, 任务: {job.job_id}")
+                    return job, False
+                if job.state != JOB_DISPATCHED:
+                    self._counters["duplicate_results"] += 1
+                    logger.warning(f"重复的检测结果 - 板号: {board_id}, 任务: {job.job_id}, 状态: {job.state}")
+                    return job, False
+                job.state = JOB_RESULT
+                job.result_at = at
+                job.has_defect = has_defect
+                self._counters["results"] += 1
+                to_release = self._collect_release()
+                to_dispatch = self._collect_dispatch()
+            self._run_release(to_release)
+            self._run_dispatch(to_dispatch)
+            return job, True
+
+    def _pair(self, job, cycle_id, triggered_at):
+        """调用方持有锁"""
+        job.cycle_id = cycle_id
+        job.triggered_at = triggered_at
+        logger.info(f"条码与触发配对 - 板号: {job.board_id}, 任务: {job.job_id}, 周期: {cycle_id}")
+
+    def _find(self, board_id, cycle_id):
+        """调用方持有锁"""
+        if cycle_id is not None:
+            for job in self._jobs:
+                if job.cycle_id == cycle_id:
+                    return job
+            job = self._recent.get(("cycle", cycle_id))
+            if job is not None:
+                return job
+        for job in self._jobs:
+            if job.board_id == board_id and job.state == JOB_DISPATCHED:
+                return job
+        for job in self._jobs:
+            if job.board_id == board_id and job.state in (JOB_RESULT, JOB_RELEASED, JOB_TIMED_OUT):
+                return job
+        return self._recent.get(("board", board_id))
+
+    def _collect_dispatch(self):
+        """按顺序取出可以下发的板卡（调用方持有锁）"""
+        inflight = sum(1 for j in self._jobs if j.state == JOB_DISPATCHED)
+        to_dispatch = []
+        for job in self._jobs:
+            if inflight >= self.max_inflight:
+                break
+            if job.state == JOB_SCANNED:
+                if not job.paired:
+                    break
+                job.state = JOB_DISPATCHED
+                job.dispatched_at = time.monotonic()
+                self._counters["dispatched"] += 1
+                inflight += 1
+                to_dispatch.append(job)
+        return to_dispatch
+
+    def _collect_release(self):
+        """取出队首连续已有检测结果或检测超时的板卡（调用方持有锁）"""
+        to_release = []
+        while self._jobs and self._jobs[0].state in (JOB_RESULT, JOB_TIMED_OUT):
+            job = self._jobs.popleft()
+            # 超时的板卡保持 timed_out 状态，之后到达的检测结果按迟到处理
+            if job.state == JOB_RESULT:
+                job.state = JOB_RELEASED
+            job.released_at = time.monotonic()
+            self._counters["released"] += 1
+            self._remember(job)
+            to_release.append(job)
+        return to_release
+
+    def _remember(self, job):
+        self._recent[("board", job.board_id)] = job
+        if job.cycle_id is not None:
+            self._recent[("cycle", job.cycle_id)] = job
+        while len(self._recent) > RECENT_JOBS * 2:
+            self._recent.popitem(last=False)
+
+    def _drop(self, job, reason):
+        """调用方持有锁"""
+        self._jobs.remove(job)
+        job.state = JOB_DROPPED
+        self._counters["dropped_scans"] += 1
+        # 记住被丢弃的板卡，之后到达的检测结果按迟到处理，不会被当作未知结果
+        self._remember(job)
+        logger.warning(f"{reason}，丢弃板卡 - 板号: {job.board_id}, 任务: {job.job_id}")
+
+    def _run_dispatch(self, jobs):
+        for job in jobs:
+            logger.info(f"下发检测 - 板号: {job.board_id}, 任务: {job.job_id}, 周期: {job.cycle_id}")
+            try:
+                self.dispatch(job)
+            except Exception as e:
+                logger.error(f"下发检测失败 - 板号: {job.board_id}: {e}", exc_info=True)
+
+    def _run_release(self, jobs):
+        for job in jobs:
+            logger.info(f"放行板卡 - 板号: {job.board_id}, 任务: {job.job_id}, "
+                        f"结果: {'NG' if job.has_defect else 'OK'}")
+            try:
+                self.release(job)
+            except Exception as e:
+                logger.error(f"放行板卡失败 - 板号: {job.board_id}: {e}", exc_info=True)
+
+    def _watch_timeouts(self):
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self.check_timeouts()
+            except Exception as e:
+                logger.error(f"检查流水线超时出错: {e}", exc_info=True)
+
+    def check_timeouts(self, now=None):
+        """丢弃配对超时的条码和触发，检测超时的板卡在原位置按不合格放行"""
+        now = time.monotonic() if now is None else now
+        timed_out = []
+        with self._callback_lock:
+            with self._lock:
+                while self._triggers and now - self._triggers[0][1] > self.pair_timeout:
+                    cycle_id, _ = self._triggers.popleft()
+                    self._counters["dropped_triggers"] += 1
+                    logger.warning(f"触发后超过 {self.pair_timeout} 秒未读到条码，丢弃 - 周期: {cycle_id}")
+                for job in list(self._jobs):
+                    if job.state == JOB_SCANNED and not job.paired and now - job.scanned_at > self.pair_timeout:
+                        self._drop(job, f"条码超过 {self.pair_timeout} 秒未收到PLC触发")
+                    elif job.state == JOB_DISPATCHED and now - job.dispatched_at > self.result_timeout:
+                        job.state = JOB_TIMED_OUT
+                        job.result_at = now
+                        job.has_defect = True
+                        self._counters["timed_out"] += 1
+                        timed_out.append(job)
+                        logger.error(f"超过 {self.result_timeout} 秒未收到检测结果，板卡按不合格放行 - "
+                                     f"板号: {job.board_id}, 任务: {job.job_id}")
+                to_release = self._collect_release()
+                to_dispatch = self._collect_dispatch()
+            if self.on_timeout:
+                for job in timed_out:
+                    try:
+                        self.on_timeout(job)
+                    except Exception as e:
+                        logger.error(f"处理检测超时出错 - 板号: {job.board_id}: {e}", exc_info=True)
+            self._run_release(to_release)
+            self._run_dispatch(to_dispatch)
+
+    def stats(self):
+        with self._lock:
+            states = {JOB_SCANNED: 0, JOB_DISPATCHED: 0, JOB_RESULT: 0, JOB_TIMED_OUT: 0}
+            for job in self._jobs:
+                states[job.state] += 1
+            result = dict(self._counters)
+            result.update({
+                "waiting": states[JOB_SCANNED],
+                "inflight": states[JOB_DISPATCHED],
+                "awaiting_release": states[JOB_RESULT] + states[JOB_TIMED_OUT],
+                "unmatched_triggers": len(self._triggers),
+            })
+            return result
+
+    def snapshot(self):
+        """队列中的板卡（按顺序）和等待条码的触发"""
+        with self._lock:
+            return {
+                "jobs": [job.to_dict() for job in self._jobs],
+                "unmatched_triggers": [cycle_id for cycle_id, _ in self._triggers],
+            }
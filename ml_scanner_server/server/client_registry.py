@@ -0,0 +1,340 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from logger_config import get_logger
+
+logger = get_logger("ClientRegistry")
+
+POLICY_LEAST_LOADED = "least_loaded"
+POLICY_ROUND_ROBIN = "round_robin"
+POLICIES = (POLICY_LEAST_LOADED, POLICY_ROUND_ROBIN)
+
+# 声明支持确认的客户端收到 start_detection 后确认（Socket.IO ack）的最长等待时间
+DEFAULT_ACK_TIMEOUT = 5.0
+# 下发后等待检测结果的最长时间，超时后改派给其他客户端
+DEFAULT_INSPECT_TIMEOUT = 15.0
+# 每块板卡最多下发的次数
+DEFAULT_MAX_ATTEMPTS = 3
+# 每个客户端同时处理的板卡数：客户端只保存当前一块板卡的板号，声明支持流水线后才能提高
+DEFAULT_CLIENT_INFLIGHT = 1
+# 统计延迟分位数使用的最近样本数
+LATENCY_WINDOW = 256
+# 计算吞吐量的时间窗口（秒）
+THROUGHPUT_WINDOW = 60.0
+
+
+def _quantile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class InspectionClient:
+    __slots__ = ("sid", "name", "connected_at", "order", "max_inflight", "acks", "inflight", "dispatched",
+                 "acked", "completed", "reassigned", "ack_latency", "inspect_latency", "completions")
+
+    def __init__(self, sid, name, order, max_inflight=DEFAULT_CLIENT_INFLIGHT, acks=False):
+        self.sid = sid
+        self.name = name
+        self.connected_at = time.time()
+        self.order = order
+        self.max_inflight = max(1, int(max_inflight))
+        self.acks = acks
+        self.inflight = set()
+        self.dispatched = 0
+        self.acked = 0
+        self.completed = 0
+        self.reassigned = 0
+        self.ack_latency = deque(maxlen=LATENCY_WINDOW)
+        self.inspect_latency = deque(maxlen=LATENCY_WINDOW)
+        self.completions = deque()
+
+    def stats(self, now):
+        while self.completions and now - self.completions[0] > THROUGHPUT_WINDOW:
+            self.completions.popleft()
+        ms = lambda v: None if v is None else round(v * 1000, 1)  # noqa: E731
+        return {
+            "sid": self.sid,
+            "name": self.name,
+            "connected_at": self.connected_at,
+            "max_inflight": self.max_inflight,
+            "acks": self.acks,
+            "inflight": len(self.inflight),
+            "dispatched": self.dispatched,
+            "acked": self.acked,
+            "completed": self.completed,
+            "reassigned": self.reassigned,
+            "boards_per_minute": len(self.completions) * 60.0 / THROUGHPUT_WINDOW,
+            "ack_p50_ms": ms(_quantile(self.ack_latency, 0.5)),
+            "inspect_p50_ms": ms(_quantile(self.inspect_latency, 0.5)),
+            "inspect_p95_ms": ms(_quantile(self.inspect_latency, 0.95)),
+        }
+
+
+class Assignment:
+    __slots__ = ("job_id", "payload", "sid", "attempt", "sent_at", "acked_at", "tried")
+
+    def __init__(self, job_id, payload):
+        self.job_id = job_id
+        self.payload = payload
+        self.sid = None
+        self.attempt = 0
+        self.sent_at = None
+        self.acked_at = None
+        self.tried = set()
+
+
+class ClientRegistry:
+    """检测客户端登记表：每块板卡只下发给一个客户端
+
+    客户端连接时 register()（max_inflight 为它能同时处理的板卡数，acks 表示它会用
+    Socket.IO ack 确认收到 start_detection），断开时 unregister()。submit() 按策略
+    在还有空位的客户端中选择（least_loaded：进行中的板卡最少；round_robin：轮流），
+    通过 send(sid, payload, on_ack) 发送。声明了 acks 的客户端未在 ack_timeout 内
+    确认、未在 inspect_timeout 内返回结果或客户端断开时，板卡改派给其他客户端，
+    最多下发 max_attempts 次。没有客户端在线或所有客户端都没有空位时板卡排队，
+    客户端连接、返回结果或改派腾出空位后再下发，不会超过客户端的 max_inflight。
+    ack_timeout 为 None 时所有客户端都不要求确认。
+    """
+
+    def __init__(self, send, policy=POLICY_LEAST_LOADED, ack_timeout=DEFAULT_ACK_TIMEOUT,
+                 inspect_timeout=DEFAULT_INSPECT_TIMEOUT, max_attempts=DEFAULT_MAX_ATTEMPTS, check_interval=0.2):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的分配策略: {policy}")
+        self.send = send
+        self.policy = policy
+        self.ack_timeout = ack_timeout
+        self.inspect_timeout = inspect_timeout
+        self.max_attempts = max_attempts
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+        self._assignments = {}
+        self._queue = deque()
+        self._next_order = 0
+        self._rr_cursor = -1
+        self._counters = {"submitted": 0, "completed": 0, "reassigned": 0, "abandoned": 0}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch_timeouts, name="ClientRegistry", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+
+    def register(self, sid, name=None, max_inflight=DEFAULT_CLIENT_INFLIGHT, acks=False):
+        with self._lock:
+            self._clients[sid] = InspectionClient(sid, name or sid, self._next_order, max_inflight, acks)
+            self._next_order += 1
+            logger.info(f"检测客户端已登记: {name or sid}, 在线客户端: {len(self._clients)}")
+            sends = self._drain_queue()
+        self._run_sends(sends)
+
+    def unregister(self, sid):
+        """客户端断开：它正在处理的板卡改派给其他客户端"""
+        with self._lock:
+            client = self._clients.pop(sid, None)
+            if client is None:
+                return
+            logger.info(f"检测客户端已断开: {client.name}, 进行中的板卡: {len(client.inflight)}")
+            sends = []
+            for job_id in sorted(client.inflight):
+                assignment = self._assignments.get(job_id)
+                if assignment is not None:
+                    sends.extend(self._reassign(assignment, "客户端断开"))
+            sends.extend(self._drain_queue())
+        self._run_sends(sends)
+
+    def submit(self, job_id, payload):
+        """下发一块板卡，没有在线客户端时排队"""
+        with self._lock:
+            assignment = Assignment(job_id, payload)
+            self._assignments[job_id] = assignment
+            self._counters["submitted"] += 1
+            sends = self._assign(assignment)
+        self._run_sends(sends)
+
+    def complete(self, job_id):
+        """板卡已有检测结果，返回处理它的客户端 sid"""
+        with self._lock:
+            assignment = self._assignments.pop(job_id, None)
+            if assignment is None:
+                return None
+            self._counters["completed"] += 1
+            if assignment in self._queue:
+                self._queue.remove(assignment)
+            client = self._clients.get(assignment.sid)
+            if client is not None:
+                now = time.monotonic()
+                client.inflight.discard(job_id)
+                client.completed += 1
+                client.completions.append(now)
+                client.inspect_latency.append(now - assignment.sent_at)
+            sends = self._drain_queue()
+        self._run_sends(sends)
+        return assignment.sid
+
+    def cancel(self, job_id):
+        """流水线放弃了这块板卡（例如检测超时），不再改派"""
+        with self._lock:
+            assignment = self._assignments.pop(job_id, None)
+            if assignment is None:
+                return
+            if assignment in self._queue:
+                self._queue.remove(assignment)
+            client = self._clients.get(assignment.sid)
+            if client is not None:
+                client.inflight.discard(job_id)
+            sends = self._drain_queue()
+        self._run_sends(sends)
+
+    def _select(self, assignment):
+        """在有空位的客户端中选择（调用方持有锁）：优先选没有处理过这块板卡的客户端
+
+        客户端只保存当前板卡的板号时多下发一块会覆盖它，因此都没有空位时返回 None。
+        """
+        available = [c for c in self._clients.values() if len(c.inflight) < c.max_inflight]
+        candidates = [c for c in available if c.sid not in assignment.tried] or available
+        if not candidates:
+            return None
+        if self.policy == POLICY_ROUND_ROBIN:
+            later = [c for c in candidates if c.order > self._rr_cursor]
+            client = min(later or candidates, key=lambda c: c.order)
+            self._rr_cursor = client.order
+            return client
+        return min(candidates, key=lambda c: (len(c.inflight), c.dispatched, c.order))
+
+    def _assign(self, assignment, requeue=False):
+        """为板卡选择客户端，返回待发送的列表（调用方持有锁）
+
+        没有可用的客户端时排队；requeue 为 True（改派）时排在队首，先于更晚的板卡下发。
+        """
+        client = self._select(assignment)
+        if client is None:
+            assignment.sid = None
+            if requeue:
+                self._queue.appendleft(assignment)
+            else:
+                self._queue.append(assignment)
+            reason = "检测客户端都没有空位" if self._clients else "没有在线的检测客户端"
+            logger.warning(f"{reason}，板卡排队等待 - 任务: {assignment.job_id}")
+            return []
+        return self._send_to(client, assignment)
+
+    def _send_to(self, client, assignment):
+        """把板卡记为下发给 client，返回待发送的列表（调用方持有锁）"""
+        assignment.sid = client.sid
+        assignment.attempt += 1
+        assignment.sent_at = time.monotonic()
+        assignment.acked_at = None
+        assignment.tried.add(client.sid)
+        client.inflight.add(assignment.job_id)
+        client.dispatched += 1
+        return [(client, assignment, assignment.attempt)]
+
+    def _reassign(self, assignment, reason):
+        """把板卡改派给其他客户端（调用方持有锁）"""
+        previous = self._clients.get(assignment.sid)
+        if previous is not None:
+            previous.inflight.discard(assignment.job_id)
+            previous.reassigned += 1
+        if assignment.attempt >= self.max_attempts:
+            self._assignments.pop(assignment.job_id, None)
+            self._counters["abandoned"] += 1
+            logger.error(f"{reason}，板卡已下发 {assignment.attempt} 次，不再改派 - 任务: {assignment.job_id}")
+            return []
+        self._counters["reassigned"] += 1
+        logger.warning(f"{reason}，改派板卡 - 任务: {assignment.job_id}, 第 {assignment.attempt + 1} 次下发")
+        return self._assign(assignment, requeue=True)
+
+    def _drain_queue(self):
+        """按顺序把排队的板卡下发给有空位的客户端（调用方持有锁）"""
+        sends = []
+        while self._queue:
+            client = self._select(self._queue[0])
+            if client is None:
+                break
+            sends.extend(self._send_to(client, self._queue.popleft()))
+        return sends
+
+    def _run_sends(self, sends):
+        for client, assignment, attempt in sends:
+            def on_ack(*args, job_id=assignment.job_id, sid=client.sid, attempt=attempt):
+                self._on_ack(job_id, sid, attempt)
+            try:
+                self.send(client.sid, assignment.payload, on_ack)
+                logger.info(f"板卡已下发给 {client.name} - 任务: {assignment.job_id}")
+            except Exception as e:
+                logger.error(f"下发板卡给 {client.name} 失败: {e}", exc_info=True)
+
+    def _on_ack(self, job_id, sid, attempt):
+        with self._lock:
+            assignment = self._assignments.get(job_id)
+            # 改派之后旧客户端的确认不再有效
+            if assignment is None or assignment.sid != sid or assignment.attempt != attempt:
+                return
+            assignment.acked_at = time.monotonic()
+            client = self._clients.get(sid)
+            if client is not None:
+                client.acked += 1
+                client.ack_latency.append(assignment.acked_at - assignment.sent_at)
+
+    def _watch_timeouts(self):
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self.check_timeouts()
+            except Exception as e:
+                logger.error(f"检查客户端超时出错: {e}", exc_info=True)
+
+    def check_timeouts(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            sends = []
+            for assignment in list(self._assignments.values()):
+                if assignment.sid is None:
+                    continue
+                elapsed = now - assignment.sent_at
+                # 不声明 acks 的客户端（例如 iOS 客户端）不会确认，只按 inspect_timeout 判断
+                client = self._clients.get(assignment.sid)
+                requires_ack = self.ack_timeout and client is not None and client.acks
+                if requires_ack and assignment.acked_at is None and elapsed > self.ack_timeout:
+                    sends.extend(self._reassign(assignment, f"客户端 {assignment.sid} 超过 {self.ack_timeout} 秒未确认"))
+                elif self.inspect_timeout and elapsed > self.inspect_timeout:
+                    sends.extend(self._reassign(assignment,
+                                                f"客户端 {assignment.sid} 超过 {self.inspect_timeout} 秒未返回结果"))
+            sends.extend(self._drain_queue())
+        self._run_sends(sends)
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    @property
+    def capacity(self):
+        """在线客户端能同时处理的板卡总数"""
+        with self._lock:
+            return sum(c.max_inflight for c in self._clients.values())
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._counters)
+            result.update({
+                "clients": len(self._clients),
+                "inflight": sum(1 for a in self._assignments.values() if a.sid is not None),
+                "queued": len(self._queue),
+            })
+            return result
+
+    def clients(self):
+        now = time.monotonic()
+        with self._lock:
+            return [client.stats(now) for client in self._clients.values()]
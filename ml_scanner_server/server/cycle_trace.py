@@ -0,0 +1,263 @@
+import bisect
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+# 一个板卡周期依次经过的阶段
+STAGE_TRIGGER = "trigger"                  # 收到PLC '7' 到位信号
+STAGE_FILE_READ = "file_read"              # 从 input.txt 读到条码（可能早于触发）
+STAGE_EMITTED = "emitted"                  # start_detection 已发出
+STAGE_RESULT = "result_received"           # 收到检测结果
+STAGE_PLC_SENT = "plc_sent"                # 放行命令已交给PLC线程
+STAGE_PLC_ACK = "plc_ack"                  # PLC命令完成
+STAGES = (STAGE_TRIGGER, STAGE_FILE_READ, STAGE_EMITTED,
+          STAGE_RESULT, STAGE_PLC_SENT, STAGE_PLC_ACK)
+_STAGE_INDEX = {stage: i for i, stage in enumerate(STAGES)}
+
+# 直方图分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+# 计算分位数使用的最近样本数
+QUANTILE_WINDOW = 1024
+# 超过这个时间仍未完成的周期视为放弃，避免内存无限增长
+MAX_CYCLE_AGE = 600.0
+
+
+class LatencyHistogram:
+    """Prometheus 风格的累计直方图，同时保留最近样本用于计算分位数"""
+
+    __slots__ = ("bucket_counts", "count", "total", "recent")
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=QUANTILE_WINDOW)
+
+    def observe(self, value):
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        if index < len(self.bucket_counts):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+    def quantiles(self):
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {q: None for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+
+class Cycle:
+    __slots__ = ("cycle_id", "marks", "board_id", "started_at")
+
+    def __init__(self, cycle_id, started_at):
+        self.cycle_id = cycle_id
+        self.marks = {}
+        self.board_id = None
+        self.started_at = started_at
+
+
+class CycleTracer:
+    """板卡周期追踪
+
+    PLC 触发时 begin() 分配周期 id 并记录各阶段的 time.monotonic() 时间戳，
+    周期完成时把相邻阶段之间的耗时以及整个周期的耗时计入直方图。所有操作
+    只是在一把锁内做几次字典操作，对热路径的开销可以忽略。
+    """
+
+    def __init__(self, max_cycle_age=MAX_CYCLE_AGE):
+        self.max_cycle_age = max_cycle_age
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._open = OrderedDict()
+        self._by_board = {}
+        self._histograms = {}
+        self._stage_counts = {stage: 0 for stage in STAGES}
+        self._completed = 0
+        self._abandoned = 0
+
+    def begin(self, at=None):
+        """开始一个新周期，返回周期 id"""
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            self._expire(at)
+            cycle = Cycle(next(self._ids), at)
+            cycle.marks[STAGE_TRIGGER] = at
+            self._stage_counts[STAGE_TRIGGER] += 1
+            self._open[cycle.cycle_id] = cycle
+            return cycle.cycle_id
+
+    def mark(self, cycle_id, stage, at=None):
+        if cycle_id is None:
+            return
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            cycle = self._open.get(cycle_id)
+            if cycle is not None and stage not in cycle.marks:
+                cycle.marks[stage] = at
+                self._stage_counts[stage] += 1
+
+    def bind_board(self, cycle_id, board_id):
+        """记录周期对应的板号，检测结果没有带回周期 id 时按板号查找"""
+        with self._lock:
+            cycle = self._open.get(cycle_id)
+            if cycle is not None:
+                cycle.board_id = board_id
+                self._by_board[board_id] = cycle_id
+
+    def cycle_for_board(self, board_id):
+        with self._lock:
+            return self._by_board.get(board_id)
+
+    def finish(self, cycle_id, at=None):
+        """周期完成，计入各阶段耗时"""
+        if cycle_id is None:
+            return
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            cycle = self._open.pop(cycle_id, None)
+            if cycle is None:
+                return
+            if cycle.board_id is not None and self._by_board.get(cycle.board_id) == cycle_id:
+                del self._by_board[cycle.board_id]
+            self._completed += 1
+            previous_stage = None
+            for stage in STAGES:
+                stamp = cycle.marks.get(stage)
+                if stamp is None:
+                    continue
+                if previous_stage is not None:
+                    self._observe(f"{previous_stage}->{stage}", stamp - cycle.marks[previous_stage])
+                previous_stage = stage
+            self._observe("cycle", at - cycle.started_at)
+
+    def _observe(self, name, value):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = LatencyHistogram()
+        histogram.observe(max(0.0, value))
+
+    def _expire(self, now):
+        """丢弃超时未完成的周期（调用方持有锁）"""
+        while self._open:
+            cycle_id, cycle = next(iter(self._open.items()))
+            if now - cycle.started_at < self.max_cycle_age:
+                break
+            del self._open[cycle_id]
+            if cycle.board_id is not None and self._by_board.get(cycle.board_id) == cycle_id:
+                del self._by_board[cycle.board_id]
+            self._abandoned += 1
+
+    def snapshot(self):
+        """返回各阶段耗时的计数、总和、分桶和分位数，以及周期计数"""
+        with self._lock:
+            self._expire(time.monotonic())
+            histograms = {
+                name: {
+                    "count": h.count,
+                    "sum": h.total,
+                    "buckets": list(h.bucket_counts),
+                    "quantiles": h.quantiles(),
+                }
+                for name, h in self._histograms.items()
+            }
+            return {
+                "histograms": histograms,
+                "stage_counts": dict(self._stage_counts),
+                "completed": self._completed,
+                "abandoned": self._abandoned,
+                "open": len(self._open),
+            }
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(station, **labels):
+    if station is not None:
+        labels["station"] = station
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def render_prometheus(tracer, gauges=None, prefix="ml_scanner", station_gauges=None):
+    """生成 Prometheus 文本格式的指标
+
+    tracer 为 CycleTracer，或 {工位 id: CycleTracer}（多工位时每条指标带 station 标签）。
+    gauges 为 {组件名: stats 字典}，其中的数值会作为
+    <prefix>_<组件名>_<键> 导出，例如 PLC 和图片写入线程池的计数器；
+    station_gauges 为 {工位 id: {组件名: stats 字典}}，导出时带 station 标签。
+    """
+    tracers = tracer if isinstance(tracer, dict) else {None: tracer}
+    snapshots = {station: t.snapshot() for station, t in tracers.items()}
+    lines = []
+
+    name = f"{prefix}_stage_latency_seconds"
+    lines.append(f"# HELP {name} Latency between consecutive board-cycle stages.")
+    lines.append(f"# TYPE {name} histogram")
+    for station, snapshot in snapshots.items():
+        for stage, h in sorted(snapshot["histograms"].items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, h["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(station, stage=stage, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(station, stage=stage, le="+Inf")} {h["count"]}')
+            lines.append(f'{name}_sum{_labels(station, stage=stage)} {_format_value(h["sum"])}')
+            lines.append(f'{name}_count{_labels(station, stage=stage)} {h["count"]}')
+
+    name = f"{prefix}_stage_latency_recent_seconds"
+    lines.append(f"# HELP {name} Latency quantiles over the most recent {QUANTILE_WINDOW} cycles.")
+    lines.append(f"# TYPE {name} gauge")
+    for station, snapshot in snapshots.items():
+        for stage, h in sorted(snapshot["histograms"].items()):
+            for q, value in h["quantiles"].items():
+                lines.append(f'{name}{_labels(station, stage=stage, quantile=q)} {_format_value(value)}')
+
+    name = f"{prefix}_stage_events_total"
+    lines.append(f"# HELP {name} Number of cycles that reached each stage.")
+    lines.append(f"# TYPE {name} counter")
+    for station, snapshot in snapshots.items():
+        for stage, count in snapshot["stage_counts"].items():
+            lines.append(f'{name}{_labels(station, stage=stage)} {count}')
+
+    name = f"{prefix}_cycles_total"
+    lines.append(f"# HELP {name} Finished board cycles by outcome.")
+    lines.append(f"# TYPE {name} counter")
+    for station, snapshot in snapshots.items():
+        lines.append(f'{name}{_labels(station, outcome="completed")} {snapshot["completed"]}')
+        lines.append(f'{name}{_labels(station, outcome="abandoned")} {snapshot["abandoned"]}')
+
+    name = f"{prefix}_cycles_open"
+    lines.append(f"# TYPE {name} gauge")
+    for station, snapshot in snapshots.items():
+        lines.append(f"{name}{_labels(station)} {snapshot['open']}")
+
+    for component, stats in (gauges or {}).items():
+        for key, value in sorted(stats.items()):
+            if isinstance(value, (int, float)) or value is None:
+                metric = f"{prefix}_{component}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {_format_value(value)}")
+
+    # 各工位的同名指标放在一起，每个指标只输出一次 TYPE
+    labelled = {}
+    for station, components in (station_gauges or {}).items():
+        for component, stats in components.items():
+            for key, value in sorted(stats.items()):
+                if isinstance(value, (int, float)) or value is None:
+                    labelled.setdefault(f"{prefix}_{component}_{key}", []).append((station, value))
+    for metric, samples in labelled.items():
+        lines.append(f"# TYPE {metric} gauge")
+        for station, value in samples:
+            lines.append(f"{metric}{_labels(station)} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
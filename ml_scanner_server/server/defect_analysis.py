@@ -0,0 +1,351 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from logger_config import get_logger
+from result_store import safe_filename
+
+logger = get_logger("DefectAnalysis")
+
+DEFAULT_PRODUCT = "default"
+# 与客户端 DetectionManager 中固定的置信度阈值一致
+DEFAULT_SCORE_THRESHOLD = 0.3
+# 热力图和区域掩码的网格（行, 列），检测框坐标为 0~1 的归一化坐标
+DEFAULT_GRID = (64, 64)
+# 检查产品配置文件是否修改的最短间隔（秒）
+RELOAD_INTERVAL = 1.0
+# 热力图写回磁盘的间隔（秒）
+HEATMAP_FLUSH_INTERVAL = 5.0
+
+_PROFILE_KEYS = ("score_threshold", "min_box_area", "roi", "ignore", "mask", "grid")
+
+
+def _rects(value, field, product_id):
+    rects = np.asarray(value, dtype=np.float64).reshape(-1, 4) if value else np.empty((0, 4))
+    if rects.size and ((rects < 0) | (rects > 1)).any():
+        raise ValueError(f"产品 {product_id} 的 {field} 必须是 0~1 的归一化坐标")
+    return rects
+
+
+def _fill(mask, rects, value):
+    rows, cols = mask.shape
+    for x1, y1, x2, y2 in rects:
+        c1, c2 = int(np.floor(min(x1, x2) * cols)), int(np.ceil(max(x1, x2) * cols))
+        r1, r2 = int(np.floor(min(y1, y2) * rows)), int(np.ceil(max(y1, y2) * rows))
+        mask[r1:r2, c1:c2] = value
+
+
+class ProductProfile:
+    """一种产品的缺陷判定参数
+
+    score_threshold 为置信度阈值；min_box_area 为检测框最小面积（占整幅图的比例）；
+    检测框中心需要落在区域掩码内才算缺陷。掩码由 roi（需要检测的矩形列表，
+    不配置时为整幅图）、ignore（忽略的矩形列表）和 mask（灰度图片，亮处为检测区域，
+    缩放到 grid 大小）共同决定，矩形为归一化坐标 [x1, y1, x2, y2]。
+    """
+
+    __slots__ = ("product_id", "score_threshold", "min_box_area", "grid", "mask", "_flat_mask", "_scale", "_upper")
+
+    def __init__(self, product_id, score_threshold=DEFAULT_SCORE_THRESHOLD, min_box_area=0.0, roi=None,
+                 ignore=None, mask=None, grid=DEFAULT_GRID):
+        self.product_id = str(product_id)
+        self.score_threshold = float(score_threshold)
+        self.min_box_area = float(min_box_area or 0.0)
+        self.grid = tuple(int(v) for v in grid)
+        if len(self.grid) != 2 or min(self.grid) <= 0:
+            raise ValueError(f"产品 {product_id} 的 grid 必须是 [行数, 列数]")
+
+        roi = _rects(roi, "roi", product_id)
+        region = np.zeros(self.grid, dtype=bool) if len(roi) else np.ones(self.grid, dtype=bool)
+        _fill(region, roi, True)
+        _fill(region, _rects(ignore, "ignore", product_id), False)
+        if mask is not None:
+            from PIL import Image
+            with Image.open(mask) as image:
+                resized = image.convert("L").resize((self.grid[1], self.grid[0]), Image.NEAREST)
+            region &= np.asarray(resized) > 127
+        self.mask = region
+        self._flat_mask = region.ravel()
+        # 中心坐标 (x, y) 换算成 (列, 行) 的比例和上限
+        self._scale = np.array([self.grid[1], self.grid[0]], dtype=np.float32)
+        self._upper = self._scale - 1
+
+    @classmethod
+    def from_dict(cls, product_id, config, base_dir):
+        config = dict(config or {})
+        unknown = set(config) - set(_PROFILE_KEYS)
+        if unknown:
+            raise ValueError(f"产品 {product_id} 的配置项未知: {', '.join(sorted(unknown))}")
+        if config.get("mask"):
+            config["mask"] = Path(base_dir) / config["mask"]
+        return cls(product_id, **config)
+
+    def cell_indices(self, boxes):
+        """检测框中心所在的网格单元（展平后的下标）"""
+        # 单次检测通常只有几个框，用 ufunc 代替 np.clip 以减少每次调用的固定开销
+        centers = boxes[:, :2] + boxes[:, 2:]
+        centers *= 0.5
+        centers *= self._scale
+        np.maximum(centers, 0, out=centers)
+        np.minimum(centers, self._upper, out=centers)
+        index = centers.astype(np.intp)
+        return index[:, 1] * self.grid[1] + index[:, 0]
+
+    def evaluate(self, boxes, scores):
+        """按阈值、面积和区域掩码筛选检测框，返回 (保留的框, 保留的置信度, 所在网格单元)"""
+        keep = np.isfinite(scores) & (scores >= self.score_threshold) & np.isfinite(boxes).all(axis=1)
+        if self.min_box_area > 0:
+            area = np.abs((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))
+            keep &= area >= self.min_box_area
+        boxes, scores = boxes[keep], scores[keep]
+        cells = self.cell_indices(boxes)
+        inside = self._flat_mask[cells]
+        return boxes[inside], scores[inside], cells[inside]
+
+    def to_dict(self):
+        return {
+            "product": self.product_id,
+            "score_threshold": self.score_threshold,
+            "min_box_area": self.min_box_area,
+            "grid": list(self.grid),
+            "roi_coverage": float(self.mask.mean()),
+        }
+
+
+def parse_predictions(boxes, scores, image_size=None):
+    """把 nmsed_pred_boxes/nmsed_pred_scores 转成 (N, 4) 和 (N,) 的 float32 数组
+
+    支持嵌套列表、JSON 解析后的列表或 float32 小端字节串（Socket.IO 二进制附件）。
+    image_size 为 (宽, 高) 时坐标按像素处理并归一化。
+    """
+    boxes = np.frombuffer(boxes, dtype="<f4") if isinstance(boxes, (bytes, bytearray)) else \
+        np.asarray(boxes, dtype=np.float32)
+    scores = np.frombuffer(scores, dtype="<f4") if isinstance(scores, (bytes, bytearray)) else \
+        np.asarray(scores, dtype=np.float32)
+    boxes = boxes.reshape(-1, 4)
+    scores = scores.reshape(-1)
+    if len(boxes) != len(scores):
+        raise ValueError(f"检测框数量 ({len(boxes)}) 与置信度数量 ({len(scores)}) 不一致")
+    if image_size:
+        width, height = image_size
+        boxes = boxes / np.array([width, height, width, height], dtype=np.float32)
+    return boxes, scores
+
+
+class Evaluation:
+    __slots__ = ("product_id", "grid", "has_defect", "boxes", "scores", "cells", "received")
+
+    def __init__(self, product_id, grid, boxes, scores, cells, received):
+        self.product_id = product_id
+        self.grid = grid
+        self.boxes = boxes
+        self.scores = scores
+        self.cells = cells
+        self.received = received
+        self.has_defect = bool(len(scores))
+
+    def to_list(self):
+        """保存到检测结果索引中的缺陷框：[[x1, y1, x2, y2, score], ...]"""
+        return np.round(np.column_stack((self.boxes, self.scores)).astype(np.float64), 4).tolist()
+
+
+class DefectHeatmaps:
+    """按产品累计缺陷位置的热力图，保存在内存映射的 NumPy 数组中
+
+    每个产品一个 <目录>/<产品>_<行>x<列>.u32 文件（uint32，行优先），每个缺陷框
+    中心所在的单元加一。累加直接在内存映射上进行，后台线程每隔
+    HEATMAP_FLUSH_INTERVAL 秒把有变化的热力图写回磁盘（不占用检测结果请求线程），
+    关闭时再写回一次，进程重启后继续累计。
+    """
+
+    def __init__(self, directory, flush_interval=HEATMAP_FLUSH_INTERVAL):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self._maps = {}
+        self._flat = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="HeatmapFlush", daemon=True)
+        self._thread.start()
+
+    def _path(self, product_id, grid):
+        return self.directory / f"{safe_filename(product_id)}_{grid[0]}x{grid[1]}.u32"
+
+    def _open(self, product_id, grid):
+        key = (product_id, grid)
+        lock = self._locks.get(key)
+        if lock is not None:
+            return self._maps[key], self._flat[key], lock
+        with self._lock:
+            heatmap = self._maps.get(key)
+            if heatmap is None:
+                path = self._path(product_id, grid)
+                mode = "r+" if path.exists() else "w+"
+                heatmap = np.memmap(path, dtype=np.uint32, mode=mode, shape=grid)
+                self._maps[key] = heatmap
+                # 累加用普通 ndarray 视图，避免每次切片都构造 memmap 子类
+                self._flat[key] = heatmap.view(np.ndarray).reshape(-1)
+                self._locks[key] = threading.Lock()
+            return heatmap, self._flat[key], self._locks[key]
+
+    def add(self, product_id, grid, cells):
+        """累加一次检测的缺陷框（cells 为展平后的网格下标）"""
+        if len(cells) == 0:
+            return
+        _, flat, lock = self._open(product_id, tuple(grid))
+        with lock:
+            # 同一单元可能有多个框，np.add.at 不会像 flat[cells] += 1 那样只计一次
+            np.add.at(flat, cells, 1)
+        self._dirty = True
+
+    def get(self, product_id, grid):
+        """热力图的副本；没有记录时返回全零数组"""
+        grid = tuple(grid)
+        if (product_id, grid) not in self._maps and not self._path(product_id, grid).exists():
+            return np.zeros(grid, dtype=np.uint32)
+        _, flat, lock = self._open(product_id, grid)
+        with lock:
+            return flat.reshape(grid).copy()
+
+    def products(self):
+        """磁盘上已有热力图的 (产品, 网格)"""
+        found = set(self._maps)
+        for path in self.directory.glob("*.u32"):
+            name, _, shape = path.stem.rpartition("_")
+            rows, _, cols = shape.partition("x")
+            if name and rows.isdigit() and cols.isdigit():
+                found.add((name, (int(rows), int(cols))))
+        return sorted(found)
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            if not self._dirty:
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"热力图写回磁盘失败: {e}", exc_info=True)
+
+    def flush(self):
+        self._dirty = False
+        with self._lock:
+            items = [(heatmap, self._locks[key]) for key, heatmap in self._maps.items()]
+        for heatmap, lock in items:
+            with lock:
+                heatmap.flush()
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self.flush()
+        with self._lock:
+            self._maps.clear()
+            self._flat.clear()
+            self._locks.clear()
+
+
+class DefectAnalyzer:
+    """服务器端的缺陷判定：按产品配置重新筛选客户端上传的 NMS 结果并累计热力图
+
+    产品配置从 YAML 文件读取，修改后自动重新加载（最多每 RELOAD_INTERVAL 秒检查一次），
+    无需重新部署客户端或重启服务器；加载失败时继续使用旧配置。配置格式：
+
+        products:
+          default:
+            score_threshold: 0.3
+          PCB-A:
+            score_threshold: 0.45
+            min_box_area: 0.0005
+            roi: [[0.05, 0.05, 0.95, 0.95]]
+            ignore: [[0.4, 0.0, 0.6, 0.1]]
+            mask: masks/pcb-a.png
+            grid: [64, 64]
+
+    没有配置的产品使用 default；配置文件不存在时 default 的阈值为 0.3（与客户端一致）。
+    """
+
+    def __init__(self, config_path=None, heatmap_dir=None):
+        self.config_path = Path(config_path) if config_path else None
+        self.heatmaps = DefectHeatmaps(heatmap_dir) if heatmap_dir else None
+        self._profiles = {DEFAULT_PRODUCT: ProductProfile(DEFAULT_PRODUCT)}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._counters = {"evaluated": 0, "boxes": 0, "defect_boxes": 0, "reloads": 0, "reload_errors": 0}
+        self._reload_if_changed(force=True)
+
+    def _reload_if_changed(self, force=False):
+        if self.config_path is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.config_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.config_path, "r", encoding="utf-8") as f:
+                document = yaml.safe_load(f) or {}
+            profiles = {DEFAULT_PRODUCT: ProductProfile(DEFAULT_PRODUCT)}
+            for product_id, config in (document.get("products") or {}).items():
+                profiles[str(product_id)] = ProductProfile.from_dict(product_id, config, self.config_path.parent)
+        except Exception as e:
+            self._counters["reload_errors"] += 1
+            logger.error(f"加载产品配置失败，继续使用旧配置: {e}")
+            return
+        self._profiles = profiles
+        self._counters["reloads"] += 1
+        logger.info(f"已加载产品配置: {', '.join(sorted(profiles))}")
+
+    def profile(self, product_id=None):
+        if time.monotonic() - self._checked_at >= RELOAD_INTERVAL:
+            with self._lock:
+                self._reload_if_changed()
+        profiles = self._profiles
+        return profiles.get(product_id or DEFAULT_PRODUCT) or profiles[DEFAULT_PRODUCT]
+
+    def profiles(self):
+        with self._lock:
+            self._reload_if_changed()
+            return [profile.to_dict() for profile in self._profiles.values()]
+
+    def evaluate(self, product_id, boxes, scores, image_size=None):
+        """重新判定一次检测的 NMS 结果，返回 Evaluation"""
+        profile = self.profile(product_id)
+        boxes, scores = parse_predictions(boxes, scores, image_size)
+        kept_boxes, kept_scores, cells = profile.evaluate(boxes, scores)
+        with self._lock:
+            self._counters["evaluated"] += 1
+            self._counters["boxes"] += len(scores)
+            self._counters["defect_boxes"] += len(kept_scores)
+        return Evaluation(profile.product_id, profile.grid, kept_boxes, kept_scores, cells, len(scores))
+
+    def record(self, evaluation):
+        """把判定为缺陷的框累加到该产品的热力图"""
+        if self.heatmaps is not None and evaluation.has_defect:
+            self.heatmaps.add(evaluation.product_id, evaluation.grid, evaluation.cells)
+
+    def heatmap(self, product_id=None):
+        profile = self.profile(product_id)
+        return profile, self.heatmaps.get(profile.product_id, profile.grid)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, products=len(self._profiles))
+
+    def close(self):
+        if self.heatmaps is not None:
+            self.heatmaps.close()
@@ -2,22 +2,50 @@ import os
 import time
 import threading
 from logger_config import get_logger
+from file_watcher import create_watcher
+from file_tailer import FileTailer
+from introspection import InstrumentedLock
 
 class InputFileMonitor:
-    def __init__(self, file_path):
-        """初始化文件监控器"""
+    def __init__(self, file_path, watcher_backend="auto", poll_interval=0.5, fallback_interval=1.0,
+                 split_lines=False, partial_line_timeout=0.2, skip_existing=False):
+        """初始化文件监控器
+
+        watcher_backend 为 "auto" 时优先使用 inotify 事件唤醒，不可用时退回到
+        每 poll_interval 秒一次的 stat 轮询。使用 inotify 时仍每 fallback_interval
+        秒做一次 stat 检查，防止极端情况下漏掉事件。
+
+        split_lines 为 True 时按行拆分新增内容，每个非空行调用一次回调；最后一行
+        没有换行符时等待 partial_line_timeout 秒，期间没有新内容再作为一行处理。
+        为 False 时保持原来的行为：去掉所有空白后整体调用一次回调。
+
+        skip_existing 为 True 时初次启动从文件末尾开始读取，启动前文件中已有的内容
+        不调用回调（常驻监控时这些是已经处理过的旧条码）。
+        """
         self.file_path = file_path
+        self.watcher_backend = watcher_backend
+        self.poll_interval = poll_interval
+        self.fallback_interval = fallback_interval
+        self.split_lines = split_lines
+        self.partial_line_timeout = partial_line_timeout
+        self.skip_existing = skip_existing
+        # 按行拆分时尚未遇到换行符的内容及其最后更新时间
+        self.partial_line = ''
+        self.partial_since = None
+        self.watcher = None
         self.last_modified = 0
         self.is_running = False
         self.monitor_thread = None
         self.last_size = 0
-        self.last_content = ""
+        # 按字节偏移增量读取，不再在内存中保留整个文件内容
+        self.tailer = FileTailer(file_path)
         self.logger = get_logger("FileMonitor")
-        # 添加线程锁保护共享状态
-        self.state_lock = threading.Lock()
-        self.thread_lock = threading.Lock()
-        self.running_lock = threading.Lock()
-        self.file_lock = threading.Lock()
+        # 添加线程锁保护共享状态；记录等待和持有时间，可以通过 /debug 查看
+        name = os.path.basename(file_path)
+        self.state_lock = InstrumentedLock(f"FileMonitor[{name}].state_lock")
+        self.thread_lock = InstrumentedLock(f"FileMonitor[{name}].thread_lock")
+        self.running_lock = InstrumentedLock(f"FileMonitor[{name}].running_lock")
+        self.file_lock = InstrumentedLock(f"FileMonitor[{name}].file_lock")
     
     def start_monitoring(self, callback_func):
         """开始监控文件"""
@@ -33,13 +61,18 @@ class InputFileMonitor:
         # 使用锁保护状态数据
         with self.state_lock:
             # 只有初次启动时才重置这些值，保持状态连续性
-            if self.last_modified == 0 and self.last_size == 0 and self.last_content == "":
+            if self.last_modified == 0 and self.last_size == 0 and self.tailer.fingerprint is None:
                 self.last_modified = 0
                 self.last_size = 0
-                self.last_content = ""
-                self.logger.info("初次启动监控，重置文件状态")
+                if self.skip_existing:
+                    self.tailer.seek_to_end()
+                    self.last_size = self.tailer.size
+                    self.logger.info(f"初次启动监控，跳过文件中已有的 {self.tailer.offset} 字节")
+                else:
+                    self.tailer.reset()
+                    self.logger.info("初次启动监控，重置文件状态")
             else:
-                self.logger.info(f"继续监控文件，保留上次状态。上次大小: {self.last_size}, 上次内容长度: {len(self.last_content)}")
+                self.logger.info(f"继续监控文件，保留上次状态。上次大小: {self.last_size}, 读取偏移: {self.tailer.offset}")
         
         # 使用锁保护线程管理
         with self.thread_lock:
@@ -50,7 +83,8 @@ class InputFileMonitor:
                     self.logger.info("清理旧的监控线程引用")
                     self.monitor_thread = None
                     
-                self.monitor_thread = threading.Thread(target=self._monitor_loop, args=(callback_func,))
+                self.monitor_thread = threading.Thread(target=self._monitor_loop, args=(callback_func,),
+                                                       name=f"FileMonitor-{os.path.basename(self.file_path)}")
                 self.monitor_thread.daemon = True
                 self.monitor_thread.start()
                 self.logger.info(f"创建并启动新的监控线程: {self.monitor_thread.name}")
@@ -71,6 +105,9 @@ class InputFileMonitor:
         # 使用锁保护线程管理
         thread_to_join = None
         with self.thread_lock:
+            # 唤醒阻塞在等待文件事件上的监控线程，使其尽快看到停止信号
+            if self.watcher:
+                self.watcher.wakeup()
             if self.monitor_thread and self.monitor_thread.is_alive():
                 if self.monitor_thread == threading.current_thread():
                     self.logger.warning("尝试在监控线程自身中停止监控，跳过等待步骤")
@@ -103,99 +140,148 @@ class InputFileMonitor:
         
         # 记录当前状态数据
         with self.state_lock:
-            self.logger.info(f"文件监控已暂停，保留状态数据。当前文件大小: {self.last_size}, 当前内容长度: {len(self.last_content)}")
+            self.logger.info(f"文件监控已暂停，保留状态数据。当前文件大小: {self.last_size}, 读取偏移: {self.tailer.offset}")
     
     def _monitor_loop(self, callback_func):
         """监控循环"""
         self.logger.info(f"监控线程 {threading.current_thread().name} 开始运行")
-        while True:
-            # 检查是否应该继续运行
-            with self.running_lock:
-                if not self.is_running:
-                    self.logger.info(f"监控线程 {threading.current_thread().name} 检测到停止信号，退出循环")
-                    break
-                
-            try:
-                # 线程安全地检查文件状态
-                if os.path.exists(self.file_path):
-                    try:
-                        current_modified = os.path.getmtime(self.file_path)
-                        current_size = os.path.getsize(self.file_path)
-                    except (FileNotFoundError, PermissionError) as e:
-                        self.logger.error(f"获取文件信息出错: {e}")
-                        time.sleep(0.5)
-                        continue
-                    
-                    # 使用锁保护状态比较
-                    need_process = False
-                    with self.state_lock:
-                        if (current_modified > self.last_modified or current_size != self.last_size) and current_size > 0:
-                            need_process = True
-                            self.last_modified = current_modified
+        try:
+            watcher = create_watcher(self.file_path, self.watcher_backend, self.poll_interval)
+        except Exception as e:
+            self.logger.error(f"创建文件监听器失败，使用轮询方式: {e}", exc_info=True)
+            watcher = create_watcher(self.file_path, "polling", self.poll_interval)
+        self.logger.info(f"文件监听方式: {watcher.name}")
+        with self.thread_lock:
+            self.watcher = watcher
+
+        try:
+            while True:
+                # 检查是否应该继续运行
+                with self.running_lock:
+                    if not self.is_running:
+                        self.logger.info(f"监控线程 {threading.current_thread().name} 检测到停止信号，退出循环")
+                        break
                     
-                    if need_process:
+                try:
+                    # 线程安全地检查文件状态
+                    if os.path.exists(self.file_path):
                         try:
-                            # 处理文件
-                            self._process_file(callback_func)
-                        except Exception as e:
-                            self.logger.error(f"处理文件出错: {e}", exc_info=True)
-                
-                time.sleep(0.5)  # 每0.5秒检查一次
-            except Exception as e:
-                self.logger.error(f"监控循环出错: {e}", exc_info=True)
-                time.sleep(1)  # 错误后稍微延长等待时间
+                            current_modified = os.path.getmtime(self.file_path)
+                            current_size = os.path.getsize(self.file_path)
+                        except (FileNotFoundError, PermissionError) as e:
+                            self.logger.error(f"获取文件信息出错: {e}")
+                            watcher.wait(self.fallback_interval)
+                            continue
+                        
+                        # 使用锁保护状态比较
+                        need_process = False
+                        with self.state_lock:
+                            if (current_modified > self.last_modified or current_size != self.last_size) and current_size > 0:
+                                need_process = True
+                                self.last_modified = current_modified
+                        
+                        if need_process:
+                            try:
+                                # 处理文件
+                                self._process_file(callback_func)
+                            except Exception as e:
+                                self.logger.error(f"处理文件出错: {e}", exc_info=True)
+                    
+                    # 等待文件变化事件；轮询方式下相当于每0.5秒检查一次
+                    watcher.wait(self._wait_timeout())
+                    self._flush_partial_line(callback_func)
+                except Exception as e:
+                    self.logger.error(f"监控循环出错: {e}", exc_info=True)
+                    time.sleep(1)  # 错误后稍微延长等待时间
+        finally:
+            with self.thread_lock:
+                if self.watcher is watcher:
+                    self.watcher = None
+            watcher.close()
         
         self.logger.info(f"监控线程 {threading.current_thread().name} 已退出")
     
     def _process_file(self, callback_func):
         """处理文件内容，只读取新增的内容"""
-        current_content = ""
-        current_size = 0
-        
-        # 使用文件锁保护文件读取
-        with self.file_lock:
-            try:
-                # 读取文件当前全部内容
-                with open(self.file_path, 'r', encoding='utf-8') as file:
-                    current_content = file.read()
-                
-                current_size = os.path.getsize(self.file_path)
-            except (FileNotFoundError, PermissionError, IOError) as e:
-                self.logger.error(f"读取文件出错: {e}")
-                return
-        
-        # 确定新增内容
-        new_content = ""
-        
-        # 使用锁保护状态访问和更新
-        with self.state_lock:
-            # 计算新增内容
-            if not self.last_content:
-                # 如果没有上次内容记录（首次读取），使用整个内容
+        while True:
+            # 使用文件锁保护文件读取
+            with self.file_lock:
+                try:
+                    # 从上次的字节偏移处读取新增部分，轮转/截断由文件身份和长度判断
+                    new_content, reason = self.tailer.read_new()
+                except (FileNotFoundError, PermissionError, IOError) as e:
+                    self.logger.error(f"读取文件出错: {e}")
+                    return
+                has_pending = self.tailer.has_pending
+
+            # 使用锁保护状态更新
+            with self.state_lock:
+                self.last_size = self.tailer.size
+
+            if reason == "first":
                 self.logger.info("首次读取，使用全部内容")
-                new_content = current_content
-            elif current_size < self.last_size:
-                # 如果文件变小了（可能被清空或部分删除），也使用整个内容
-                self.logger.info("文件大小减少，使用全部内容")
-                new_content = current_content
-            elif current_size > self.last_size:
-                # 正常情况：文件增大，只读取新增部分
+            elif reason == "rotated":
+                self.logger.info("文件已被替换，从新文件开头读取")
+            elif reason == "truncated":
+                self.logger.info("文件大小减少，从头读取全部内容")
+            elif reason == "rewritten":
+                self.logger.info("文件内容被改写，从头读取全部内容")
+            elif reason == "appended":
                 self.logger.info("文件增大，只读取新增部分")
-                new_content = current_content[len(self.last_content):]
+
+            if self.split_lines:
+                self._dispatch_lines(new_content, reason, callback_func)
             else:
-                # 文件大小相同但内容可能发生变化，检查内容是否有变化
-                if current_content != self.last_content:
-                    self.logger.info("文件大小相同但内容发生变化，使用全部内容")
-                    new_content = current_content
-                else:
-                    self.logger.info("文件内容未变化，无需处理")
-                    new_content = ""
-            
-            # 更新状态
-            self.last_content = current_content
-            self.last_size = current_size
-        
-        # 处理新增内容：移除所有空格和换行符
+                self._dispatch_content(new_content, callback_func)
+
+            # 单次读取量受限时继续读取剩余内容
+            if not has_pending:
+                break
+
+    def _wait_timeout(self):
+        """有未结束的行时缩短等待时间，以便按时把它作为一行处理"""
+        with self.file_lock:
+            if self.partial_since is None:
+                return self.fallback_interval
+            remaining = self.partial_line_timeout - (time.monotonic() - self.partial_since)
+        return min(self.fallback_interval, max(0.01, remaining))
+
+    def _flush_partial_line(self, callback_func, force=False):
+        """未结束的行超过 partial_line_timeout 没有新内容时，作为完整的一行处理"""
+        with self.file_lock:
+            if self.partial_since is None:
+                return
+            if not force and time.monotonic() - self.partial_since < self.partial_line_timeout:
+                return
+            line = self.partial_line
+            self.partial_line = ''
+            self.partial_since = None
+        self._dispatch_line(line, callback_func)
+
+    def _dispatch_lines(self, new_content, reason, callback_func):
+        """按行拆分新增内容，每个非空行调用一次回调函数"""
+        if reason not in (None, "appended"):
+            # 文件被替换或改写，之前未结束的行不会再有后续内容
+            self._flush_partial_line(callback_func, force=True)
+        with self.file_lock:
+            lines = (self.partial_line + new_content).split('\n')
+            self.partial_line = lines.pop()
+            self.partial_since = time.monotonic() if self.partial_line else None
+        for line in lines:
+            self._dispatch_line(line, callback_func)
+
+    def _dispatch_line(self, line, callback_func):
+        board_id = line.strip()
+        if not board_id:
+            return
+        self.logger.info(f"读取到条码: {board_id}")
+        try:
+            callback_func(board_id)
+        except Exception as e:
+            self.logger.error(f"调用回调函数出错: {e}", exc_info=True)
+
+    def _dispatch_content(self, new_content, callback_func):
+        """处理新增内容：移除所有空格和换行符后调用回调函数"""
         if new_content:
             processed_content = ''.join(new_content.split())
             
@@ -210,4 +296,4 @@ class InputFileMonitor:
             else:
                 self.logger.info("内容经处理后为空，不调用回调函数")
         else:
-            self.logger.warning("没有检测到新内容")
\ No newline at end of file
+            self.logger.warning("没有检测到新内容")
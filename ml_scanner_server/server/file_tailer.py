@@ -0,0 +1,105 @@
+import os
+import codecs
+
+# 用于检测原地改写的尾部标记长度（字节）
+TAIL_MARKER_SIZE = 64
+
+
+class FileTailer:
+    """按字节偏移增量读取文件新增内容
+
+    只保存读取偏移、文件身份（st_dev, st_ino）以及偏移前最多 64 字节的尾部标记，
+    状态大小与文件长度无关。每次读取只 seek 到偏移处读取新追加的字节：
+    - 文件身份变化（被删除重建或原子替换）视为轮转，从头读取新文件；
+    - 文件长度小于偏移视为被截断，从头读取；
+    - 尾部标记与文件内容不一致视为被原地改写，从头读取。
+    """
+
+    def __init__(self, file_path, encoding='utf-8', max_read_bytes=1024 * 1024):
+        self.file_path = file_path
+        self.encoding = encoding
+        self.max_read_bytes = max_read_bytes
+        self.offset = 0
+        self.size = 0
+        self.fingerprint = None
+        self.tail_marker = b""
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+    @property
+    def has_pending(self):
+        """上次读取受 max_read_bytes 限制时，文件中仍有未读取的内容"""
+        return self.offset < self.size
+
+    def reset(self):
+        """清空读取状态，下次读取从文件开头开始"""
+        self.offset = 0
+        self.size = 0
+        self.fingerprint = None
+        self.tail_marker = b""
+        self._decoder.reset()
+
+    def seek_to_end(self):
+        """跳过文件中已有的内容，之后只读取新追加的部分；文件不存在时与 reset() 相同
+
+        运行中检测到的轮转、截断和改写仍然从新内容的开头读取。
+        """
+        self.reset()
+        try:
+            with open(self.file_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                self.fingerprint = (st.st_dev, st.st_ino)
+                self.size = self.offset = st.st_size
+                marker_size = min(st.st_size, TAIL_MARKER_SIZE)
+                self.tail_marker = self._read_at(f, st.st_size - marker_size, marker_size)
+        except FileNotFoundError:
+            pass
+
+    def read_new(self):
+        """读取自上次以来新增的内容
+
+        返回 (text, reason)，reason 为 "first"、"rotated"、"truncated"、
+        "rewritten"、"appended" 或 None（没有新内容）。
+        """
+        with open(self.file_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            fingerprint = (st.st_dev, st.st_ino)
+            size = st.st_size
+
+            reason = "appended"
+            if self.fingerprint is None:
+                reason = "first"
+                self._restart()
+            elif fingerprint != self.fingerprint:
+                reason = "rotated"
+                self._restart()
+            elif size < self.offset:
+                reason = "truncated"
+                self._restart()
+            elif self.tail_marker and self._read_at(f, self.offset - len(self.tail_marker), len(self.tail_marker)) != self.tail_marker:
+                reason = "rewritten"
+                self._restart()
+
+            self.fingerprint = fingerprint
+            self.size = size
+
+            if size <= self.offset:
+                return "", (None if reason == "appended" else reason)
+
+            data = self._read_at(f, self.offset, min(size - self.offset, self.max_read_bytes))
+
+        self.offset += len(data)
+        if len(data) >= TAIL_MARKER_SIZE:
+            self.tail_marker = data[-TAIL_MARKER_SIZE:]
+        else:
+            self.tail_marker = (self.tail_marker + data)[-TAIL_MARKER_SIZE:]
+        return self._decoder.decode(data), reason
+
+    def _restart(self):
+        self.offset = 0
+        self.tail_marker = b""
+        self._decoder.reset()
+
+    @staticmethod
+    def _read_at(f, offset, length):
+        f.seek(offset)
+        return f.read(length)
@@ -0,0 +1,191 @@
+import os
+import sys
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+from logger_config import get_logger
+
+logger = get_logger("FileWatcher")
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+
+# 关注的事件：写入、写入关闭、原子替换（rename 到目标文件名）以及新建
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_libc = None
+
+
+def _load_libc():
+    """加载 libc 并检查 inotify 接口是否可用"""
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify 仅在 Linux 上可用")
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        _libc = libc
+    return _libc
+
+
+class PollingWatcher:
+    """基于固定间隔的轮询等待，作为 inotify 不可用时的后备方案"""
+
+    name = "polling"
+
+    def __init__(self, file_path, interval=0.5):
+        self.file_path = file_path
+        self.interval = interval
+        self._wakeup_event = threading.Event()
+
+    def wait(self, timeout=None):
+        """等待一个轮询周期，返回 True 表示调用方需要检查文件状态"""
+        self._wakeup_event.wait(self.interval if timeout is None else min(timeout, self.interval))
+        self._wakeup_event.clear()
+        return True
+
+    def wakeup(self):
+        """唤醒正在等待的监控线程（用于停止监控）"""
+        self._wakeup_event.set()
+
+    def close(self):
+        self._wakeup_event.set()
+
+
+class InotifyWatcher:
+    """基于 Linux inotify 的事件驱动等待
+
+    监听文件所在目录而不是文件本身，这样文件被原子替换（写临时文件后 rename）
+    时也能收到 IN_MOVED_TO 事件，而不会因为旧 inode 被删除而丢失监听。
+    """
+
+    name = "inotify"
+
+    def __init__(self, file_path):
+        self.file_path = os.path.abspath(file_path)
+        self.dir_path = os.path.dirname(self.file_path)
+        self.file_name = os.fsencode(os.path.basename(self.file_path))
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 失败: {os.strerror(errno)}")
+        self._wd = -1
+        # 用于从其他线程唤醒 select 的自管道
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._closed = False
+        if not self._add_watch():
+            self.close()
+            raise OSError(f"无法监听目录: {self.dir_path}")
+
+    def _add_watch(self):
+        """为文件所在目录添加监听，目录不存在时返回 False"""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(self.dir_path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            logger.warning(f"添加 inotify 监听失败: {self.dir_path}: {os.strerror(errno)}")
+            self._wd = -1
+            return False
+        self._wd = wd
+        return True
+
+    def wait(self, timeout=None):
+        """阻塞直到目标文件发生变化或超时，返回 True 表示收到相关事件"""
+        if self._closed:
+            return False
+        if self._wd < 0 and not self._add_watch():
+            # 目录暂时不存在，退化为按超时等待
+            select.select([self._wakeup_r], [], [], 0.5 if timeout is None else timeout)
+            self._drain_wakeup()
+            return True
+
+        readable, _, _ = select.select([self._fd, self._wakeup_r], [], [], timeout)
+        if self._wakeup_r in readable:
+            self._drain_wakeup()
+        if self._fd in readable:
+            return self._read_events()
+        return False
+
+    def _read_events(self):
+        """读取并解析所有待处理事件，判断是否涉及目标文件"""
+        matched = False
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(buf):
+                wd, mask, _cookie, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = buf[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+                if mask & IN_IGNORED or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    # 目录本身被删除或移动，下次等待时重新添加监听
+                    self._wd = -1
+                    matched = True
+                elif name == self.file_name:
+                    matched = True
+        return matched
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wakeup(self):
+        """唤醒正在等待的监控线程（用于停止监控）"""
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for fd in (self._fd, self._wakeup_r, self._wakeup_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def create_watcher(file_path, backend="auto", poll_interval=0.5):
+    """创建文件变化等待器
+
+    backend 可选 "auto"、"inotify"、"polling"。"auto" 在 inotify 可用时使用
+    inotify，否则退回到 stat 轮询。
+    """
+    if backend not in ("auto", "inotify", "polling"):
+        raise ValueError(f"未知的文件监听后端: {backend}")
+
+    if backend in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(file_path)
+        except (OSError, AttributeError) as e:
+            if backend == "inotify":
+                raise
+            logger.info(f"inotify 不可用，使用轮询方式监听文件: {e}")
+
+    return PollingWatcher(file_path, interval=poll_interval)
@@ -0,0 +1,469 @@
+import io
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from logger_config import get_logger
+from result_store import VERDICT_OK
+
+logger = get_logger("ImageArchive")
+
+ARCHIVE_DIR_NAME = "archive"
+# 已归档图片在检测结果索引中的 image_path：archive/<段文件名>#<条目序号>
+LOCATOR_PREFIX = ARCHIVE_DIR_NAME + "/"
+
+SEGMENT_MAGIC = b"MLSEG001"
+INDEX_MAGIC = b"MLIDX001"
+# 索引条目：段内偏移、长度、检测结果 id、检测时间，小端定长 28 字节
+INDEX_RECORD = struct.Struct("<QIqd")
+SEGMENT_NAME = re.compile(r"^(?P<verdict>[A-Z]+)-(?P<day>\d{8})-(?P<seq>\d{3})\.seg$")
+
+DEFAULT_SEGMENT_MAX_MB = 256
+# 同时保持映射的段文件数
+MAX_OPEN_SEGMENTS = 32
+
+
+def is_archived(image_path):
+    return bool(image_path) and image_path.startswith(LOCATOR_PREFIX) and "#" in image_path
+
+
+def parse_locator(image_path):
+    """archive/<段文件名>#<序号> -> (段文件名, 序号)"""
+    name, _, entry = image_path[len(LOCATOR_PREFIX):].partition("#")
+    if not SEGMENT_NAME.match(name) or not entry.isdigit():
+        raise ValueError(f"无效的归档路径: {image_path}")
+    return name, int(entry)
+
+
+class ArchivedImage:
+    """段文件中的一张图片"""
+    __slots__ = ("locator", "segment_path", "offset", "length", "result_id", "created_at")
+
+    def __init__(self, locator, segment_path, offset, length, result_id, created_at):
+        self.locator = locator
+        self.segment_path = segment_path
+        self.offset = offset
+        self.length = length
+        self.result_id = result_id
+        self.created_at = created_at
+
+
+class ImageArchive:
+    """一个工位的图片归档：按天追加写入的段文件 + 定长偏移索引
+
+    <images_dir>/archive/ 下每个段文件 <判定>-<YYYYMMDD>-<序号>.seg 以 SEGMENT_MAGIC 开头，
+    后面依次是各图片的 JPEG 字节；同名 .idx 文件以 INDEX_MAGIC 开头，每张图片一个
+    INDEX_RECORD（偏移、长度、检测结果 id、检测时间）。段文件只追加，超过
+    segment_max_bytes 后开始下一个序号。先写入并 fsync 图片数据，再追加索引，
+    索引中的条目一定可以读取。
+
+    读取时用 mmap 映射索引和段文件，按条目序号直接定位，段文件追加后自动重新映射。
+    """
+
+    def __init__(self, directory, segment_max_bytes=DEFAULT_SEGMENT_MAX_MB * 1024 * 1024):
+        self.directory = Path(directory)
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        self._maps = OrderedDict()
+        self._write_lock = threading.Lock()
+
+    def _paths(self, name):
+        segment = self.directory / name
+        return segment, segment.with_suffix(".idx")
+
+    def segment_names(self):
+        if not self.directory.is_dir():
+            return []
+        return sorted(entry.name for entry in os.scandir(self.directory) if SEGMENT_NAME.match(entry.name))
+
+    def _current_segment(self, verdict, day):
+        """当天可以继续追加的段文件名"""
+        prefix = f"{verdict}-{day}-"
+        existing = [name for name in self.segment_names() if name.startswith(prefix)]
+        if existing:
+            last = existing[-1]
+            if (self.directory / last).stat().st_size < self.segment_max_bytes:
+                return last
+            seq = int(SEGMENT_NAME.match(last).group("seq")) + 1
+        else:
+            seq = 1
+        return f"{prefix}{seq:03d}.seg"
+
+    def append(self, verdict, day, items):
+        """追加一批图片，items 为 [(检测结果 id, 检测时间, JPEG 字节)]，返回各图片的 image_path"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._write_lock:
+            name = self._current_segment(verdict, day)
+            segment_path, index_path = self._paths(name)
+            locators = []
+            records = []
+            with open(segment_path, "ab") as segment, open(index_path, "ab") as index:
+                if segment.tell() == 0:
+                    segment.write(SEGMENT_MAGIC)
+                if index.tell() == 0:
+                    index.write(INDEX_MAGIC)
+                # 上次写索引时中断留下的不完整条目
+                entry, partial = divmod(index.tell() - len(INDEX_MAGIC), INDEX_RECORD.size)
+                if partial:
+                    index.truncate(len(INDEX_MAGIC) + entry * INDEX_RECORD.size)
+                for result_id, created_at, data in items:
+                    offset = segment.tell()
+                    segment.write(data)
+                    records.append(INDEX_RECORD.pack(offset, len(data), result_id, created_at))
+                    locators.append(f"{LOCATOR_PREFIX}{name}#{entry}")
+                    entry += 1
+                segment.flush()
+                os.fsync(segment.fileno())
+                index.write(b"".join(records))
+                index.flush()
+                os.fsync(index.fileno())
+        return locators
+
+    def _mapping(self, path, needed):
+        """path 的只读映射，长度不足 needed 时重新映射（调用方持有锁）"""
+        mapped = self._maps.get(path)
+        if mapped is not None and len(mapped) >= needed:
+            self._maps.move_to_end(path)
+            return mapped
+        if mapped is not None:
+            mapped.close()
+            del self._maps[path]
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapped) < needed:
+            mapped.close()
+            raise FileNotFoundError(f"归档文件不完整: {path}")
+        self._maps[path] = mapped
+        while len(self._maps) > MAX_OPEN_SEGMENTS * 2:
+            _, evicted = self._maps.popitem(last=False)
+            evicted.close()
+        return mapped
+
+    def locate(self, image_path):
+        """image_path 对应的 ArchivedImage，不存在时抛出 FileNotFoundError"""
+        name, entry = parse_locator(image_path)
+        segment_path, index_path = self._paths(name)
+        start = len(INDEX_MAGIC) + entry * INDEX_RECORD.size
+        try:
+            with self._lock:
+                index = self._mapping(index_path, start + INDEX_RECORD.size)
+                offset, length, result_id, created_at = INDEX_RECORD.unpack_from(index, start)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"归档图片不存在: {image_path}")
+        return ArchivedImage(image_path, segment_path, offset, length, result_id, created_at)
+
+    def read(self, image_path):
+        """读取已归档的图片"""
+        image = self.locate(image_path)
+        with self._lock:
+            segment = self._mapping(image.segment_path, image.offset + image.length)
+            return segment[image.offset:image.offset + image.length]
+
+    def entries(self, name):
+        """段文件的全部索引条目 [(偏移, 长度, 检测结果 id, 检测时间)]"""
+        _, index_path = self._paths(name)
+        data = index_path.read_bytes()[len(INDEX_MAGIC):]
+        usable = len(data) - len(data) % INDEX_RECORD.size
+        return list(INDEX_RECORD.iter_unpack(data[:usable]))
+
+    def segment_day(self, name):
+        return datetime.strptime(SEGMENT_NAME.match(name).group("day"), "%Y%m%d")
+
+    def remove_segment(self, name):
+        segment_path, index_path = self._paths(name)
+        with self._lock:
+            for path in (segment_path, index_path):
+                mapped = self._maps.pop(path, None)
+                if mapped is not None:
+                    mapped.close()
+        for path in (index_path, segment_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        names = self.segment_names()
+        total = 0
+        entries = 0
+        for name in names:
+            segment_path, index_path = self._paths(name)
+            try:
+                total += segment_path.stat().st_size
+                entries += (index_path.stat().st_size - len(INDEX_MAGIC)) // INDEX_RECORD.size
+            except FileNotFoundError:
+                continue
+        return {"segments": len(names), "bytes": total, "images": entries}
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+
+
+def reencode(data, quality=None, max_dimension=None):
+    """按较低的质量或分辨率重新压缩 JPEG，结果不比原图小时返回原图"""
+    if quality is None and max_dimension is None:
+        return data
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        if max_dimension:
+            image.draft("RGB", (max_dimension, max_dimension))
+        converted = image.convert("RGB")
+    if max_dimension:
+        converted.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    buffer = io.BytesIO()
+    converted.save(buffer, format="JPEG", quality=quality or 80, optimize=True)
+    encoded = buffer.getvalue()
+    return encoded if len(encoded) < len(data) else data
+
+
+class ArchivePolicy:
+    """工位的图片归档策略
+
+    after_days 天以前的 OK 图片打包进段文件（原文件删除）；quality/max_dimension
+    设置时重新压缩（JPEG 质量、最长边像素）；retention_days 设置时删除更早的段文件，
+    对应检测结果保留、图片路径清空。
+    """
+
+    __slots__ = ("after_days", "quality", "max_dimension", "retention_days", "segment_max_mb")
+
+    def __init__(self, after_days=7, quality=None, max_dimension=None, retention_days=None,
+                 segment_max_mb=DEFAULT_SEGMENT_MAX_MB):
+        self.after_days = float(after_days)
+        self.quality = int(quality) if quality else None
+        self.max_dimension = int(max_dimension) if max_dimension else None
+        self.retention_days = float(retention_days) if retention_days else None
+        self.segment_max_mb = float(segment_max_mb)
+        if self.retention_days is not None and self.retention_days < self.after_days:
+            raise ValueError("归档策略的 retention_days 不能小于 after_days")
+
+    @classmethod
+    def from_dict(cls, config):
+        config = dict(config or {})
+        unknown = set(config) - set(cls.__slots__)
+        if unknown:
+            raise ValueError(f"归档策略的配置项未知: {', '.join(sorted(unknown))}")
+        return cls(**config)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _Target:
+    __slots__ = ("station_id", "result_store", "archive", "policy")
+
+    def __init__(self, station_id, result_store, archive, policy):
+        self.station_id = station_id
+        self.result_store = result_store
+        self.archive = archive
+        self.policy = policy
+
+
+class ImageCompactor:
+    """后台归档任务：按各工位的 ArchivePolicy 把旧的 OK 图片打包进段文件
+
+    所有工位共用一个低优先级线程，每 interval 秒执行一次（也可以 run_now()）。
+    每批最多 batch_size 张图片：读取原图、按需重新压缩（无法解码的图片按原字节归档）、
+    追加到当天的段文件，在一个事务中把检测结果的 image_path 改为归档路径，最后删除
+    原文件和空目录。
+    读写字节数受 io_budget（字节/秒）限制；busy() 返回 True（例如图片写入线程池有
+    排队的检测图片）时暂停，让实时写入优先使用磁盘。
+    """
+
+    def __init__(self, busy=None, io_budget=8 * 1024 * 1024, interval=600.0, batch_size=64,
+                 backoff_interval=0.5):
+        self.busy = busy
+        self.io_budget = io_budget
+        self.interval = interval
+        self.batch_size = batch_size
+        self.backoff_interval = backoff_interval
+        self._targets = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+        self._allowance = 0.0
+        self._allowance_at = time.monotonic()
+        self._counters = {"runs": 0, "archived": 0, "missing": 0, "undecodable": 0, "errors": 0,
+                          "bytes_read": 0, "bytes_written": 0, "segments_removed": 0, "expired": 0, "backoffs": 0}
+        self._throttled_seconds = 0.0
+        self._last_run = None
+        self._running = False
+
+    def add(self, station_id, result_store, archive, policy):
+        with self._lock:
+            self._targets.append(_Target(station_id, result_store, archive, policy))
+        logger.info(f"工位 {station_id} 启用图片归档: {policy.to_dict()}")
+
+    def start(self):
+        if not self._targets or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ImageCompactor", daemon=True)
+        self._thread.start()
+
+    def run_now(self):
+        self._wake_event.set()
+
+    def close(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        # 只降低本线程的 CPU 优先级（Linux 上 setpriority 可以作用于单个线程）
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop_event.is_set():
+            self.run_once()
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+    def run_once(self):
+        """对所有工位执行一轮归档和过期清理"""
+        with self._lock:
+            targets = list(self._targets)
+            self._running = True
+        try:
+            for target in targets:
+                if self._stop_event.is_set():
+                    break
+                try:
+                    self._compact(target)
+                    self._expire(target)
+                except Exception as e:
+                    self._count("errors")
+                    logger.error(f"工位 {target.station_id} 图片归档出错: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._running = False
+                self._counters["runs"] += 1
+                self._last_run = time.time()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _throttle(self, nbytes):
+        """等待实时写入空闲并消耗 nbytes 的 I/O 额度，停止时返回 False"""
+        while self.busy is not None and self.busy():
+            self._count("backoffs")
+            if self._stop_event.wait(self.backoff_interval):
+                return False
+            with self._lock:
+                self._throttled_seconds += self.backoff_interval
+        if not self.io_budget:
+            return not self._stop_event.is_set()
+        now = time.monotonic()
+        # 额度按 io_budget 每秒恢复，最多积累一秒
+        self._allowance = min(self.io_budget, self._allowance + (now - self._allowance_at) * self.io_budget)
+        self._allowance_at = now
+        self._allowance -= nbytes
+        if self._allowance < 0:
+            delay = -self._allowance / self.io_budget
+            with self._lock:
+                self._throttled_seconds += delay
+            if self._stop_event.wait(delay):
+                return False
+        return True
+
+    def _compact(self, target):
+        policy = target.policy
+        before = time.time() - policy.after_days * 86400
+        target.archive.segment_max_bytes = int(policy.segment_max_mb * 1024 * 1024)
+        while not self._stop_event.is_set():
+            rows = target.result_store.aged_images(VERDICT_OK, before, self.batch_size)
+            if not rows:
+                return
+            by_day = OrderedDict()
+            missing = []
+            sources = []
+            for row in rows:
+                path = target.result_store.resolve(row["image_path"])
+                try:
+                    size = path.stat().st_size
+                    if not self._throttle(size):
+                        return
+                    data = path.read_bytes()
+                except FileNotFoundError:
+                    missing.append(row["id"])
+                    continue
+                try:
+                    encoded = reencode(data, policy.quality, policy.max_dimension)
+                except Exception as e:
+                    # 截断或损坏的图片不能让整批失败：按时间排序，它会一直排在下一批的最前面
+                    encoded = data
+                    self._count("undecodable")
+                    logger.warning(f"工位 {target.station_id} 的图片无法解码，按原字节归档: {path}: {e}")
+                day = datetime.fromtimestamp(row["created_at"]).strftime("%Y%m%d")
+                by_day.setdefault(day, []).append((row["id"], row["created_at"], encoded))
+                sources.append(path)
+                self._count("bytes_read", len(data))
+            updates = []
+            for day, items in by_day.items():
+                written = sum(len(data) for _, _, data in items)
+                if not self._throttle(written):
+                    return
+                locators = target.archive.append(VERDICT_OK, day, items)
+                updates.extend((locator, len(data), result_id)
+                               for locator, (result_id, _, data) in zip(locators, items))
+                self._count("bytes_written", written)
+            # 先更新索引再删除原文件：中途退出时最多留下段文件中未被引用的数据
+            target.result_store.set_image_paths(updates)
+            for result_id in missing:
+                target.result_store.mark_image_missing(result_id)
+            for path in sources:
+                self._remove_source(path, target.result_store.images_root)
+            self._count("archived", len(updates))
+            self._count("missing", len(missing))
+            logger.info(f"工位 {target.station_id} 已归档 {len(updates)} 张OK图片")
+
+    @staticmethod
+    def _remove_source(path, images_root):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return
+        # 删除变空的 年/月/日 目录，保留 OK/NG 目录本身
+        parent = path.parent
+        while images_root in parent.parent.parents:
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+            parent = parent.parent
+
+    def _expire(self, target):
+        if target.policy.retention_days is None:
+            return
+        cutoff = datetime.fromtimestamp(time.time() - target.policy.retention_days * 86400)
+        cutoff = cutoff.replace(hour=0, minute=0, second=0, microsecond=0)
+        for name in target.archive.segment_names():
+            if target.archive.segment_day(name) >= cutoff:
+                continue
+            cleared = target.result_store.clear_image_paths(f"{LOCATOR_PREFIX}{name}#")
+            target.archive.remove_segment(name)
+            self._count("segments_removed")
+            self._count("expired", cleared)
+            logger.info(f"工位 {target.station_id} 已删除过期的归档段 {name}（{cleared} 张图片）")
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._counters)
+            result.update({
+                "stations": len(self._targets),
+                "running": int(self._running),
+                "throttled_seconds": round(self._throttled_seconds, 1),
+                "last_run": self._last_run,
+            })
+            return result
@@ -0,0 +1,307 @@
+import os
+import time
+import queue
+import itertools
+import threading
+from pathlib import Path
+from logger_config import get_logger
+
+# 队列满时的处理策略
+OVERFLOW_BLOCK = "block"              # 阻塞等待 block_timeout 秒，仍满则丢弃新任务
+OVERFLOW_DROP_NEWEST = "drop_newest"  # 立即丢弃新任务
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # 丢弃队列中最旧的任务，为新任务腾出位置
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST)
+
+# 唤醒阻塞在空队列上的工作线程；停止由 _stop_event 表示，队列满时不放入
+_STOP = object()
+# 队列为空时工作线程检查停止信号的间隔（秒）
+STOP_CHECK_INTERVAL = 0.5
+
+
+class ImageWriteJob:
+    """一次图片写入任务：data 为图片字节，或 source_path 为已写好的临时文件"""
+
+    __slots__ = ("filepath", "data", "source_path", "submitted_at", "on_done")
+
+    def __init__(self, filepath, data=None, source_path=None, on_done=None):
+        self.filepath = Path(filepath)
+        self.data = data
+        self.source_path = Path(source_path) if source_path else None
+        self.submitted_at = time.monotonic()
+        self.on_done = on_done
+
+    def discard(self):
+        """任务被丢弃时清理已写好的临时文件"""
+        if self.source_path:
+            self.source_path.unlink(missing_ok=True)
+
+
+class ImageWriterPool:
+    """有界的后台图片写入线程池
+
+    检测结果先放行 PLC，再把图片交给本线程池写盘。队列有上限，满时按
+    overflow_policy 施加背压或丢弃任务；每个工作线程把写好的文件攒成一批，
+    达到 fsync_batch 个或等待超过 fsync_interval 秒后统一 fsync、rename，
+    并对涉及的目录做一次 fsync。
+    """
+
+    def __init__(self, num_workers=2, max_queue=64, overflow_policy=OVERFLOW_BLOCK,
+                 block_timeout=1.0, fsync_batch=8, fsync_interval=0.5):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的队列溢出策略: {overflow_policy}")
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.fsync_batch = max(1, fsync_batch)
+        self.fsync_interval = fsync_interval
+        self.logger = get_logger("ImageWriter")
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._tmp_seq = itertools.count()
+        self._stats_lock = threading.Lock()
+        self._idle = threading.Condition(self._stats_lock)
+        self._unfinished = 0
+        self._accepting = True
+        self._stop_event = threading.Event()
+        self._stats = {
+            "submitted": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "bytes_written": 0,
+            "fsync_batches": 0,
+        }
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"ImageWriter-{i}")
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        self.logger.info(f"图片写入线程池已启动: 线程数 {num_workers}, 队列上限 {max_queue}, 溢出策略 {overflow_policy}")
+
+    @property
+    def queue_depth(self):
+        """当前排队等待写入的任务数"""
+        return self._queue.qsize()
+
+    def submit(self, filepath, data=None, source_path=None, on_done=None):
+        """提交写入任务，返回 False 表示任务因队列已满或已关闭被丢弃
+
+        on_done(filepath, error) 在写入完成（fsync 之后）或失败时于工作线程中调用。
+        """
+        job = ImageWriteJob(filepath, data=data, source_path=source_path, on_done=on_done)
+        with self._stats_lock:
+            if not self._accepting:
+                self._stats["dropped"] += 1
+                accepted = False
+            else:
+                self._stats["submitted"] += 1
+                self._unfinished += 1
+                accepted = True
+        if not accepted:
+            self.logger.warning(f"图片写入线程池已关闭，丢弃任务: {job.filepath}")
+            job.discard()
+            return False
+
+        if self._enqueue(job):
+            return True
+
+        self.logger.warning(f"图片写入队列已满({self.max_queue})，丢弃任务: {job.filepath}")
+        self._drop(job)
+        return False
+
+    def _enqueue(self, job):
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            try:
+                self._queue.put(job, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                return False
+
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+                return False
+
+        # drop_oldest：腾出位置后重试，竞争失败时丢弃新任务
+        try:
+            oldest = self._queue.get_nowait()
+        except queue.Empty:
+            oldest = None
+        if oldest is not None and oldest is not _STOP:
+            self.logger.warning(f"图片写入队列已满，丢弃最旧任务: {oldest.filepath}")
+            self._drop(oldest)
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            return False
+
+    def _drop(self, job):
+        job.discard()
+        self._finish(dropped=1)
+
+    def _finish(self, written=0, failed=0, dropped=0, nbytes=0):
+        with self._stats_lock:
+            self._stats["written"] += written
+            self._stats["failed"] += failed
+            self._stats["dropped"] += dropped
+            self._stats["bytes_written"] += nbytes
+            self._unfinished -= written + failed + dropped
+            if self._unfinished <= 0:
+                self._idle.notify_all()
+
+    def _worker_loop(self):
+        pending = []
+        batch_deadline = None
+        while True:
+            timeout = STOP_CHECK_INTERVAL
+            if pending:
+                timeout = max(0.0, batch_deadline - time.monotonic())
+            try:
+                job = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                job = None
+
+            if job is _STOP or self._stop_event.is_set():
+                # 关闭超时后取到的任务不再写入，由 shutdown 统一丢弃
+                if job is not None and job is not _STOP:
+                    self._drop(job)
+                self._commit_batch(pending)
+                break
+
+            if job is not None:
+                entry = self._write(job)
+                if entry:
+                    if not pending:
+                        batch_deadline = time.monotonic() + self.fsync_interval
+                    pending.append(entry)
+
+            # 批次已满、等待超时或队列已空时统一提交
+            if pending and (len(pending) >= self.fsync_batch
+                            or time.monotonic() >= batch_deadline
+                            or self._queue.empty()):
+                self._commit_batch(pending)
+                pending = []
+
+    def _write(self, job):
+        """把任务内容写入临时文件（暂不 fsync），返回 (job, 临时文件, 字节数)"""
+        try:
+            job.filepath.parent.mkdir(parents=True, exist_ok=True)
+            if job.source_path:
+                return job, job.source_path, job.source_path.stat().st_size
+            tmp_path = job.filepath.with_name(f"{job.filepath.name}.{next(self._tmp_seq)}.part")
+            with open(tmp_path, 'wb') as f:
+                f.write(job.data)
+            return job, tmp_path, len(job.data)
+        except Exception as e:
+            self.logger.error(f"写入图片失败: {job.filepath}: {e}", exc_info=True)
+            job.discard()
+            self._finish(failed=1)
+            self._notify(job, e)
+            return None
+
+    def _commit_batch(self, pending):
+        """对一批临时文件做 fsync 后 rename 到目标路径，并 fsync 所在目录"""
+        if not pending:
+            return
+        dirs = set()
+        for job, tmp_path, nbytes in pending:
+            try:
+                fd = os.open(tmp_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(tmp_path, job.filepath)
+                dirs.add(job.filepath.parent)
+            except Exception as e:
+                self.logger.error(f"提交图片失败: {job.filepath}: {e}", exc_info=True)
+                job.discard()
+                self._finish(failed=1)
+                self._notify(job, e)
+                continue
+            self._finish(written=1, nbytes=nbytes)
+            self.logger.info(f"图片已保存: {job.filepath}")
+            self._notify(job, None)
+
+        for dir_path in dirs:
+            try:
+                fd = os.open(dir_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                self.logger.warning(f"目录 fsync 失败: {dir_path}: {e}")
+        with self._stats_lock:
+            self._stats["fsync_batches"] += 1
+
+    def _notify(self, job, error):
+        if job.on_done:
+            try:
+                job.on_done(job.filepath, error)
+            except Exception as e:
+                self.logger.error(f"图片写入回调出错: {e}", exc_info=True)
+
+    def flush(self, timeout=None):
+        """等待已提交的任务全部写入完成，超时返回 False"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._unfinished <= 0, timeout=timeout)
+
+    def shutdown(self, timeout=10.0):
+        """停止接收新任务，写完队列中的任务后退出工作线程
+
+        超时后不再等待：通知工作线程提交手中的批次后退出，队列中剩余的任务丢弃。
+        不会因为队列已满而阻塞。
+        """
+        with self._stats_lock:
+            if not self._accepting:
+                return True
+            self._accepting = False
+        self.logger.info(f"关闭图片写入线程池，剩余任务: {self.queue_depth}")
+        deadline = time.monotonic() + timeout
+        flushed = self.flush(timeout)
+        self._stop_event.set()
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                # 队列满时工作线程不会阻塞在 get 上，下次取任务时就会看到停止信号
+                break
+        for worker in self._workers:
+            worker.join(timeout=max(0.0, deadline - time.monotonic()))
+        discarded = self._discard_queued()
+        if not flushed:
+            self.logger.warning(f"图片写入线程池未能在超时时间内写完所有任务，丢弃排队中的 {discarded} 个任务")
+        else:
+            self.logger.info("图片写入线程池已关闭")
+        return flushed
+
+    def _discard_queued(self):
+        """丢弃关闭后仍在队列中的任务，返回丢弃的数量"""
+        discarded = 0
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return discarded
+            if job is not _STOP:
+                self._drop(job)
+                discarded += 1
+
+    def stats(self):
+        """返回队列深度、溢出策略及计数器"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+            "workers": self.num_workers,
+            "accepting": self._accepting,
+        })
+        return stats
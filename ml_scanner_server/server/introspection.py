@@ -0,0 +1,239 @@
+import math
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import Counter
+from logger_config import get_logger
+
+logger = get_logger("Introspection")
+
+# 采样分析的最长时间和最小采样间隔，分析期间占用一个请求线程
+MAX_PROFILE_SECONDS = 60.0
+DEFAULT_PROFILE_SECONDS = 5.0
+DEFAULT_PROFILE_INTERVAL = 0.01
+MIN_PROFILE_INTERVAL = 0.001
+
+_locks = weakref.WeakSet()
+_locks_guard = threading.Lock()
+
+
+class InstrumentedLock:
+    """记录等待和持有时间的 threading.Lock，用法相同
+
+    未被占用时只多一次非阻塞获取和两次计时；被占用时记录等待时间。计数在持有锁时
+    更新，不需要另外加锁。创建的锁登记在模块中，lock_stats() 汇总所有仍存在的锁，
+    并给出当前持有者和已持有的时间，用于发现卡住的线程和锁争用。
+    """
+    __slots__ = ("name", "_lock", "_owner", "_acquired_at", "acquisitions", "contended",
+                 "wait_seconds", "wait_max", "hold_seconds", "hold_max", "__weakref__")
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._owner = None
+        self._acquired_at = None
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.wait_max = 0.0
+        self.hold_seconds = 0.0
+        self.hold_max = 0.0
+        with _locks_guard:
+            _locks.add(self)
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self._acquired_at = time.perf_counter()
+        else:
+            if not blocking:
+                return False
+            started = time.perf_counter()
+            if not self._lock.acquire(True, timeout):
+                return False
+            self._acquired_at = time.perf_counter()
+            waited = self._acquired_at - started
+            self.contended += 1
+            self.wait_seconds += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+        self._owner = threading.get_ident()
+        self.acquisitions += 1
+        return True
+
+    def release(self):
+        if self._acquired_at is None:
+            # 未持有时与 threading.Lock 一样抛出 RuntimeError
+            self._lock.release()
+        held = time.perf_counter() - self._acquired_at
+        self.hold_seconds += held
+        if held > self.hold_max:
+            self.hold_max = held
+        self._owner = None
+        self._acquired_at = None
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def stats(self, thread_names=None):
+        owner, acquired_at = self._owner, self._acquired_at
+        acquisitions = self.acquisitions
+        holder = None
+        if owner is not None and acquired_at is not None:
+            holder = {"thread": (thread_names or {}).get(owner, owner),
+                      "held_ms": round((time.perf_counter() - acquired_at) * 1000, 3)}
+        return {
+            "name": self.name,
+            "acquisitions": acquisitions,
+            "contended": self.contended,
+            "wait_ms_total": round(self.wait_seconds * 1000, 3),
+            "wait_ms_max": round(self.wait_max * 1000, 3),
+            "hold_ms_total": round(self.hold_seconds * 1000, 3),
+            "hold_ms_avg": round(self.hold_seconds / acquisitions * 1000, 3) if acquisitions else None,
+            "hold_ms_max": round(self.hold_max * 1000, 3),
+            "holder": holder,
+        }
+
+
+def lock_stats():
+    """所有 InstrumentedLock 的等待/持有统计，按名称排序"""
+    with _locks_guard:
+        locks = list(_locks)
+    names = {t.ident: t.name for t in threading.enumerate()}
+    return sorted((lock.stats(names) for lock in locks), key=lambda s: s["name"])
+
+
+def thread_group(name):
+    """线程名去掉编号，例如 ImageWriter-3 -> ImageWriter-N，用于按类统计线程数"""
+    return re.sub(r"\d+", "N", name)
+
+
+def thread_counts():
+    threads = threading.enumerate()
+    groups = Counter(thread_group(t.name) for t in threads)
+    return {
+        "total": len(threads),
+        "daemon": sum(1 for t in threads if t.daemon),
+        "groups": dict(sorted(groups.items())),
+    }
+
+
+def thread_dump():
+    """所有线程的当前调用栈"""
+    frames = sys._current_frames()
+    threads = []
+    for thread in sorted(threading.enumerate(), key=lambda t: t.name):
+        frame = frames.get(thread.ident)
+        threads.append({
+            "name": thread.name,
+            "ident": thread.ident,
+            "native_id": thread.native_id,
+            "daemon": thread.daemon,
+            "stack": traceback.format_stack(frame) if frame is not None else [],
+        })
+    return threads
+
+
+def format_thread_dump(threads):
+    """文本格式的线程栈，类似 faulthandler.dump_traceback 的输出"""
+    parts = []
+    for thread in threads:
+        daemon = " daemon" if thread["daemon"] else ""
+        parts.append(f'Thread "{thread["name"]}" (ident {thread["ident"]}, native {thread["native_id"]}{daemon}):\n')
+        parts.extend(thread["stack"])
+        parts.append("\n")
+    return "".join(parts)
+
+
+def _frame_label(code, lineno):
+    filename = os.path.basename(code.co_filename)
+    if lineno is None:
+        return f"{code.co_name} ({filename})"
+    return f"{code.co_name} ({filename}:{lineno})"
+
+
+class SamplingProfiler:
+    """对运行中的进程做定时采样，输出折叠栈（flamegraph.pl / speedscope 可直接读取）
+
+    每隔 interval 秒用 sys._current_frames() 取一次所有线程的调用栈，每行为
+    "线程名;最外层函数;...;最内层函数 次数"。线程名已去掉编号，同类线程合并。
+    采样在调用线程中进行，同一时间只允许一次采样（profile() 返回 None 表示已有采样
+    在进行）。阻塞在 I/O 或锁上的线程同样会被采到，可以用 thread 只采样名称以此开头
+    的线程。
+    """
+
+    def __init__(self):
+        self._running = threading.Lock()
+        self.last_run = None
+
+    def profile(self, seconds=DEFAULT_PROFILE_SECONDS, interval=DEFAULT_PROFILE_INTERVAL, thread=None,
+                lines=False):
+        seconds, interval = float(seconds), float(interval)
+        if not (math.isfinite(seconds) and math.isfinite(interval)):
+            raise ValueError("seconds 和 interval 必须是有限的数")
+        seconds = min(max(seconds, 0.0), MAX_PROFILE_SECONDS)
+        interval = max(interval, MIN_PROFILE_INTERVAL)
+        if not self._running.acquire(False):
+            return None
+        try:
+            logger.info(f"开始采样分析: {seconds:g} 秒, 间隔 {interval * 1000:g} 毫秒")
+            stacks = Counter()
+            labels = {}
+            own_ident = threading.get_ident()
+            samples = 0
+            started = time.monotonic()
+            deadline = started + seconds
+            next_sample = started
+            while True:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    name = names.get(ident, str(ident))
+                    if thread and not name.startswith(thread):
+                        continue
+                    parts = []
+                    while frame is not None:
+                        code = frame.f_code
+                        key = (code, frame.f_lineno) if lines else code
+                        label = labels.get(key)
+                        if label is None:
+                            label = labels[key] = _frame_label(code, frame.f_lineno if lines else None)
+                        parts.append(label)
+                        frame = frame.f_back
+                    parts.append(thread_group(name))
+                    parts.reverse()
+                    stacks[";".join(parts)] += 1
+                samples += 1
+                next_sample += interval
+                now = time.monotonic()
+                if next_sample >= deadline:
+                    break
+                if next_sample > now:
+                    time.sleep(next_sample - now)
+                else:
+                    # 采样本身比间隔慢时不补采
+                    next_sample = now
+            elapsed = time.monotonic() - started
+            self.last_run = {"seconds": round(elapsed, 3), "samples": samples, "stacks": len(stacks)}
+            logger.info(f"采样分析完成: {samples} 次采样, {len(stacks)} 个不同的调用栈")
+            return {"seconds": round(elapsed, 3), "interval": interval, "samples": samples, "stacks": stacks}
+        finally:
+            self._running.release()
+
+    @property
+    def running(self):
+        return self._running.locked()
+
+
+def format_collapsed(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -1,24 +1,239 @@
+import atexit
+import copy
+import gzip
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
 
-def setup_logging(log_dir=None):
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 单个日志文件的最大字节数和保留的历史文件数
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 10
+# 日志队列长度，队列满时丢弃新的日志而不是阻塞调用线程
+DEFAULT_QUEUE_SIZE = 10000
+# 同一行代码的 INFO/DEBUG 日志每秒最多输出的条数（令牌桶速率和容量）
+DEFAULT_RATE_LIMIT = 20.0
+DEFAULT_RATE_BURST = 50
+
+_listener = None
+_queue_handler = None
+_lock = threading.Lock()
+_exception_formatter = logging.Formatter()
+
+
+def _gzip_rotator(source, dest):
+    """轮转时把旧日志压缩为 .gz（在日志线程中执行，不影响业务线程）"""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _gzip_namer(name):
+    return name + '.gz'
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，便于日志系统采集"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        suppressed = getattr(record, 'suppressed', None)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """按调用位置（文件 + 行号）限制 INFO/DEBUG 日志的频率
+
+    每个调用位置一个令牌桶，超出速率的日志被丢弃并计数，下一条放行的日志会
+    附带被省略的条数。WARNING 及以上级别不受限制。
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, burst=DEFAULT_RATE_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.suppressed_total = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                self.suppressed_total += 1
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f"{record.msg} (省略了 {suppressed} 条相同位置的日志)"
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志并计数，保证业务线程永远不会因为写日志而阻塞"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """合并消息参数并把异常堆栈转成文本，格式化留给日志线程"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_module_levels(value):
+    """解析 "PLCManager=WARNING,FileMonitor=DEBUG" 形式的模块日志级别"""
+    levels = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(log_dir=None, level=None, json_format=None, module_levels=None,
+                  max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT, when=None,
+                  compress=True, rate_limit=DEFAULT_RATE_LIMIT, rate_burst=DEFAULT_RATE_BURST,
+                  queue_size=DEFAULT_QUEUE_SIZE, queued=True, console=True):
+    """配置根日志
+
+    日志先放入队列，由后台 QueueListener 线程格式化并写入文件和控制台，业务线程
+    只做一次入队操作。文件按大小（max_bytes）或时间（when，如 'midnight'）轮转，
+    旧文件压缩为 .gz。未传入的参数可以用环境变量覆盖：
+      ML_SCANNER_LOG_LEVEL    根日志级别，默认 INFO
+      ML_SCANNER_LOG_FORMAT   text（默认）或 json（每行一条 JSON）
+      ML_SCANNER_LOG_LEVELS   模块日志级别，如 PLCManager=WARNING,FileMonitor=DEBUG
+    queued=False 时直接在调用线程写日志，rate_limit=None 时不限制日志频率。
+    """
+    global _listener, _queue_handler
+
     if log_dir:
         log_dir_path = Path(log_dir)
         log_dir_path.mkdir(parents=True, exist_ok=True)
         log_file = log_dir_path / 'server.log'
     else:
         log_file = 'server.log'
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
-    )
-    
-    return logging.getLogger()
+
+    level = (level or os.environ.get('ML_SCANNER_LOG_LEVEL') or 'INFO').upper()
+    if json_format is None:
+        json_format = os.environ.get('ML_SCANNER_LOG_FORMAT', 'text').lower() == 'json'
+    if module_levels is None:
+        module_levels = parse_module_levels(os.environ.get('ML_SCANNER_LOG_LEVELS'))
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+
+    if when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=when, backupCount=backup_count, encoding='utf-8')
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    if compress:
+        file_handler.rotator = _gzip_rotator
+        file_handler.namer = _gzip_namer
+    handlers = [file_handler]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    with _lock:
+        shutdown_logging()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+            handler.close()
+        root.setLevel(level)
+
+        if queued:
+            _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+            _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers,
+                                                       respect_handler_level=True)
+            _listener.start()
+            front_handlers = [_queue_handler]
+        else:
+            front_handlers = handlers
+
+        for handler in front_handlers:
+            if rate_limit:
+                handler.addFilter(RateLimitFilter(rate_limit, rate_burst))
+            root.addHandler(handler)
+
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
+
+    return root
+
+
+def shutdown_logging():
+    """停止日志线程并写完队列中剩余的日志，进程退出时自动调用"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        # 队列满时停止标记无法入队，等日志线程消费一部分后重试
+        while True:
+            try:
+                listener.stop()
+                break
+            except queue.Full:
+                time.sleep(0.01)
+        for handler in listener.handlers:
+            handler.flush()
+            handler.close()
+
+
+def logging_stats():
+    """日志队列长度、因队列满丢弃的条数和被限频省略的条数"""
+    root = logging.getLogger()
+    suppressed = sum(f.suppressed_total for h in root.handlers for f in h.filters
+                     if isinstance(f, RateLimitFilter))
+    return {
+        'queue_depth': _queue_handler.queue.qsize() if _listener else 0,
+        'dropped': _queue_handler.dropped if _queue_handler else 0,
+        'suppressed': suppressed,
+    }
+
+
+atexit.register(shutdown_logging)
+
 
 def get_logger(name):
-    return logging.getLogger(name) 
\ No newline at end of file
+    return logging.getLogger(name)
@@ -0,0 +1,156 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import serial
+import serial.tools.list_ports
+from logger_config import get_logger
+
+logger = get_logger("PLCDiscovery")
+
+# 单个端口握手等待应答的时间
+PROBE_TIMEOUT = 0.5
+# 并行探测的最大线程数
+MAX_PROBE_WORKERS = 8
+
+
+class PortIdentity:
+    """串口设备身份：设备路径可能随插拔变化，VID/PID/序列号不会"""
+
+    __slots__ = ("device", "vid", "pid", "serial_number")
+
+    def __init__(self, device, vid=None, pid=None, serial_number=None):
+        self.device = device
+        self.vid = vid
+        self.pid = pid
+        self.serial_number = serial_number
+
+    @classmethod
+    def from_port_info(cls, port_info):
+        return cls(port_info.device, port_info.vid, port_info.pid, port_info.serial_number)
+
+    def to_dict(self):
+        return {"device": self.device, "vid": self.vid, "pid": self.pid, "serial_number": self.serial_number}
+
+    def matches(self, other):
+        """同一物理设备：有序列号时比较 VID/PID/序列号，否则比较 VID/PID 和设备路径"""
+        if other is None:
+            return False
+        if self.serial_number and other.serial_number:
+            return (self.vid, self.pid, self.serial_number) == (other.vid, other.pid, other.serial_number)
+        if self.vid is not None and other.vid is not None:
+            return (self.vid, self.pid, self.device) == (other.vid, other.pid, other.device)
+        return self.device == other.device
+
+    def __repr__(self):
+        if self.vid is None:
+            return self.device
+        return f"{self.device} ({self.vid:04x}:{self.pid:04x} SN={self.serial_number})"
+
+
+def load_cached_identity(cache_file):
+    """读取上次成功连接的端口，文件不存在或损坏时返回 None"""
+    if not cache_file:
+        return None
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return PortIdentity(data["device"], data.get("vid"), data.get("pid"), data.get("serial_number"))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"读取PLC端口缓存失败: {e}")
+        return None
+
+
+def save_cached_identity(cache_file, identity):
+    """原子写入成功连接的端口信息"""
+    if not cache_file:
+        return
+    cache_file = Path(cache_file)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_file.with_name(cache_file.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(identity.to_dict(), f)
+        os.replace(tmp_path, cache_file)
+    except OSError as e:
+        logger.warning(f"保存PLC端口缓存失败: {e}")
+
+
+def rank_candidates(ports, cached=None):
+    """候选端口排序：上次成功的设备优先，其次是 USB 串口，最后是板载串口"""
+    def rank(identity):
+        if cached is not None and identity.matches(cached):
+            return 0
+        if identity.vid is not None:
+            return 1
+        return 2
+    return sorted(ports, key=rank)
+
+
+def list_candidates(cached=None):
+    ports = [PortIdentity.from_port_info(p) for p in serial.tools.list_ports.comports()]
+    return rank_candidates(ports, cached)
+
+
+def probe_port(device, baudrate=9600, handshake=None, expected=None, timeout=PROBE_TIMEOUT):
+    """打开端口并做一次握手，返回是否确认是PLC
+
+    handshake 为发送的探测帧，expected 为期望应答的前缀（None 表示收到任意
+    非空应答即可）。不配置 handshake 时只能确认端口可以打开。
+    """
+    try:
+        port = serial.serial_for_url(device, baudrate=baudrate, bytesize=8, parity='N',
+                                     stopbits=2, timeout=timeout)
+    except Exception as e:
+        logger.info(f"无法打开端口 {device}: {e}")
+        return False
+    try:
+        if handshake is None:
+            return True
+        port.reset_input_buffer()
+        port.write(handshake)
+        port.flush()
+        deadline = time.monotonic() + timeout
+        response = b''
+        want = len(expected) if expected else 1
+        while len(response) < want and time.monotonic() < deadline:
+            response += port.read(want - len(response))
+        ok = response.startswith(expected) if expected else bool(response)
+        logger.info(f"端口 {device} 握手应答: {response.hex()} -> {'成功' if ok else '失败'}")
+        return ok
+    except Exception as e:
+        logger.info(f"端口 {device} 握手失败: {e}")
+        return False
+    finally:
+        port.close()
+
+
+def discover(candidates, baudrate=9600, handshake=None, expected=None, timeout=PROBE_TIMEOUT,
+             max_workers=MAX_PROBE_WORKERS):
+    """并行探测候选端口，返回排序最靠前的成功端口（PortIdentity），都失败时返回 None"""
+    if not candidates:
+        return None
+    logger.info(f"并行探测PLC端口: {candidates}")
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(candidates)), thread_name_prefix="PLCProbe")
+    try:
+        futures = {executor.submit(probe_port, c.device, baudrate, handshake, expected, timeout): i
+                   for i, c in enumerate(candidates)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception:
+                results[index] = False
+            # 排在前面的端口都已有结果时即可确定最佳端口，不必等待其余探测
+            for i in range(len(candidates)):
+                if i not in results:
+                    break
+                if results[i]:
+                    return candidates[i]
+        return None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
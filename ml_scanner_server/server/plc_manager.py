@@ -0,0 +1,394 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import serial
+from logger_config import get_logger
+from plc_protocol import FrameParser, FrameDispatcher, FrameSpec, FrameType
+from plc_discovery import (PortIdentity, PROBE_TIMEOUT, discover, list_candidates,
+                           load_cached_identity, save_cached_identity)
+
+logger = get_logger("PLCManager")
+
+# 读取线程阻塞读串口的超时时间：有数据时 read 立即返回，超时只用于
+# 检查停止标志和结束不带分隔符的帧，不再是固定的轮询间隔
+READ_TIMEOUT = 0.05
+# 等待PLC命令应答的时间
+RESPONSE_TIMEOUT = 1.0
+# 保留用于统计往返时间分位数的样本数
+RTT_SAMPLES = 1000
+# 断线重连的退避时间范围（秒）
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 10.0
+
+
+class PLCTimeoutError(TimeoutError):
+    """PLC命令在截止时间内未收到应答"""
+
+
+class PLCCommand:
+    """排队等待发送的PLC命令
+
+    response_length 为 0 表示PLC不应答，写出即完成；大于 0 表示把写出后
+    收到的这么多字节作为应答；None 表示等待帧解析器识别出的 ACK/ERROR 帧。
+    deadline 为整个命令（含重试）的截止时间，response_timeout 为单次尝试
+    等待应答的时间。
+    """
+
+    __slots__ = ("command", "response_length", "response_timeout", "deadline", "retries",
+                 "attempts", "future", "submitted_at", "sent_at", "attempt_deadline")
+
+    def __init__(self, command, response_length, response_timeout, timeout, retries):
+        self.command = command
+        self.response_length = response_length
+        self.response_timeout = response_timeout
+        self.submitted_at = time.monotonic()
+        self.deadline = self.submitted_at + timeout
+        self.retries = retries
+        self.attempts = 0
+        self.future = Future()
+        self.sent_at = None
+        self.attempt_deadline = None
+
+
+class PLCManager:
+    def __init__(self, port=None, baudrate=9600, frame_spec=None, handlers=None,
+                 response_length=0, response_timeout=RESPONSE_TIMEOUT, retries=0,
+                 handshake=None, handshake_response=None, probe_timeout=PROBE_TIMEOUT,
+                 cache_file=None):
+        """初始化PLC管理器
+
+        frame_spec 为 PLC 帧格式（FrameSpec），handlers 为 {FrameType: 处理函数}，
+        处理函数在读取线程中以 Frame 为参数调用。response_length、
+        response_timeout、retries 为 send_command 的默认应答匹配方式（见
+        PLCCommand）。现场PLC收到放行命令后不应答，因此默认 response_length=0。
+
+        串口只由读取线程访问：命令通过队列交给读取线程依次发送，调用方拿到
+        Future，不会在串口读写上阻塞。
+
+        port 为 None 时自动查找：并行探测所有串口，handshake/handshake_response
+        为探测帧和期望应答前缀（不配置时只能确认端口可以打开），上次成功的
+        设备身份保存在 cache_file 中，下次启动优先使用。构造时不连接，调用
+        start() 后在后台线程中查找/连接，断线后自动重连。
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.handshake = handshake
+        self.handshake_response = handshake_response
+        self.probe_timeout = probe_timeout
+        self.cache_file = cache_file
+        self.serial_port = None
+        self.running = False
+        self.read_thread = None
+        self.supervisor_thread = None
+        self.identity = None
+        self._stop_event = threading.Event()
+        self._disconnected = threading.Event()
+        self.parser = FrameParser(frame_spec or FrameSpec())
+        self.dispatcher = FrameDispatcher(handlers)
+        self.response_length = response_length
+        self.response_timeout = response_timeout
+        self.retries = retries
+        self._commands = queue.Queue()
+        self._current = None
+        self._stats_lock = threading.Lock()
+        self._rtts = deque(maxlen=RTT_SAMPLES)
+        self._counters = {
+            "submitted": 0,
+            "sent": 0,
+            "completed": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "retries": 0,
+            "expired": 0,
+        }
+
+    @property
+    def is_connected(self):
+        return bool(self.running and self.serial_port is not None)
+
+    def start(self):
+        """启动后台连接线程：查找/连接PLC，断线后按退避时间重连，不阻塞调用方"""
+        if self.supervisor_thread and self.supervisor_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self.supervisor_thread = threading.Thread(target=self._supervise, name="PLCSupervisor")
+        self.supervisor_thread.daemon = True
+        self.supervisor_thread.start()
+
+    def wait_connected(self, timeout=None):
+        """等待连接建立，返回是否已连接"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.is_connected:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if (remaining is not None and remaining <= 0) or self._stop_event.wait(0.05 if remaining is None else min(0.05, remaining)):
+                break
+        return self.is_connected
+
+    def _supervise(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self._stop_event.is_set():
+            if not self.is_connected:
+                if self.port is not None:
+                    connected = self.connect(self.port, self.baudrate)
+                else:
+                    connected = self.auto_connect(self.baudrate)
+                if not connected:
+                    logger.info(f"{delay:.1f} 秒后重试连接PLC")
+                    self._stop_event.wait(delay)
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                    continue
+                delay = RECONNECT_MIN_DELAY
+            # 等待读取线程报告断线
+            self._disconnected.wait()
+            self._disconnected.clear()
+
+    def auto_connect(self, baudrate=9600):
+        """并行探测并连接PLC设备，优先使用上次成功的设备"""
+        logger.info("开始自动查找PLC设备...")
+
+        cached = load_cached_identity(self.cache_file)
+        candidates = list_candidates(cached)
+        if not candidates:
+            logger.error("未找到任何COM端口设备")
+            return False
+
+        logger.info(f"发现以下COM端口: {[port.device for port in candidates]}")
+
+        identity = discover(candidates, baudrate, self.handshake, self.handshake_response, self.probe_timeout)
+        if identity is None:
+            logger.error("无法找到可用的PLC设备")
+            return False
+
+        if self.connect(identity.device, baudrate):
+            logger.info(f"成功连接到PLC设备，端口: {identity}")
+            self.identity = identity
+            save_cached_identity(self.cache_file, identity)
+            return True
+        return False
+
+    def connect(self, port, baudrate=9600):
+        """连接到指定的COM端口，port 也可以是 pyserial URL（例如 loop://）"""
+        logger.info(f"尝试连接PLC - 端口: {port}, 波特率: {baudrate}")
+        try:
+            self.serial_port = serial.serial_for_url(
+                port,
+                baudrate=baudrate,
+                bytesize=8,
+                parity='N',
+                stopbits=2,
+                timeout=READ_TIMEOUT
+            )
+            if self.identity is None or self.identity.device != port:
+                self.identity = PortIdentity(port)
+            self.parser.reset()
+            self._disconnected.clear()
+            self.running = True
+            self.read_thread = threading.Thread(target=self._read_plc, name="PLCReader")
+            self.read_thread.daemon = True  # 设置为守护线程，主程序退出时自动结束
+            self.read_thread.start()
+            logger.info("PLC连接初始化成功")
+            return True
+        except Exception as e:
+            logger.error(f"PLC连接初始化失败: {e}")
+            self.serial_port = None
+            return False
+
+    def _handle_disconnect(self, error):
+        """串口出错（例如USB拔出）：关闭端口，让后台线程重连"""
+        logger.error(f"PLC连接断开: {error}")
+        self.running = False
+        port = self.serial_port
+        self.serial_port = None
+        try:
+            if port is not None and port.is_open:
+                port.close()
+        except Exception:
+            pass
+        self._disconnected.set()
+
+    def _read_plc(self):
+        """串口所有者线程：发送排队的命令，持续读取PLC信号，按帧解析后分发"""
+        while self.running:
+            try:
+                if self._current is None:
+                    self._start_next_command()
+
+                # 阻塞直到至少收到一个字节（或超时），再把已到达的字节一并读出
+                data = self.serial_port.read(max(1, self.serial_port.in_waiting))
+                now = time.monotonic()
+                if data:
+                    logger.debug(f"收到PLC数据: {data!r}")
+                    frames = self.parser.feed(data, now)
+                else:
+                    frames = self.parser.flush_idle(now)
+                for frame in frames:
+                    logger.info(f"收到PLC帧: {frame}")
+                    if self._current is not None and frame.type in (FrameType.ACK, FrameType.ERROR):
+                        self._complete_current(frame, now)
+                    self.dispatcher.dispatch(frame)
+
+                if self._current is not None and now >= self._current.attempt_deadline:
+                    self._current_timed_out(now)
+            except (serial.SerialException, OSError) as e:
+                self._fail_pending(ConnectionError(f"PLC连接断开: {e}"))
+                self._handle_disconnect(e)
+                break
+            except Exception as e:
+                logger.error(f"读取PLC数据错误: {e}", exc_info=True)
+                if self._current is not None:
+                    self._fail_current(e)
+                time.sleep(0.1)
+        self._fail_pending(ConnectionError("PLC连接已关闭"))
+
+    def _start_next_command(self):
+        """取出下一条命令并写入串口（只在读取线程中调用）"""
+        while True:
+            try:
+                cmd = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if cmd.future.done():
+                continue
+            now = time.monotonic()
+            if now >= cmd.deadline:
+                self._count("expired")
+                cmd.future.set_exception(PLCTimeoutError(f"PLC命令 {cmd.command.hex()} 在发送前已超过截止时间"))
+                continue
+            self._send(cmd, now)
+            # 不需要应答的命令写出即完成，继续发送后续命令
+            if self._current is not None:
+                return
+
+    def _send(self, cmd, now):
+        cmd.attempts += 1
+        cmd.sent_at = now
+        cmd.attempt_deadline = min(cmd.deadline, now + cmd.response_timeout)
+        if cmd.response_length:
+            self.parser.expect_response(cmd.response_length)
+        logger.info(f"发送PLC命令: {cmd.command.hex()} (第{cmd.attempts}次)")
+        # 写入前先设为当前命令，写串口出错时由读取循环的异常处理让它的 future 失败
+        self._current = cmd
+        self.serial_port.write(cmd.command)
+        self.serial_port.flush()
+        self._count("sent")
+        if cmd.response_length == 0:
+            self._current = None
+            self._finish(cmd, b'', time.monotonic())
+
+    def _complete_current(self, frame, now):
+        cmd = self._current
+        self._current = None
+        if frame.type == FrameType.ERROR:
+            self._count("errors")
+            logger.error(f"PLC返回错误: {frame.payload.hex()}")
+            cmd.future.set_exception(RuntimeError(f"PLC返回错误: {frame.payload.hex()}"))
+            return
+        logger.info(f"PLC响应: {frame.payload.hex()}")
+        self._finish(cmd, frame.payload, now)
+
+    def _finish(self, cmd, response, now):
+        with self._stats_lock:
+            self._counters["completed"] += 1
+            self._rtts.append(now - cmd.sent_at)
+        if not cmd.future.done():
+            cmd.future.set_result(response)
+
+    def _current_timed_out(self, now):
+        cmd = self._current
+        self._current = None
+        self.parser.expect_response(0)
+        if cmd.attempts <= cmd.retries and now < cmd.deadline:
+            self._count("retries")
+            logger.warning(f"PLC命令 {cmd.command.hex()} 未收到应答，重试")
+            self._send(cmd, now)
+            return
+        self._count("timeouts")
+        logger.error(f"PLC命令 {cmd.command.hex()} 超时，共尝试 {cmd.attempts} 次")
+        cmd.future.set_exception(PLCTimeoutError(f"PLC命令 {cmd.command.hex()} 超时"))
+
+    def _fail_current(self, error):
+        cmd = self._current
+        self._current = None
+        self.parser.expect_response(0)
+        self._count("errors")
+        if not cmd.future.done():
+            cmd.future.set_exception(error)
+
+    def _fail_pending(self, error):
+        if self._current is not None:
+            self._fail_current(error)
+        while True:
+            try:
+                cmd = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            if not cmd.future.done():
+                cmd.future.set_exception(error)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._counters[name] += 1
+
+    def send_command(self, command, response_length=None, timeout=None, retries=None, response_timeout=None):
+        """把命令放入发送队列，立即返回 concurrent.futures.Future
+
+        Future 的结果为PLC应答字节（不需要应答时为 b''），超时抛出
+        PLCTimeoutError。未指定的参数使用构造时的默认值；timeout 为包括
+        重试在内的总截止时间。
+        """
+        response_length = self.response_length if response_length is None else response_length
+        response_timeout = self.response_timeout if response_timeout is None else response_timeout
+        retries = self.retries if retries is None else retries
+        if timeout is None:
+            timeout = response_timeout * (retries + 1)
+        cmd = PLCCommand(command, response_length, response_timeout, timeout, retries)
+        self._count("submitted")
+
+        if not self.is_connected:
+            self._count("errors")
+            cmd.future.set_exception(ConnectionError("PLC未连接"))
+            return cmd.future
+
+        self._commands.put(cmd)
+        # 唤醒阻塞在串口读取上的所有者线程，尽快发送命令
+        cancel_read = getattr(self.serial_port, 'cancel_read', None)
+        if cancel_read:
+            try:
+                cancel_read()
+            except Exception:
+                pass
+        return cmd.future
+
+    def stats(self):
+        """返回命令计数、队列长度以及往返时间分位数（毫秒）"""
+        with self._stats_lock:
+            stats = dict(self._counters)
+            rtts = sorted(self._rtts)
+        stats["queue_depth"] = self._commands.qsize()
+        stats["connected"] = self.is_connected
+        stats["port"] = self.identity.to_dict() if self.identity else None
+        for name, pct in (("rtt_p50_ms", 50), ("rtt_p95_ms", 95), ("rtt_p99_ms", 99)):
+            stats[name] = rtts[min(len(rtts) - 1, int(pct / 100.0 * len(rtts)))] * 1000 if rtts else None
+        return stats
+
+    def close(self):
+        logger.info("关闭PLC连接")
+        self._stop_event.set()
+        self._disconnected.set()
+        self.running = False
+        if self.serial_port is not None:
+            cancel_read = getattr(self.serial_port, 'cancel_read', None)
+            if cancel_read:
+                try:
+                    cancel_read()
+                except Exception:
+                    pass
+        if self.read_thread and self.read_thread.is_alive():
+            self.read_thread.join()
+        if self.supervisor_thread and self.supervisor_thread.is_alive():
+            self.supervisor_thread.join(timeout=2)
+        self._fail_pending(ConnectionError("PLC连接已关闭"))
+        if self.serial_port and self.serial_port.is_open:
+            self.serial_port.close()
@@ -0,0 +1,236 @@
+import time
+from enum import Enum
+from functools import reduce
+from logger_config import get_logger
+
+logger = get_logger("PLCProtocol")
+
+
+class FrameType(Enum):
+    TRIGGER = "trigger"  # PLC 到位信号，开始读取条码
+    ACK = "ack"          # PLC 对命令的应答
+    ERROR = "error"      # PLC 报告的错误
+    UNKNOWN = "unknown"  # 无法识别的帧
+
+
+def checksum_sum8(data):
+    return sum(data) & 0xFF
+
+
+def checksum_xor8(data):
+    return reduce(lambda a, b: a ^ b, data, 0)
+
+
+CHECKSUMS = {
+    "sum8": checksum_sum8,
+    "xor8": checksum_xor8,
+}
+
+MODE_DELIMITER = "delimiter"  # 以分隔符结束的帧
+MODE_FIXED = "fixed"          # 固定长度的帧
+MODE_LENGTH = "length"        # 首字节为负载长度的帧
+FRAME_MODES = (MODE_DELIMITER, MODE_FIXED, MODE_LENGTH)
+
+
+class Frame:
+    """一个完整的 PLC 帧"""
+
+    __slots__ = ("type", "payload", "raw", "received_at")
+
+    def __init__(self, frame_type, payload, raw, received_at):
+        self.type = frame_type
+        self.payload = payload
+        self.raw = raw
+        # 收到帧最后一个字节时的 time.monotonic()
+        self.received_at = received_at
+
+    def __repr__(self):
+        return f"Frame({self.type.value}, {self.payload!r})"
+
+
+class FrameSpec:
+    """PLC 帧格式配置
+
+    mode:
+        "delimiter" —— 帧以 delimiters 中任意一个字节序列结束，空帧忽略；
+                       若缓冲区中有未结束的数据且超过 idle_gap 秒没有新字节，
+                       也视为一帧结束（兼容不带结束符的 PLC）。
+        "fixed"     —— 每帧固定 length 字节。
+        "length"    —— 首字节为后续负载长度。
+    checksum:
+        None、"sum8" 或 "xor8"，启用时帧负载最后一个字节为校验和。
+    codes:
+        负载到帧类型的映射，完全匹配；未命中时再按 ack_prefix/error_prefix
+        前缀匹配，仍未命中为 UNKNOWN。
+
+    默认配置对应现场 PLC 的行为：发送 ASCII '7' 后跟空格，只有完整的 "7"
+    帧才是触发信号，"17"、"77" 之类的数据不会误触发。
+    """
+
+    def __init__(self, mode=MODE_DELIMITER, delimiters=(b" ", b"\r", b"\n", b"\x00"),
+                 length=1, checksum=None, codes=None, ack_prefix=None, error_prefix=None,
+                 idle_gap=0.02, max_frame=256):
+        if mode not in FRAME_MODES:
+            raise ValueError(f"未知的帧模式: {mode}")
+        if checksum is not None and checksum not in CHECKSUMS:
+            raise ValueError(f"未知的校验方式: {checksum}")
+        self.mode = mode
+        self.delimiters = tuple(delimiters)
+        self.length = length
+        self.checksum = checksum
+        self.codes = dict(codes) if codes is not None else {b"7": FrameType.TRIGGER}
+        self.ack_prefix = ack_prefix
+        self.error_prefix = error_prefix
+        self.idle_gap = idle_gap
+        self.max_frame = max_frame
+
+    @classmethod
+    def from_dict(cls, config):
+        """从配置字典（例如 YAML）创建，codes 的键为字符串，值为帧类型名"""
+        config = dict(config or {})
+        if "delimiters" in config:
+            config["delimiters"] = [_to_bytes(d) for d in config["delimiters"]]
+        if "codes" in config:
+            config["codes"] = {_to_bytes(k): FrameType(v) for k, v in config["codes"].items()}
+        for key in ("ack_prefix", "error_prefix"):
+            if config.get(key) is not None:
+                config[key] = _to_bytes(config[key])
+        return cls(**config)
+
+    def classify(self, payload):
+        frame_type = self.codes.get(payload)
+        if frame_type is not None:
+            return frame_type
+        if self.ack_prefix and payload.startswith(self.ack_prefix):
+            return FrameType.ACK
+        if self.error_prefix and payload.startswith(self.error_prefix):
+            return FrameType.ERROR
+        return FrameType.UNKNOWN
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, int):
+        return bytes([value])
+    return value.encode("latin-1")
+
+
+class FrameParser:
+    """把串口字节流切分为帧
+
+    feed() 返回本次数据中所有完整的帧；flush_idle() 在读超时后调用，用于在
+    delimiter 模式下结束超过 idle_gap 未收到新字节的不完整帧。
+    expect_response(n) 让接下来的 n 个字节作为一个 ACK 帧，不受分隔符影响，
+    用于匹配没有帧格式的命令应答。
+    """
+
+    def __init__(self, spec=None):
+        self.spec = spec or FrameSpec()
+        self._buffer = bytearray()
+        self._last_byte_at = None
+        self._expected_response = 0
+        self.invalid_frames = 0
+
+    def expect_response(self, length):
+        self._expected_response = length
+
+    def reset(self):
+        self._buffer.clear()
+        self._last_byte_at = None
+        self._expected_response = 0
+
+    def feed(self, data, now=None):
+        now = time.monotonic() if now is None else now
+        frames = []
+        self._last_byte_at = now
+        for byte in data:
+            self._buffer.append(byte)
+            frame = self._take_frame(now)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+    def flush_idle(self, now=None):
+        now = time.monotonic() if now is None else now
+        if (self.spec.mode != MODE_DELIMITER or self._expected_response or not self._buffer
+                or self._last_byte_at is None or now - self._last_byte_at < self.spec.idle_gap):
+            return []
+        raw = bytes(self._buffer)
+        self._buffer.clear()
+        frame = self._make_frame(raw, raw, now)
+        return [frame] if frame else []
+
+    def _take_frame(self, now):
+        spec = self.spec
+        buf = self._buffer
+
+        if self._expected_response:
+            if len(buf) < self._expected_response:
+                return None
+            raw = bytes(buf)
+            buf.clear()
+            self._expected_response = 0
+            return Frame(FrameType.ACK, raw, raw, now)
+
+        if spec.mode == MODE_DELIMITER:
+            for delimiter in spec.delimiters:
+                if buf.endswith(delimiter):
+                    raw = bytes(buf)
+                    buf.clear()
+                    payload = raw[:-len(delimiter)]
+                    if not payload:
+                        return None
+                    return self._make_frame(payload, raw, now)
+            if len(buf) > spec.max_frame:
+                logger.warning(f"PLC帧超过最大长度 {spec.max_frame}，丢弃: {bytes(buf)!r}")
+                buf.clear()
+                self.invalid_frames += 1
+            return None
+
+        if spec.mode == MODE_FIXED:
+            if len(buf) < spec.length:
+                return None
+        else:
+            if len(buf) < 1 or len(buf) < 1 + buf[0]:
+                return None
+        raw = bytes(buf)
+        buf.clear()
+        payload = raw if spec.mode == MODE_FIXED else raw[1:]
+        return self._make_frame(payload, raw, now)
+
+    def _make_frame(self, payload, raw, now):
+        if self.spec.checksum:
+            body, received = payload[:-1], payload[-1:]
+            expected = CHECKSUMS[self.spec.checksum](body)
+            if not received or received[0] != expected:
+                logger.warning(f"PLC帧校验失败，丢弃: {raw!r}")
+                self.invalid_frames += 1
+                return None
+            payload = body
+        return Frame(self.spec.classify(payload), payload, raw, now)
+
+
+class FrameDispatcher:
+    """按帧类型分发到已注册的处理函数"""
+
+    def __init__(self, handlers=None):
+        self._handlers = {frame_type: [] for frame_type in FrameType}
+        self.counts = {frame_type: 0 for frame_type in FrameType}
+        for frame_type, handler in (handlers or {}).items():
+            self.register(frame_type, handler)
+
+    def register(self, frame_type, handler):
+        self._handlers[frame_type].append(handler)
+
+    def dispatch(self, frame):
+        self.counts[frame.type] += 1
+        handlers = self._handlers[frame.type]
+        if not handlers:
+            logger.info(f"未处理的PLC帧: {frame}")
+            return
+        for handler in handlers:
+            try:
+                handler(frame)
+            except Exception as e:
+                logger.error(f"处理PLC帧 {frame} 出错: {e}", exc_info=True)
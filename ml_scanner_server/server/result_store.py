@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from pathlib import Path
+from logger_config import get_logger
+
+VERDICT_OK = "OK"
+VERDICT_NG = "NG"
+VERDICTS = (VERDICT_OK, VERDICT_NG)
+
+MAX_PAGE_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    board_id TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    image_path TEXT,
+    image_size INTEGER,
+    boxes TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_board ON results (board_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_created ON results (created_at);
+CREATE INDEX IF NOT EXISTS idx_results_verdict ON results (verdict, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_image ON results (image_path);
+"""
+
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^\w.-]')
+
+
+def safe_filename(board_id):
+    """把板号转换为可用作文件名的字符串"""
+    name = _UNSAFE_FILENAME_CHARS.sub('_', board_id or '')
+    return name or 'unknown'
+
+
+class ResultStore:
+    """检测结果索引（SQLite WAL 模式）
+
+    每次检测记录板号、判定、时间、图片路径、大小以及检测框，图片按
+    <verdict>/<YYYY>/<MM>/<DD>/ 分目录存放，文件名带时间戳，同一块板
+    重复检测不会互相覆盖。image_path 保存为相对 images_root 的路径。
+    """
+
+    def __init__(self, db_path, images_root):
+        self.db_path = Path(db_path)
+        self.images_root = Path(images_root)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.logger = get_logger("ResultStore")
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _connection(self):
+        """每个线程使用独立的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def image_path_for(self, board_id, verdict, created_at=None):
+        """返回新检测结果的图片路径（按日期分目录）"""
+        created_at = time.time() if created_at is None else created_at
+        dt = datetime.fromtimestamp(created_at)
+        filename = f"{safe_filename(board_id)}_{dt.strftime('%H%M%S_%f')}.jpg"
+        return self.images_root / verdict / dt.strftime('%Y') / dt.strftime('%m') / dt.strftime('%d') / filename
+
+    def record(self, board_id, verdict, created_at=None, image_path=None, image_size=None, boxes=None):
+        """写入一条检测结果，返回记录 id"""
+        created_at = time.time() if created_at is None else created_at
+        cursor = self._connection().execute(
+            "INSERT INTO results (board_id, verdict, created_at, image_path, image_size, boxes) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (board_id, verdict, created_at, self._relative(image_path), image_size,
+             json.dumps(boxes) if boxes is not None else None))
+        return cursor.lastrowid
+
+    def set_image_size(self, result_id, image_size):
+        self._connection().execute(
+            "UPDATE results SET image_size = ? WHERE id = ?", (image_size, result_id))
+
+    def mark_image_missing(self, result_id):
+        """图片写入失败或被丢弃时清空图片路径"""
+        self._connection().execute(
+            "UPDATE results SET image_path = NULL, image_size = NULL WHERE id = ?", (result_id,))
+
+    def aged_images(self, verdict, before, limit):
+        """created_at 早于 before、图片仍是单独文件的检测结果（最早的在前），用于归档"""
+        rows = self._connection().execute(
+            "SELECT id, created_at, image_path FROM results "
+            "WHERE verdict = ? AND created_at < ? AND image_path IS NOT NULL AND image_path NOT LIKE 'archive/%' "
+            "ORDER BY created_at LIMIT ?", (verdict, before, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def set_image_paths(self, updates):
+        """在一个事务中更新图片路径和大小，updates 为 [(image_path, image_size, id)]"""
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("UPDATE results SET image_path = ?, image_size = ? WHERE id = ?", updates)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear_image_paths(self, prefix):
+        """清空以 prefix 开头的图片路径（图片已被删除），返回清空的数量"""
+        # 用范围比较代替 LIKE，可以使用 image_path 索引
+        cursor = self._connection().execute(
+            "UPDATE results SET image_path = NULL, image_size = NULL WHERE image_path >= ? AND image_path < ?",
+            (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+        return cursor.rowcount
+
+    def get(self, result_id):
+        row = self._connection().execute("SELECT * FROM results WHERE id = ?", (result_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def query(self, board_id=None, verdict=None, start=None, end=None, page=1, page_size=50):
+        """按板号、判定和时间范围分页查询，按时间倒序，返回 (结果列表, 总数)"""
+        clauses = []
+        params = []
+        if board_id:
+            clauses.append("board_id = ?")
+            params.append(board_id)
+        if verdict:
+            clauses.append("verdict = ?")
+            params.append(verdict)
+        if start is not None:
+            clauses.append("created_at >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("created_at < ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        page = max(1, int(page))
+        page_size = max(1, min(MAX_PAGE_SIZE, int(page_size)))
+        conn = self._connection()
+        total = conn.execute(f"SELECT COUNT(*) FROM results {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM results {where} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+            params + [page_size, (page - 1) * page_size]).fetchall()
+        return [self._to_dict(row) for row in rows], total
+
+    def count_by_verdict(self, start=None, end=None):
+        """统计时间范围内各判定的数量，例如计算某个班次的NG率"""
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append("created_at >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("created_at < ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connection().execute(
+            f"SELECT verdict, COUNT(*) FROM results {where} GROUP BY verdict", params).fetchall()
+        counts = {verdict: 0 for verdict in VERDICTS}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+    def import_directory(self, directory, verdict, batch_size=1000):
+        """把旧的平铺目录（Images/OK、Images/NG）中的图片导入索引
+
+        图片保留在原位置，板号取自文件名，时间取自文件修改时间；已经导入过的
+        路径会被跳过，因此可以重复执行。返回新导入的数量。
+        """
+        directory = Path(directory)
+        conn = self._connection()
+        imported = 0
+        batch = []
+
+        def flush():
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT INTO results (board_id, verdict, created_at, image_path, image_size) "
+                    "VALUES (?, ?, ?, ?, ?)", batch)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith('.jpg'):
+                    continue
+                relative = self._relative(entry.path)
+                exists = conn.execute(
+                    "SELECT 1 FROM results WHERE image_path = ? LIMIT 1", (relative,)).fetchone()
+                if exists:
+                    continue
+                st = entry.stat()
+                batch.append((Path(entry.name).stem, verdict, st.st_mtime, relative, st.st_size))
+                if len(batch) >= batch_size:
+                    flush()
+                    imported += len(batch)
+                    batch = []
+        if batch:
+            flush()
+            imported += len(batch)
+        self.logger.info(f"已从 {directory} 导入 {imported} 条{verdict}结果")
+        return imported
+
+    def resolve(self, image_path):
+        """把索引中的相对路径转换为绝对路径（已归档的图片见 image_archive.ImageArchive）"""
+        return self.images_root / image_path if image_path else None
+
+    def _relative(self, image_path):
+        if image_path is None:
+            return None
+        image_path = Path(image_path)
+        try:
+            return image_path.relative_to(self.images_root).as_posix()
+        except ValueError:
+            return str(image_path)
+
+    @staticmethod
+    def _to_dict(row):
+        result = dict(row)
+        result['created_at_iso'] = datetime.fromtimestamp(result['created_at']).isoformat(timespec='milliseconds')
+        result['boxes'] = json.loads(result['boxes']) if result['boxes'] else None
+        return result
+
+
+def parse_time(value):
+    """解析查询参数中的时间：Unix 时间戳或 ISO 8601 字符串"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把旧的 Images/OK、Images/NG 平铺目录导入检测结果索引")
+    parser.add_argument('--images-root', default=str(Path(__file__).resolve().parent.parent / 'Images'))
+    parser.add_argument('--db', default=None, help='索引数据库路径，默认为 <images-root>/results.db')
+    args = parser.parse_args()
+
+    images_root = Path(args.images_root)
+    store = ResultStore(args.db or images_root / 'results.db', images_root)
+    for verdict in VERDICTS:
+        directory = images_root / verdict
+        if directory.is_dir():
+            count = store.import_directory(directory, verdict)
+            print(f"{verdict}: 导入 {count} 条")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,253 +1,418 @@
-from flask import Flask, request, jsonify
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, request, jsonify, send_file, render_template_string, url_for
+from flask_socketio import SocketIO, emit, join_room
+import argparse
 import base64
+import functools
+import hmac
+import io
+import json
+import math
+import os
 from datetime import datetime
 import logging
 import threading
-import serial
-import serial.tools.list_ports
 import time
 from pathlib import Path
-from file_monitor import InputFileMonitor
-from logger_config import setup_logging, get_logger
+import numpy as np
+from image_writer import ImageWriterPool
+from client_registry import POLICY_LEAST_LOADED, DEFAULT_CLIENT_INFLIGHT
+from cycle_trace import render_prometheus
+from defect_analysis import DefectAnalyzer
+from image_archive import ImageCompactor, ArchivePolicy, is_archived
+from introspection import (SamplingProfiler, lock_stats, thread_counts, thread_dump, format_thread_dump,
+                           format_collapsed, DEFAULT_PROFILE_SECONDS, DEFAULT_PROFILE_INTERVAL)
+from thumbnails import ThumbnailService, ThumbnailBusy, DEFAULT_THUMBNAIL_SIZE
+from station import Station, StationConfig, load_station_configs, DEFAULT_STATION_ID
+from result_store import VERDICT_OK, VERDICT_NG, VERDICTS, MAX_PAGE_SIZE, parse_time
+from logger_config import setup_logging, get_logger, logging_stats
+from serving import (run_server, SERVING_MODES, MODE_THREADED, DEFAULT_WORKERS, DEFAULT_DRAIN_TIMEOUT,
+                     DEFAULT_MAX_QUEUED, DEFAULT_SOCKETIO_WORKERS)
 
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# PLC读取、文件监控和图片写入都是阻塞式的后台线程，Socket.IO 固定使用 threading 模式
+# 检测结果可以通过 Socket.IO 以二进制附件上传，单条消息最大 MAX_MESSAGE_BYTES
+MAX_MESSAGE_BYTES = 32 * 1024 * 1024
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', max_http_buffer_size=MAX_MESSAGE_BYTES)
 
 # 项目根目录
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# 设置日志目录
+# 日志目录（日志在 start_services() 中初始化）
 LOGS_DIR = BASE_DIR / 'logs'
-LOGS_DIR.mkdir(parents=True, exist_ok=True)
-
-# 初始化日志配置
-setup_logging(LOGS_DIR)
 logger = get_logger("Server")
 
 INPUT_FILE = BASE_DIR / "input" / "input.txt"
-if not INPUT_FILE.exists():
-    INPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    INPUT_FILE.touch()
+IMAGES_DIR = BASE_DIR / 'Images'
+
+# 流式上传图片时每次从请求流读取的字节数
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# 以原始二进制请求体上传图片时接受的 Content-Type
+RAW_IMAGE_MIMETYPES = ('image/jpeg', 'application/octet-stream')
+
+# PLC串口：None 表示自动查找，可通过环境变量 ML_SCANNER_PLC_PORT 指定（也支持 pyserial URL）
+PLC_PORT = os.environ.get('ML_SCANNER_PLC_PORT') or None
+# 自动查找时发送的握手帧和期望的应答前缀，None 表示只检查端口能否打开
+PLC_HANDSHAKE = None
+PLC_HANDSHAKE_RESPONSE = None
+# 上次成功连接的PLC端口及设备身份，下次启动优先使用
+PLC_PORT_CACHE = BASE_DIR / 'plc_port.json'
+
+# 检测客户端分配策略 least_loaded / round_robin。确认超时只对连接时声明 acks 的客户端生效，
+# 为 0 时所有客户端都不要求 ack
+DISPATCH_POLICY = os.environ.get('ML_SCANNER_DISPATCH_POLICY', POLICY_LEAST_LOADED)
+DISPATCH_ACK_TIMEOUT = float(os.environ.get('ML_SCANNER_ACK_TIMEOUT', 5.0)) or None
+DISPATCH_INSPECT_TIMEOUT = float(os.environ.get('ML_SCANNER_INSPECT_TIMEOUT', 15.0)) or None
+
+# 旧 OK 图片归档：设置 ML_SCANNER_ARCHIVE_AFTER_DAYS 后把更早的 OK 图片打包进 <图片目录>/archive/
+# 的段文件，可选重新压缩（质量、最长边）和过期删除；多工位时也可以在工位配置中用 archive 单独设置
+def archive_policy_from_env():
+    after_days = os.environ.get('ML_SCANNER_ARCHIVE_AFTER_DAYS')
+    if not after_days:
+        return None
+    return ArchivePolicy(after_days, quality=os.environ.get('ML_SCANNER_ARCHIVE_QUALITY'),
+                         max_dimension=os.environ.get('ML_SCANNER_ARCHIVE_MAX_DIMENSION'),
+                         retention_days=os.environ.get('ML_SCANNER_ARCHIVE_RETENTION_DAYS'))
+
+# 归档任务每秒最多读写的字节数和执行间隔（秒）
+ARCHIVE_IO_BUDGET = float(os.environ.get('ML_SCANNER_ARCHIVE_IO_MB', 8)) * 1024 * 1024
+ARCHIVE_INTERVAL = float(os.environ.get('ML_SCANNER_ARCHIVE_INTERVAL', 600))
+
+# 运行时诊断接口（/debug：线程栈、采样分析和锁统计）和手动归档（POST /archive/run）。
+# 默认关闭，设置后请求需带 X-Admin-Token 头或 token 查询参数
+ADMIN_TOKEN = os.environ.get('ML_SCANNER_ADMIN_TOKEN') or None
+
+# 多工位配置文件（YAML，见 station.load_station_configs）：一个进程驱动多条产线。
+# 不配置时为单工位，使用 input/input.txt、Images/ 和上面的PLC设置
+STATIONS_CONFIG = os.environ.get('ML_SCANNER_STATIONS') or None
+
+def load_stations_config():
+    defaults = {'dispatch_policy': DISPATCH_POLICY, 'ack_timeout': DISPATCH_ACK_TIMEOUT,
+                'inspect_timeout': DISPATCH_INSPECT_TIMEOUT, 'archive': archive_policy_from_env()}
+    if STATIONS_CONFIG:
+        return load_station_configs(STATIONS_CONFIG, defaults)
+    return [StationConfig(DEFAULT_STATION_ID, INPUT_FILE, IMAGES_DIR, plc_port=PLC_PORT,
+                          plc_handshake=PLC_HANDSHAKE, plc_handshake_response=PLC_HANDSHAKE_RESPONSE,
+                          plc_cache_file=PLC_PORT_CACHE, **defaults)]
+
+# 服务器端缺陷判定：按产品配置（阈值、检测区域）重新筛选客户端上传的 NMS 结果，
+# 缺陷位置按产品累计到 heatmaps/ 下的内存映射热力图。配置文件修改后自动生效
+PRODUCTS_CONFIG = os.environ.get('ML_SCANNER_PRODUCTS') or BASE_DIR / 'products.yaml'
+HEATMAPS_DIR = BASE_DIR / 'heatmaps'
+
+# NG 复查的缩略图：子进程（spawn 方式启动）生成，磁盘 + 内存 LRU 缓存
+THUMBNAILS_DIR = os.environ.get('ML_SCANNER_THUMB_DIR') or BASE_DIR / 'thumbnails'
+
+def send_start_detection(sid, payload, on_ack):
+    """只发给选中的检测客户端，客户端通过 ack 确认收到"""
+    socketio.emit('start_detection', payload, to=sid, callback=on_ack)
+
+def broadcast_to_room(event, payload, room):
+    socketio.emit(event, payload, to=room)
+
+# 后台服务，由 start_services() 创建
+station_configs = []
+defect_analyzer = None
+thumbnail_service = None
+image_writer = None
+stations = {}
+image_compactor = None
+
+def start_services():
+    """初始化日志，创建并启动缺陷判定、缩略图进程池、图片写入线程池、各工位和归档任务
+
+    在模块末尾调用；缩略图子进程以 spawn 方式启动时会以 __mp_main__ 重新导入本模块，
+    此时不调用，子进程中不会启动任何服务。
+    """
+    global station_configs, defect_analyzer, thumbnail_service, image_writer, stations, image_compactor
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    setup_logging(LOGS_DIR)
 
-IMAGES_OK_DIR = BASE_DIR / 'Images' / 'OK'
-IMAGES_NG_DIR = BASE_DIR / 'Images' / 'NG'
+    station_configs = load_stations_config()
+    defect_analyzer = DefectAnalyzer(PRODUCTS_CONFIG, HEATMAPS_DIR)
+    thumbnail_service = ThumbnailService(
+        THUMBNAILS_DIR, workers=int(os.environ.get('ML_SCANNER_THUMB_WORKERS', 2)),
+        disk_bytes=int(os.environ.get('ML_SCANNER_THUMB_CACHE_MB', 1024)) * 1024 * 1024)
 
-for dir_path in [IMAGES_OK_DIR, IMAGES_NG_DIR]:
-    dir_path.mkdir(parents=True, exist_ok=True)
+    # 后台图片写入线程池：先放行PLC，再异步落盘；所有工位共用，每个工位至少一个线程
+    image_writer = ImageWriterPool(num_workers=max(2, len(station_configs)), max_queue=64, overflow_policy="block",
+                                   block_timeout=1.0, fsync_batch=8, fsync_interval=0.5)
 
-# 创建单一的文件监控器实例
-# 文件监控器实例
-last_instance_id = 0
-file_monitor = None
-# 添加监控器锁，保护对file_monitor的并发访问
-monitor_lock = threading.Lock()
+    # 各工位：独立的PLC、文件监控、流水线和检测客户端，检测结果按工位 id 路由
+    stations = {config.station_id: Station(config, send_start_detection, broadcast_to_room)
+                for config in station_configs}
+    for station in stations.values():
+        station.start()
+    logger.info(f"已启动 {len(stations)} 个工位: {', '.join(stations)}")
 
-# 当收到文件内容时的回调函数
-def on_file_content(content):
+    # 归档任务在图片写入线程池有排队的检测图片时暂停，不与实时写入争用磁盘
+    image_compactor = ImageCompactor(busy=lambda: image_writer.queue_depth > 0, io_budget=ARCHIVE_IO_BUDGET,
+                                     interval=ARCHIVE_INTERVAL)
+    for station in stations.values():
+        if station.config.archive:
+            image_compactor.add(station.station_id, station.result_store, station.image_archive,
+                                station.config.archive)
+    image_compactor.start()
+
+# 检测客户端 sid -> 所属工位，以及通过 Socket.IO 上传、尚未 ack 的检测结果数
+client_stations = {}
+result_inflight = {}
+client_stations_lock = threading.Lock()
+
+# Socket.IO 上传检测结果时每个客户端同时处理的上限，以及等待放行命令发送到PLC的最长时间
+RESULT_INFLIGHT_PER_CLIENT = int(os.environ.get('ML_SCANNER_RESULT_INFLIGHT', 4))
+RESULT_ACK_TIMEOUT = 10.0
+
+# 按上传方式统计的检测结果数（busy 为超过上限被拒绝的 Socket.IO 上传）
+result_counters = {'http': 0, 'socketio': 0, 'busy': 0}
+
+def count_result(channel):
+    with client_stations_lock:
+        result_counters[channel] += 1
+
+def get_station(station_id=None):
+    """按 id 查找工位；只有一个工位时可以不指定"""
+    if station_id in (None, ''):
+        if len(stations) == 1:
+            return next(iter(stations.values()))
+        raise ValueError("多工位模式下需要指定工位（station）")
+    station = stations.get(str(station_id))
+    if station is None:
+        raise ValueError(f"未知的工位: {station_id}")
+    return station
+
+def parse_bool(value):
+    """解析请求头/查询参数/表单中的布尔值"""
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'ng', 'defect')
+
+def spool_image_stream(stream, tmp_path, chunk_size=UPLOAD_CHUNK_SIZE):
+    """分块把图片流写入临时文件，返回写入的字节数"""
+    size = 0
     try:
-        logger.info(f"读取到文件内容: {content}")
-        # 发送开始检测的信号
-        socketio.emit('start_detection', {'message': 'START', 'data': content})
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return size
 
-        def safe_stop():
-            logger.info("在新线程中安全停止文件监控")
-            stop_file_monitoring()
-            
-        stop_thread = threading.Thread(target=safe_stop)
-        stop_thread.daemon = True
-        stop_thread.start()
-        logger.info(f"已创建停止线程: {stop_thread.name}")
-    except Exception as e:
-        logger.error(f"发送信号时出错: {e}", exc_info=True)
+def submit_image_stream(stream, filepath, on_done=None):
+    """把请求流写入临时文件后交给后台线程池完成 fsync 和 rename
 
-    # def delayed_stop():
-    #     logger.info("计划延迟停止文件监控")
-    #     stop_file_monitoring()
-    
-    # # 使用线程延迟停止监控
-    # timer = threading.Timer(0.1, delayed_stop)
-    # timer.daemon = True
-    # timer.start()
-
-def start_file_monitoring():
-    global file_monitor, last_instance_id
-    current_id = id(file_monitor) if file_monitor else 0
-    
-    logger.info(f"启动文件监控 - 当前实例ID: {current_id}, 上次记录ID: {last_instance_id}")
-
-    with monitor_lock:
-        if file_monitor is None:
-            logger.info("创建新的文件监控器实例")
-            file_monitor = InputFileMonitor(str(INPUT_FILE))
-            last_instance_id = id(file_monitor)
-        elif current_id != last_instance_id and last_instance_id != 0:
-            logger.warning(f"实例ID变化 ({last_instance_id} -> {current_id}")
-            # 记录新实例ID但不重新创建
-            last_instance_id = current_id
-            
-        file_monitor.start_monitoring(on_file_content)
-        logger.info("文件监控已启动")
-
-def stop_file_monitoring():
-    logger.info("请求停止文件监控")
-    global file_monitor
-    with monitor_lock:
-        if file_monitor:
-            file_monitor.stop_monitoring()
-            logger.info("文件监控已停止")
-
-class PLCManager:
-    def __init__(self, port=None, baudrate=9600):
-        self.serial_port = None
-        self.running = False
-        self.read_thread = None
-        
-        # 尝试自动查找可用的COM端口
-        if port is None:
-            self.auto_connect(baudrate)
-        else:
-            self.connect(port, baudrate)
+    返回图片字节数，任务被丢弃时返回 None。
+    """
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = filepath.with_name(f"{filepath.name}.{threading.get_ident()}.upload")
+    size = spool_image_stream(stream, tmp_path)
+    if not image_writer.submit(filepath, source_path=tmp_path, on_done=on_done):
+        return None
+    return size
 
+def submit_image_data(image_data, filepath, on_done=None):
+    """把内存中的图片交给后台线程池写入，返回图片字节数，任务被丢弃时返回 None"""
+    if not image_writer.submit(filepath, data=image_data, on_done=on_done):
+        return None
+    return len(image_data)
 
-    def auto_connect(self, baudrate=9600):
-        """自动查找并连接PLC设备"""
-        logger.info("开始自动查找PLC设备...")
+def parse_boxes(value):
+    """解析可选的检测框字段（列表或 JSON 字符串）"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
 
-        
-        available_ports = list(serial.tools.list_ports.comports())
-        if not available_ports:
-            logger.error("未找到任何COM端口设备")
-            return False
-        
-        logger.info(f"发现以下COM端口: {[port.device for port in available_ports]}")
-        
-        # 尝试连接每个可用端口
-        for port_info in available_ports:
-            port = port_info.device
-            logger.info(f"尝试连接端口: {port}")
-            try:
-                if self.connect(port, baudrate):
-                    logger.info(f"成功连接到PLC设备，端口: {port}")
-                    return True
-            except Exception as e:
-                logger.warning(f"尝试连接端口 {port} 失败: {e}")
-                continue
-        
-        logger.error("无法找到可用的PLC设备")
-        return False
+def request_station_id(data=None):
+    """检测结果所属的工位（X-Station-Id 请求头、查询参数、JSON 字段或表单字段）"""
+    value = request.headers.get('X-Station-Id') or request.args.get('station')
+    if value is None and data is not None:
+        value = data.get('station')
+    if value is None and request.mimetype == 'multipart/form-data':
+        value = request.form.get('station')
+    return value
 
-    def connect(self, port, baudrate=9600):
-        """连接到指定的COM端口"""
-        logger.info(f"尝试连接PLC - 端口: {port}, 波特率: {baudrate}")
-        try:
-            self.serial_port = serial.Serial(
-                port=port,
-                baudrate=baudrate,
-                bytesize=8,
-                parity='N',
-                stopbits=2,
-                timeout=1
-            )
-            self.running = True
-            self.read_thread = threading.Thread(target=self._read_plc)
-            self.read_thread.daemon = True  # 设置为守护线程，主程序退出时自动结束
-            self.read_thread.start()
-            logger.info("PLC连接初始化成功")
-            return True
-        except Exception as e:
-            logger.error(f"PLC连接初始化失败: {e}")
-            return False
-
-    def _read_plc(self):
-        """持续读取PLC信号"""
-        while self.running:
-            try:
-                if self.serial_port.in_waiting:
-                    data = self.serial_port.read(self.serial_port.in_waiting)
-                    logger.info(f"收到PLC信号: {data}")
-                    logger.info(f"PLC信号长度: {len(data)}")
-                    if data:
-                        if b'7' in data:
-                            logging.info("检测到'7'信号，开始监控文件以获取检测内容")
-                            # 启动文件监控来读取input.txt
-                            start_file_monitoring()
-            except Exception as e:
-                logger.error(f"读取PLC数据错误: {e}", exc_info=True)
-            time.sleep(0.1)
-
-    def send_command(self, command):
-        logger.info(f"发送PLC命令: {command.hex()}")
+def request_cycle_id(data=None):
+    """检测结果中带回的周期 id（JSON 字段、表单字段、X-Cycle-Id 请求头或查询参数）"""
+    value = request.headers.get('X-Cycle-Id') or request.args.get('cycle_id')
+    if value is None and data is not None:
+        value = data.get('cycle_id')
+    if value is None and request.mimetype == 'multipart/form-data':
+        value = request.form.get('cycle_id')
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def parse_json_field(value):
+    """JSON 字符串（请求头、表单字段）或已解析的值"""
+    if isinstance(value, str):
+        return json.loads(value) if value else None
+    return value
+
+def request_predictions(data=None):
+    """客户端上传的原始 NMS 结果，返回 (nmsed_pred_boxes, nmsed_pred_scores, image_size)，没有时返回 None
+
+    JSON 上传时为同名字段；multipart 时为 JSON 字符串表单字段；二进制上传时为
+    X-Pred-Boxes/X-Pred-Scores 请求头（JSON）。坐标为归一化坐标，带 image_width/
+    image_height 时按像素坐标处理。
+    """
+    if data is not None:
+        source = data
+    elif request.mimetype == 'multipart/form-data':
+        source = request.form
+    else:
+        source = {'nmsed_pred_boxes': request.headers.get('X-Pred-Boxes'),
+                  'nmsed_pred_scores': request.headers.get('X-Pred-Scores'),
+                  'image_width': request.headers.get('X-Image-Width'),
+                  'image_height': request.headers.get('X-Image-Height')}
+    return predictions_from(source)
+
+def predictions_from(source):
+    boxes = parse_json_field(source.get('nmsed_pred_boxes'))
+    scores = parse_json_field(source.get('nmsed_pred_scores'))
+    if boxes is None or scores is None:
+        return None
+    width, height = source.get('image_width'), source.get('image_height')
+    image_size = (float(width), float(height)) if width and height else None
+    return boxes, scores, image_size
+
+def request_product(data=None):
+    """检测结果所属的产品（X-Product 请求头、查询参数、JSON 字段或表单字段）"""
+    value = request.headers.get('X-Product') or request.args.get('product')
+    if value is None and data is not None:
+        value = data.get('product')
+    if value is None and request.mimetype == 'multipart/form-data':
+        value = request.form.get('product')
+    return value
+
+def read_detection_request():
+    """解析检测结果请求，返回 (has_defect, board_id, boxes, image_saver)
+
+    支持三种上传方式：
+    - application/json：图片以 base64 放在 image 字段中（原有方式）；
+    - image/jpeg 或 application/octet-stream：请求体即为图片，board_id 和
+      has_defect 通过 X-Board-Id/X-Has-Defect 请求头或查询参数传递，
+      图片直接从请求流分块写入磁盘；
+    - multipart/form-data：图片为 image 文件字段，其余字段为表单字段。
+    boxes 为可选的检测框列表。image_saver 为 None 表示请求中没有图片，否则调用
+    image_saver(filepath, on_done) 把图片交给后台写入线程池，返回图片字节数，
+    任务被丢弃时返回 None。
+    """
+    if request.mimetype in RAW_IMAGE_MIMETYPES:
+        board_id = request.headers.get('X-Board-Id', request.args.get('board_id', ''))
+        has_defect = parse_bool(request.headers.get('X-Has-Defect', request.args.get('has_defect', False)))
+        boxes = parse_boxes(request.headers.get('X-Boxes', request.args.get('boxes')))
+        if request.content_length == 0:
+            return has_defect, board_id, boxes, None
+        return has_defect, board_id, boxes, lambda filepath, on_done: submit_image_stream(request.stream, filepath, on_done)
+
+    if request.mimetype == 'multipart/form-data':
+        board_id = request.form.get('board_id', '')
+        has_defect = parse_bool(request.form.get('has_defect', False))
+        boxes = parse_boxes(request.form.get('boxes'))
+        image_file = request.files.get('image')
+        if image_file is None:
+            return has_defect, board_id, boxes, None
+        return has_defect, board_id, boxes, lambda filepath, on_done: submit_image_stream(image_file.stream, filepath, on_done)
+
+    data = request.json
+    has_defect = data.get('has_defect', False)
+    board_id = data.get('board_id', '')
+    boxes = parse_boxes(data.get('boxes'))
+    image_base64 = data.get('image', '')
+    if not image_base64:
+        return has_defect, board_id, boxes, None
+
+    image_data = base64.b64decode(image_base64)
+    return has_defect, board_id, boxes, lambda filepath, on_done: submit_image_data(image_data, filepath, on_done)
+
+def process_detection_result(station, has_defect, board_id, boxes, image_saver, cycle_id, received_at,
+                             predictions=None, product=None):
+    """HTTP 和 Socket.IO 上传共用：交给流水线放行、记录结果、提交图片保存
+
+    predictions 为客户端上传的原始 NMS 结果时由服务器按产品配置重新判定，
+    替代客户端的 has_defect，保留的缺陷框作为 boxes 保存。
+    返回 (响应字典, signalled)，signalled 见 Station.on_result。
+    """
+    evaluation = None
+    if predictions is not None:
+        evaluation = defect_analyzer.evaluate(product or station.config.product, *predictions)
+        if evaluation.has_defect != bool(has_defect):
+            logger.info(f"服务器重新判定为{'有缺陷' if evaluation.has_defect else '无缺陷'} - 板号: {board_id}, "
+                        f"产品: {evaluation.product_id}, 缺陷框: {len(evaluation.scores)}/{evaluation.received}")
+        has_defect = evaluation.has_defect
+        boxes = evaluation.to_list()
+
+    logger.info(f"收到检测结果: {'有缺陷' if has_defect else '无缺陷'} - 工位: {station.station_id}, "
+                f"板号: {board_id}, 周期: {cycle_id}")
+    
+    # 先交给本工位的流水线按板卡顺序放行，结果索引写入和图片保存都不阻塞传送带
+    job, is_new, signalled = station.on_result(board_id, has_defect, cycle_id, received_at)
+
+    result_store = station.result_store
+    verdict = VERDICT_NG if has_defect else VERDICT_OK
+    created_at = time.time()
+    filepath = result_store.image_path_for(board_id, verdict, created_at) if image_saver else None
+    result_id = result_store.record(board_id, verdict, created_at, image_path=filepath, boxes=boxes)
+    if evaluation is not None:
+        defect_analyzer.record(evaluation)
+
+    if image_saver:
+
+        # 保存图片
         try:
-            self.serial_port.write(command)
-            response = self.serial_port.read(7)
-            logger.info(f"PLC响应: {response.hex()}")
-            return response
+            def on_image_saved(path, error):
+                if error is not None:
+                    result_store.mark_image_missing(result_id)
+
+            image_size = image_saver(filepath, on_image_saved)
+            if image_size is not None:
+                result_store.set_image_size(result_id, image_size)
+                logger.info(f"图片已提交保存: {filepath}, 队列深度: {image_writer.queue_depth}")
+            else:
+                result_store.mark_image_missing(result_id)
+                logger.warning(f"图片保存任务被丢弃: {filepath}")
+            
         except Exception as e:
-            logger.error(f"PLC通信错误: {e}", exc_info=True)
-            raise
+            result_store.mark_image_missing(result_id)
+            logger.error(f"保存图片失败: {str(e)}", exc_info=True)
     
-    def close(self):
-        logger.info("关闭PLC连接")
-        self.running = False
-        if self.read_thread and self.read_thread.is_alive():
-            self.read_thread.join()
-        if self.serial_port and self.serial_port.is_open:
-            self.serial_port.close()
-
-# 初始化PLC管理器
-try:
-    plc_manager = PLCManager()
-    logger.info("PLC管理器初始化成功")
-except Exception as e:
-    logger.error(f"PLC管理器初始化失败: {e}", exc_info=True)
-    plc_manager = None
+    response = {
+        'message': 'Success',
+        'result': 'defect' if has_defect else 'normal',
+        'station': station.station_id,
+        'result_id': result_id,
+        'job_id': job.job_id if job else None,
+        'duplicate': bool(job) and not is_new
+    }
+    if evaluation is not None:
+        response['product'] = evaluation.product_id
+        response['defect_boxes'] = len(evaluation.scores)
+    return response, signalled
 
 @app.route('/detection_result', methods=['POST'])
-def receive_detection_result():
+@app.route('/stations/<station_id>/detection_result', methods=['POST'])
+def receive_detection_result(station_id=None):
+    data = request.get_json(silent=True) if request.is_json else None
     try:
-        data = request.json
-        has_defect = data.get('has_defect', False)
-        board_id = data.get('board_id', '')
-        image_base64 = data.get('image', '')
-        
-        logger.info(f"收到检测结果: {'有缺陷' if has_defect else '无缺陷'}")
-        
-        # 保存图片
-        if image_base64:
-            try:
-                image_data = base64.b64decode(image_base64)
-                
-                save_dir = IMAGES_NG_DIR if has_defect else IMAGES_OK_DIR
-                filename = f"{board_id}.jpg"
-                filepath = save_dir / filename
-                
-                with open(filepath, 'wb') as f:
-                    f.write(image_data)
-                logger.info(f"图片已保存: {filepath}")
-                
-                # 发送不同的PLC信号
-                if plc_manager:
-                    try:
-                        if has_defect:
-                            # NG信号
-                            command = bytes([8])
-                        else:
-                            # OK信号
-                            command = bytes([8])
-                        
-                        plc_manager.send_command(command)
-                        logger.info(f"已发送{'NG' if has_defect else 'OK'}信号到PLC")
-                    except Exception as e:
-                        logger.error(f"发送PLC信号失败: {e}", exc_info=True)
-                
-            except Exception as e:
-                logger.error(f"保存图片失败: {str(e)}", exc_info=True)
-        
-        return jsonify({
-            'message': 'Success',
-            'result': 'defect' if has_defect else 'normal'
-        })
+        station = get_station(station_id or request_station_id(data))
+    except ValueError as e:
+        return jsonify({'message': 'Error', 'error': str(e)}), 400
+    try:
+        received_at = time.monotonic()
+        has_defect, board_id, boxes, image_saver = read_detection_request()
+        cycle_id = request_cycle_id(data)
+        response, _ = process_detection_result(station, has_defect, board_id, boxes, image_saver,
+                                               cycle_id, received_at, predictions=request_predictions(data),
+                                               product=request_product(data))
+        count_result('http')
+        return jsonify(response)
         
     except Exception as e:
         logger.error(f"处理检测结果时出错: {str(e)}", exc_info=True)
@@ -256,34 +421,488 @@ def receive_detection_result():
             'error': str(e)
         }), 500
 
+def query_args():
+    """解析查询接口共用的分页和时间范围参数"""
+    return {
+        'start': parse_time(request.args.get('start')),
+        'end': parse_time(request.args.get('end')),
+        'page': int(request.args.get('page', 1)),
+        'page_size': int(request.args.get('page_size', 50)),
+    }
+
+def results_response(board_id=None):
+    try:
+        args = query_args()
+        verdict = request.args.get('verdict', '').upper() or None
+        if verdict and verdict not in VERDICTS:
+            raise ValueError(f"未知的判定: {verdict}")
+        station = get_station(request.args.get('station'))
+        results, total = station.result_store.query(board_id=board_id or request.args.get('board_id'),
+                                                    verdict=verdict, **args)
+    except ValueError as e:
+        return jsonify({'message': 'Error', 'error': str(e)}), 400
+    return jsonify({
+        'message': 'Success',
+        'total': total,
+        'page': args['page'],
+        'page_size': args['page_size'],
+        'results': results
+    })
+
+@app.route('/results', methods=['GET'])
+def query_results():
+    """按板号、判定(verdict=OK/NG)和时间范围(start/end)分页查询检测结果，多工位时用 station 指定工位"""
+    return results_response()
+
+@app.route('/results/board/<path:board_id>', methods=['GET'])
+def query_board_results(board_id):
+    """查询某块板的所有检测记录"""
+    return results_response(board_id)
+
+@app.route('/results/summary', methods=['GET'])
+def results_summary():
+    """统计时间范围内的OK/NG数量和NG率"""
+    try:
+        args = query_args()
+        station = get_station(request.args.get('station'))
+    except ValueError as e:
+        return jsonify({'message': 'Error', 'error': str(e)}), 400
+    counts = station.result_store.count_by_verdict(args['start'], args['end'])
+    total = sum(counts.values())
+    return jsonify({
+        'message': 'Success',
+        'total': total,
+        'counts': counts,
+        'ng_rate': counts[VERDICT_NG] / total if total else 0.0
+    })
+
+# 复查图片在浏览器中的缓存时间（秒），过期后用 If-None-Match 重新验证
+REVIEW_MAX_AGE = 3600
+
+REVIEW_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>{{ verdict }} 复查 - {{ station }}</title>
+<style>
+body { font-family: sans-serif; margin: 16px; }
+.grid { display: flex; flex-wrap: wrap; gap: 12px; }
+.card { width: {{ size }}px; font-size: 12px; }
+.card img { width: {{ size }}px; height: auto; background: #eee; display: block; }
+.missing { width: {{ size }}px; height: {{ size * 3 // 4 }}px; background: #eee; }
+</style></head><body>
+<h3>{{ verdict }} 复查 - {{ station }}：共 {{ total }} 条，第 {{ page }}/{{ pages }} 页</h3>
+<p>{% if prev_url %}<a href="{{ prev_url }}">上一页</a>{% endif %}
+{% if next_url %}<a href="{{ next_url }}">下一页</a>{% endif %}</p>
+<div class="grid">
+{% for item in results %}<div class="card">
+{% if item.image_url %}<a href="{{ item.image_url }}" target="_blank"><img loading="lazy" src="{{ item.thumbnail_url }}"></a>
+{% else %}<div class="missing"></div>{% endif %}
+<div>{{ item.board_id }}</div><div>{{ item.created_at_iso }}</div></div>
+{% endfor %}</div></body></html>
+"""
+
+def review_image_source(station, result_id):
+    """检测结果的图片：文件路径或归档段文件中的 ArchivedImage，没有图片时抛出 FileNotFoundError"""
+    result = station.result_store.get(result_id)
+    image_path = result['image_path'] if result else None
+    if is_archived(image_path):
+        return station.image_archive.locate(image_path)
+    path = station.result_store.resolve(image_path)
+    if path is None or not path.exists():
+        raise FileNotFoundError(f"检测结果 {result_id} 没有图片")
+    return path
+
+@app.route('/review', methods=['GET'])
+def review_gallery():
+    """NG 复查图库：按时间倒序分页列出有缺陷的检测结果及其缩略图和原图地址
+
+    参数与 /results 相同（station、board_id、start、end、page、page_size），verdict 默认 NG，
+    size 为缩略图尺寸。format=html 或浏览器访问时返回图库页面，否则返回 JSON。
+    """
+    try:
+        args = query_args()
+        verdict = request.args.get('verdict', VERDICT_NG).upper()
+        if verdict not in VERDICTS:
+            raise ValueError(f"未知的判定: {verdict}")
+        station = get_station(request.args.get('station'))
+        size = int(request.args.get('size', DEFAULT_THUMBNAIL_SIZE))
+        results, total = station.result_store.query(board_id=request.args.get('board_id'), verdict=verdict, **args)
+    except ValueError as e:
+        return jsonify({'message': 'Error', 'error': str(e)}), 400
+    station_arg = {'station': station.station_id} if len(stations) > 1 else {}
+    for result in results:
+        has_image = bool(result['image_path'])
+        result['image_url'] = url_for('review_image', result_id=result['id'], **station_arg) if has_image else None
+        result['thumbnail_url'] = url_for('review_thumbnail', result_id=result['id'], size=size,
+                                          **station_arg) if has_image else None
+
+    page_size = max(1, min(args['page_size'], MAX_PAGE_SIZE))
+    pages = max(1, -(-total // page_size))
+    fmt = request.args.get('format') or ('html' if request.accept_mimetypes.accept_html else 'json')
+    if fmt == 'html':
+        def page_url(page):
+            query = {**request.args.to_dict(), 'page': page}
+            return url_for('review_gallery', **query)
+        body = render_template_string(
+            REVIEW_PAGE, results=results, total=total, page=args['page'], pages=pages, verdict=verdict,
+            station=station.station_id, size=size,
+            prev_url=page_url(args['page'] - 1) if args['page'] > 1 else None,
+            next_url=page_url(args['page'] + 1) if args['page'] < pages else None)
+        response = Response(body, mimetype='text/html')
+    else:
+        response = jsonify({
+            'message': 'Success',
+            'station': station.station_id,
+            'verdict': verdict,
+            'total': total,
+            'page': args['page'],
+            'page_size': page_size,
+            'pages': pages,
+            'results': results
+        })
+    # 列表没有变化时返回 304，复查页面轮询时不重复传输
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/review/images/<int:result_id>', methods=['GET'])
+def review_image(result_id):
+    """检测结果的原图（包括已归档的图片），支持 ETag 和 Range"""
+    try:
+        station = get_station(request.args.get('station'))
+        source = review_image_source(station, result_id)
+        if not isinstance(source, Path):
+            data = station.image_archive.read(source.locator)
+    except ValueError as e:
+        return jsonify({'message': 'Error', 'error': str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({'message': 'Error', 'error': str(e)}), 404
+    if isinstance(source, Path):
+        return send_file(source, mimetype='image/jpeg', conditional=True, max_age=REVIEW_MAX_AGE)
+    # 段文件只追加，归档路径对应的内容不会改变，直接用作 ETag
+    response = Response(data, mimetype='image/jpeg')
+    response.set_etag(source.locator)
+    response.headers['Cache-Control'] = f'max-age={REVIEW_MAX_AGE}'
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+@app.route('/review/images/<int:result_id>/thumbnail', methods=['GET'])
+def review_thumbnail(result_id):
+    """检测结果的缩略图（size 为最长边，取 160/320/640 中的一档），由缩略图进程池生成并缓存"""
+    try:
+        station = get_station(request.args.get('station'))
+        size = int(request.args.get('size', DEFAULT_THUMBNAIL_SIZE))
+        source = review_image_source(station, result_id)
+        # 浏览器已有这张缩略图时只比较 ETag，不读取缓存也不生成
+        etag = thumbnail_service.etag(source, size)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        data, etag = thumbnail_service.get(source, size)
+    except ValueError as e:
+        return jsonify({'message': 'Error', 'error': str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({'message': 'Error', 'error': str(e)}), 404
+    except ThumbnailBusy as e:
+        return jsonify({'message': 'Error', 'error': str(e)}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        logger.error(f"生成缩略图出错 - 检测结果: {result_id}: {e}")
+        return jsonify({'message': 'Error', 'error': str(e)}), 500
+    response = Response(data, mimetype='image/jpeg')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'max-age={REVIEW_MAX_AGE}'
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文本格式的周期各阶段耗时、吞吐计数以及PLC/图片写入指标，按工位带 station 标签"""
+    with client_stations_lock:
+        results = dict(result_counters)
+    gauges = {'image_writer': image_writer.stats(), 'logging': logging_stats(), 'results': results,
+              'defects': defect_analyzer.stats(), 'thumbnails': thumbnail_service.stats(),
+              'archive': image_compactor.stats(), 'threads': thread_counts()}
+    tracers = {station_id: station.tracer for station_id, station in stations.items()}
+    station_gauges = {station_id: station.gauges() for station_id, station in stations.items()}
+    return Response(render_prometheus(tracers, gauges, station_gauges=station_gauges),
+                    mimetype='text/plain; version=0.0.4')
+
+def station_view(view):
+    """查询参数 station 指定工位时只返回该工位；不指定且有多个工位时按工位 id 返回全部"""
+    station_id = request.args.get('station')
+    if station_id or len(stations) == 1:
+        try:
+            station = get_station(station_id)
+        except ValueError as e:
+            return jsonify({'message': 'Error', 'error': str(e)}), 400
+        return jsonify(view(station))
+    return jsonify({'stations': {station_id: view(station) for station_id, station in stations.items()}})
+
+@app.route('/stations', methods=['GET'])
+def stations_status():
+    """各工位的配置、PLC连接状态、在线客户端数和流水线计数"""
+    return jsonify({'stations': [station.status() for station in stations.values()]})
+
+@app.route('/pipeline', methods=['GET'])
+def pipeline_status():
+    """流水线计数以及队列中各板卡的状态"""
+    return station_view(lambda station: {'stats': station.board_pipeline.stats(),
+                                         **station.board_pipeline.snapshot()})
+
+@app.route('/clients', methods=['GET'])
+def clients_status():
+    """在线检测客户端及其吞吐量、确认和检测耗时"""
+    return station_view(lambda station: {'stats': station.client_registry.stats(),
+                                         'clients': station.client_registry.clients()})
+
+@app.route('/plc/stats', methods=['GET'])
+def plc_stats():
+    """PLC命令计数、队列长度和往返时间分位数"""
+    return station_view(lambda station: station.plc_stats())
+
+def admin_only(view):
+    """诊断和管理接口：未设置 ML_SCANNER_ADMIN_TOKEN 时返回 404，令牌不对时返回 403"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if ADMIN_TOKEN is None:
+            return jsonify({'message': 'Error', 'error': "管理接口未启用"}), 404
+        token = request.headers.get('X-Admin-Token') or request.args.get('token') or ''
+        if not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({'message': 'Error', 'error': "令牌无效"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/archive', methods=['GET'])
+def archive_status():
+    """旧 OK 图片归档：归档任务计数、各工位的归档策略和段文件统计"""
+    return station_view(lambda station: {
+        'compactor': image_compactor.stats(),
+        'policy': station.config.archive.to_dict() if station.config.archive else None,
+        'segments': station.image_archive.stats(),
+    })
+
+@app.route('/archive/run', methods=['POST'])
+@admin_only
+def archive_run():
+    """立即执行一轮归档，不等待下一次定时执行"""
+    image_compactor.run_now()
+    return jsonify({'message': 'Success', 'compactor': image_compactor.stats()})
+
+@app.route('/heatmap', methods=['GET'])
+def heatmap():
+    """产品的缺陷位置热力图
+
+    product 指定产品（默认 default）；format=json（默认，二维列表）、npy（NumPy 数组文件）
+    或 png（灰度图，最亮处为缺陷最多的位置）。不指定 product 且 format=json 时列出
+    各产品的判定参数和已有热力图。
+    """
+    product = request.args.get('product')
+    fmt = request.args.get('format', 'json').lower()
+    if product is None and fmt == 'json':
+        return jsonify({'products': defect_analyzer.profiles(), 'stats': defect_analyzer.stats()})
+    profile, counts = defect_analyzer.heatmap(product)
+    if fmt == 'npy':
+        buffer = io.BytesIO()
+        np.save(buffer, counts)
+        return Response(buffer.getvalue(), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename="{profile.product_id}.npy"'})
+    if fmt == 'png':
+        from PIL import Image
+        peak = counts.max()
+        pixels = (counts.astype(np.float64) * (255.0 / peak)).astype(np.uint8) if peak else counts.astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels, mode='L').save(buffer, format='PNG')
+        return Response(buffer.getvalue(), mimetype='image/png')
+    if fmt != 'json':
+        return jsonify({'message': 'Error', 'error': f"未知的格式: {fmt}"}), 400
+    return jsonify({
+        **profile.to_dict(),
+        'total': int(counts.sum()),
+        'max': int(counts.max()),
+        'heatmap': counts.tolist(),
+    })
+
+@app.route('/image_writer/stats', methods=['GET'])
+def image_writer_stats():
+    return jsonify(image_writer.stats())
+
+profiler = SamplingProfiler()
+
+@app.route('/debug', methods=['GET'])
+@admin_only
+def debug_summary():
+    """按类的线程数、各工位 monitor_lock 和文件监控器各锁的等待/持有时间及当前持有者"""
+    return jsonify({'threads': thread_counts(), 'locks': lock_stats(),
+                    'profiler': {'running': profiler.running, 'last_run': profiler.last_run}})
+
+@app.route('/debug/threads', methods=['GET'])
+@admin_only
+def debug_threads():
+    """所有线程的当前调用栈；format=json 时返回 JSON，默认为文本"""
+    threads = thread_dump()
+    if request.args.get('format') == 'json':
+        return jsonify({'counts': thread_counts(), 'threads': threads})
+    return Response(format_thread_dump(threads), mimetype='text/plain; charset=utf-8')
+
+@app.route('/debug/profile', methods=['GET'])
+@admin_only
+def debug_profile():
+    """对运行中的进程采样 seconds 秒（默认 5，最长 60），返回折叠栈
+
+    interval 为采样间隔秒数（默认 0.01）；thread 只采样名称以此开头的线程（例如 PLCReader、
+    FileMonitor、HTTPWorker）；lines=1 时按行号区分；format=json 时返回 JSON。
+    输出可以直接交给 flamegraph.pl 或 speedscope 生成火焰图。
+    """
+    try:
+        seconds = float(request.args.get('seconds', DEFAULT_PROFILE_SECONDS))
+        interval = float(request.args.get('interval', DEFAULT_PROFILE_INTERVAL))
+    except ValueError as e:
+        return jsonify({'message': 'Error', 'error': f"参数错误: {e}"}), 400
+    # nan 会让采样循环永远不结束（interval 为 nan 时还会空转），inf 同样拒绝
+    if not (math.isfinite(seconds) and math.isfinite(interval)):
+        return jsonify({'message': 'Error', 'error': "参数错误: seconds 和 interval 必须是有限的数"}), 400
+    result = profiler.profile(seconds, interval, thread=request.args.get('thread') or None,
+                              lines=parse_bool(request.args.get('lines')))
+    if result is None:
+        return jsonify({'message': 'Error', 'error': "已有采样分析在进行"}), 409
+    if request.args.get('format') == 'json':
+        return jsonify({**result, 'stacks': dict(result['stacks'].most_common())})
+    return Response(format_collapsed(result['stacks']), mimetype='text/plain; charset=utf-8',
+                    headers={'X-Profile-Samples': str(result['samples'])})
+
 @socketio.on('connect')
-def handle_connect():
-    logger.info('客户端已连接')
-    emit('connection_response', {'message': 'Connected'})
+def handle_connect(auth=None):
+    # 连接时 auth 或查询参数中的 station 指定工位（只有一个工位时可省略），
+    # role=viewer 的客户端只接收本工位的通知，不参与检测；pipeline 为客户端能同时
+    # 处理的板卡数，不声明时每次只下发一块（客户端只保存当前板卡的板号）；
+    # acks=1 表示客户端会 ack start_detection，未及时确认的板卡改派给其他客户端
+    auth = auth if isinstance(auth, dict) else {}
+    role = auth.get('role') or request.args.get('role')
+    try:
+        max_inflight = int(auth.get('pipeline') or request.args.get('pipeline') or DEFAULT_CLIENT_INFLIGHT)
+    except (TypeError, ValueError):
+        max_inflight = DEFAULT_CLIENT_INFLIGHT
+    acks = parse_bool(auth.get('acks') or request.args.get('acks') or False)
+    try:
+        station = get_station(auth.get('station') or request.args.get('station'))
+    except ValueError as e:
+        logger.warning(f"拒绝客户端连接: {e}")
+        return False
+    logger.info(f'客户端已连接 - 工位: {station.station_id}')
+    join_room(station.room)
+    with client_stations_lock:
+        client_stations[request.sid] = station
+    emit('connection_response', {'message': 'Connected', 'station': station.station_id})
+    if role != 'viewer':
+        station.register_client(request.sid, auth.get('name') or request.args.get('name') or request.remote_addr,
+                                max_inflight, acks)
 
 @socketio.on('disconnect')
-def handle_disconnect():
+def handle_disconnect(*args):
     logger.info('客户端已断开连接')
+    with client_stations_lock:
+        station = client_stations.pop(request.sid, None)
+        result_inflight.pop(request.sid, None)
+    if station is not None:
+        station.unregister_client(request.sid)
 
 @socketio.on('release_signal')
 def handle_release_signal(data):
     message = data.get('message', '')
+    with client_stations_lock:
+        station = client_stations.get(request.sid)
     logger.info(f'收到放行信号: {message}')
     
-    # 发送放行信号到PLC
-    if plc_manager:
-        try:
-            release_command = bytes([8])
-            plc_manager.send_command(release_command)
-            logger.info("已发送PLC放行信号")
-        except Exception as e:
-            logger.error(f"发送PLC放行信号失败: {e}", exc_info=True)
+    # 发送放行信号到客户端所属工位的PLC
+    if station is not None:
+        station.send_release_signal()
+
+@socketio.on('detection_result')
+def handle_detection_result(data):
+    """通过 Socket.IO 上传检测结果，图片为二进制附件（不需要 base64）
+
+    data 的字段与 JSON 上传相同（board_id、has_defect、cycle_id、boxes、product、
+    nmsed_pred_boxes/nmsed_pred_scores），image 为 JPEG 字节，NMS 结果也可以是
+    float32 字节串，工位为客户端连接时指定的工位。结果与 HTTP 上传走同样的保存和放行
+    流程，放行命令发送到PLC后（最多等待 RESULT_ACK_TIMEOUT 秒）才通过 ack 返回，
+    released 表示命令是否已发送。每个客户端同时处理的结果不超过
+    RESULT_INFLIGHT_PER_CLIENT 个，超过时立即返回 busy，客户端应稍后重试。
+    """
+    sid = request.sid
+    with client_stations_lock:
+        station = client_stations.get(sid)
+        inflight = result_inflight.get(sid, 0)
+        if station is not None and inflight < RESULT_INFLIGHT_PER_CLIENT:
+            result_inflight[sid] = inflight + 1
+    if station is None:
+        return {'message': 'Error', 'error': '客户端未指定工位'}
+    if inflight >= RESULT_INFLIGHT_PER_CLIENT:
+        count_result('busy')
+        logger.warning(f"客户端未完成的检测结果过多，拒绝 - 工位: {station.station_id}, 数量: {inflight}")
+        return {'message': 'Error', 'error': 'busy', 'inflight': inflight}
+    try:
+        received_at = time.monotonic()
+        data = data if isinstance(data, dict) else {}
+        has_defect = parse_bool(data.get('has_defect', False))
+        board_id = str(data.get('board_id', ''))
+        boxes = parse_boxes(data.get('boxes'))
+        cycle_id = data.get('cycle_id')
+        cycle_id = int(cycle_id) if cycle_id not in (None, '') else None
+        image_data = data.get('image') or None
+        if isinstance(image_data, str):
+            image_data = base64.b64decode(image_data)
+        image_saver = None
+        if image_data:
+            image_saver = lambda filepath, on_done: submit_image_data(image_data, filepath, on_done)  # noqa: E731
+        response, signalled = process_detection_result(station, has_defect, board_id, boxes, image_saver,
+                                                       cycle_id, received_at, predictions=predictions_from(data),
+                                                       product=data.get('product'))
+        count_result('socketio')
+        response['released'] = station.wait_signalled(signalled, RESULT_ACK_TIMEOUT)
+        return response
+    except Exception as e:
+        logger.error(f"处理检测结果时出错: {str(e)}", exc_info=True)
+        return {'message': 'Error', 'error': str(e)}
+    finally:
+        with client_stations_lock:
+            if sid in result_inflight:
+                result_inflight[sid] -= 1
+
+def shutdown_services():
+    """按顺序停止后台服务：归档任务，各工位的文件监控、流水线和PLC，最后写完队列中剩余的图片"""
+    image_compactor.close()
+    for station in stations.values():
+        station.close()
+    defect_analyzer.close()
+    thumbnail_service.close()
+    image_writer.shutdown(timeout=10)
+    logger.info("后台服务已停止")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ML Scanner 服务器")
+    parser.add_argument('--mode', choices=SERVING_MODES, default=os.environ.get('ML_SCANNER_MODE', MODE_THREADED),
+                        help="threaded: 线程池 WSGI 服务器（生产环境）；dev: Werkzeug 开发服务器（debug + reloader）")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('ML_SCANNER_WORKERS', DEFAULT_WORKERS)),
+                        help="处理普通请求（检测结果上传、查询等）的线程数")
+    parser.add_argument('--max-queued', type=int,
+                        default=int(os.environ.get('ML_SCANNER_MAX_QUEUED', DEFAULT_MAX_QUEUED)),
+                        help="工作线程都在忙时最多排队的连接数，超过后返回 503")
+    parser.add_argument('--socketio-workers', type=int,
+                        default=int(os.environ.get('ML_SCANNER_SOCKETIO_WORKERS', DEFAULT_SOCKETIO_WORKERS)),
+                        help="Socket.IO 长连接（WebSocket、长轮询）的线程数上限，每个连接占用一个线程，超过后返回 503")
+    parser.add_argument('--drain-timeout', type=float, default=DEFAULT_DRAIN_TIMEOUT,
+                        help="关闭时等待正在处理的请求完成的秒数")
+    return parser.parse_args()
+
+# 缩略图子进程（spawn）以 __mp_main__ 导入本模块时只需要其中的定义
+if __name__ != '__mp_main__':
+    start_services()
 
 if __name__ == '__main__':
+    args = parse_args()
     try:
         logger.info("启动服务器...")
-        socketio.run(app, host='0.0.0.0', port=8080, debug=True)
+        run_server(app, socketio, mode=args.mode, host=args.host, port=args.port,
+                   workers=args.workers, drain_timeout=args.drain_timeout, max_queued=args.max_queued,
+                   socketio_workers=args.socketio_workers)
     finally:
-        stop_file_monitoring()
-        if plc_manager:
-            plc_manager.close()
\ No newline at end of file
+        shutdown_services()
@@ -0,0 +1,215 @@
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer
+from logger_config import get_logger
+
+logger = get_logger("Serving")
+
+MODE_DEV = "dev"            # Werkzeug 开发服务器（debug + reloader），仅用于开发调试
+MODE_THREADED = "threaded"  # 固定大小线程池的 WSGI 服务器，生产环境使用
+SERVING_MODES = (MODE_DEV, MODE_THREADED)
+
+DEFAULT_WORKERS = 32
+DEFAULT_MAX_QUEUED = 64
+DEFAULT_SOCKETIO_WORKERS = 64
+DEFAULT_DRAIN_TIMEOUT = 10.0
+# 按请求行的路径区分长连接：Socket.IO 的 WebSocket 和长轮询
+SOCKETIO_PATH = b"/socket.io/"
+# 读取请求行用于分类的超时（秒）；超时或请求行过长时按普通请求处理
+CLASSIFY_TIMEOUT = 5.0
+CLASSIFY_BYTES = 2048
+
+SERVICE_UNAVAILABLE = (b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: text/plain\r\n"
+                       b"Content-Length: 20\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+                       b"server is saturated\n")
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """用固定大小线程池处理连接的 WSGI 服务器
+
+    与 Werkzeug 每个请求新建一个线程不同，连接交给 workers 个线程处理，
+    并记录正在处理的连接数，关闭时可以等待它们完成。
+
+    Socket.IO 的 WebSocket 和长轮询连接会长时间占用一个线程，按请求行的路径
+    转交给单独的 socketio_workers 个线程处理，不占用处理 /detection_result 等
+    普通请求的线程。普通连接排队超过 max_queued 个、或长连接超过
+    socketio_workers 个时直接返回 503，不再无限排队。
+    """
+
+    multithread = True
+    multiprocess = False
+
+    def __init__(self, host, port, app, workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED,
+                 socketio_workers=DEFAULT_SOCKETIO_WORKERS, **kwargs):
+        super().__init__(host, port, app, **kwargs)
+        self.workers = workers
+        self.max_queued = max_queued
+        self.socketio_workers = socketio_workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="HTTPWorker")
+        self.socketio_executor = ThreadPoolExecutor(max_workers=socketio_workers, thread_name_prefix="SocketIOWorker")
+        # 普通线程池中排队和处理中的连接数、长连接数
+        self._pending = 0
+        self._long_lived = 0
+        self._inflight_cond = threading.Condition()
+        self._counters = {"rejected": 0, "socketio_rejected": 0}
+
+    @property
+    def inflight(self):
+        return self._pending + self._long_lived
+
+    def stats(self):
+        with self._inflight_cond:
+            return {"workers": self.workers, "pending": self._pending, "max_queued": self.max_queued,
+                    "socketio_workers": self.socketio_workers, "socketio_connections": self._long_lived,
+                    **self._counters}
+
+    def process_request(self, request, client_address):
+        # WebSocket 上的 ack 和小消息不等待 Nagle 合并，否则与对端的延迟确认叠加会多出约 40 毫秒
+        try:
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+        with self._inflight_cond:
+            saturated = self._pending >= self.workers + self.max_queued
+            if saturated:
+                self._counters["rejected"] += 1
+            else:
+                self._pending += 1
+        if saturated:
+            logger.warning(f"工作线程和等待队列已满（{self.workers} + {self.max_queued}），"
+                           f"拒绝来自 {client_address[0]} 的连接")
+            self._reject(request)
+            return
+        self.executor.submit(self._process_request_thread, request, client_address)
+
+    def _reject(self, request):
+        try:
+            request.sendall(SERVICE_UNAVAILABLE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _is_long_lived(self, request):
+        """预读请求行（不消耗数据），判断是否为 Socket.IO 连接"""
+        try:
+            request.settimeout(CLASSIFY_TIMEOUT)
+            head = request.recv(CLASSIFY_BYTES, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            # ValueError：TLS 连接不支持 MSG_PEEK
+            return False
+        finally:
+            try:
+                request.settimeout(None)
+            except OSError:
+                pass
+        parts = head.split(b"\r\n", 1)[0].split(b" ")
+        return len(parts) == 3 and parts[1].startswith(SOCKETIO_PATH)
+
+    def _process_request_thread(self, request, client_address):
+        if self._is_long_lived(request):
+            with self._inflight_cond:
+                self._pending -= 1
+                accepted = self._long_lived < self.socketio_workers
+                if accepted:
+                    self._long_lived += 1
+                else:
+                    self._counters["socketio_rejected"] += 1
+                self._inflight_cond.notify_all()
+            if not accepted:
+                logger.warning(f"Socket.IO 连接数已达上限 {self.socketio_workers}，拒绝来自 {client_address[0]} 的连接")
+                self._reject(request)
+                return
+            try:
+                self.socketio_executor.submit(self._finish, request, client_address, True)
+            except RuntimeError:
+                # 正在关闭，长连接线程池已停止
+                self._finish_counting(True)
+                self._reject(request)
+            return
+        self._finish(request, client_address, False)
+
+    def _finish(self, request, client_address, long_lived):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._finish_counting(long_lived)
+
+    def _finish_counting(self, long_lived):
+        with self._inflight_cond:
+            if long_lived:
+                self._long_lived -= 1
+            else:
+                self._pending -= 1
+            self._inflight_cond.notify_all()
+
+    def drain(self, timeout):
+        """等待正在处理的请求完成，超时返回 False"""
+        with self._inflight_cond:
+            drained = self._inflight_cond.wait_for(lambda: self.inflight == 0, timeout=timeout)
+        self.executor.shutdown(wait=drained)
+        self.socketio_executor.shutdown(wait=drained)
+        return drained
+
+
+def run_threaded(app, socketio, host, port, workers=DEFAULT_WORKERS, drain_timeout=DEFAULT_DRAIN_TIMEOUT,
+                 max_queued=DEFAULT_MAX_QUEUED, socketio_workers=DEFAULT_SOCKETIO_WORKERS):
+    """以线程池模式运行，收到 SIGTERM/SIGINT 后停止接收新连接并等待请求处理完成"""
+    async_mode = socketio.server.eio.async_mode if socketio.server else None
+    if async_mode != "threading":
+        raise RuntimeError(f"threaded 模式需要 Socket.IO 使用 threading 异步模式，当前为 {async_mode}")
+
+    httpd = PooledWSGIServer(host, port, app, workers=workers, max_queued=max_queued,
+                             socketio_workers=socketio_workers)
+    stop_requested = threading.Event()
+
+    def request_stop(signum, _frame):
+        if stop_requested.is_set():
+            return
+        stop_requested.set()
+        logger.info(f"收到信号 {signal.Signals(signum).name}，停止接收新连接")
+        # shutdown() 会等待 serve_forever 退出，不能在主线程中调用
+        threading.Thread(target=httpd.shutdown, name="HTTPShutdown", daemon=True).start()
+
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous_handlers[signum] = signal.signal(signum, request_stop)
+
+    logger.info(f"服务器以线程池模式运行: http://{host}:{port}, 工作线程数: {workers}, "
+                f"等待队列: {max_queued}, Socket.IO 连接上限: {socketio_workers}")
+    try:
+        httpd.serve_forever()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        started = time.monotonic()
+        # 先断开 Socket.IO 客户端，释放长连接占用的工作线程
+        shutdown = getattr(socketio.server, "shutdown", None)
+        if shutdown:
+            try:
+                shutdown()
+            except Exception as e:
+                logger.warning(f"断开 Socket.IO 客户端时出错: {e}")
+        httpd.server_close()
+        if httpd.drain(drain_timeout):
+            logger.info(f"正在处理的请求已完成，用时 {time.monotonic() - started:.2f} 秒")
+        else:
+            logger.warning(f"等待 {drain_timeout} 秒后仍有 {httpd.inflight} 个请求未完成")
+
+
+def run_server(app, socketio, mode=MODE_THREADED, host='0.0.0.0', port=8080,
+               workers=DEFAULT_WORKERS, drain_timeout=DEFAULT_DRAIN_TIMEOUT,
+               max_queued=DEFAULT_MAX_QUEUED, socketio_workers=DEFAULT_SOCKETIO_WORKERS):
+    if mode == MODE_DEV:
+        logger.warning("以开发模式运行（Werkzeug debug + reloader），不要在生产环境使用")
+        socketio.run(app, host=host, port=port, debug=True, allow_unsafe_werkzeug=True)
+    elif mode == MODE_THREADED:
+        run_threaded(app, socketio, host, port, workers, drain_timeout, max_queued, socketio_workers)
+    else:
+        raise ValueError(f"未知的运行模式: {mode}")
@@ -0,0 +1,367 @@
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+
+import yaml
+
+from board_pipeline import BoardPipeline
+from client_registry import (ClientRegistry, POLICY_LEAST_LOADED, DEFAULT_ACK_TIMEOUT, DEFAULT_INSPECT_TIMEOUT,
+                             DEFAULT_CLIENT_INFLIGHT)
+from cycle_trace import CycleTracer, STAGE_FILE_READ, STAGE_EMITTED, STAGE_RESULT, STAGE_PLC_SENT, STAGE_PLC_ACK
+from file_monitor import InputFileMonitor
+from image_archive import ImageArchive, ArchivePolicy, ARCHIVE_DIR_NAME
+from introspection import InstrumentedLock
+from logger_config import get_logger
+from plc_manager import PLCManager
+from plc_protocol import FrameSpec, FrameType
+from result_store import ResultStore, VERDICT_OK, VERDICT_NG
+
+# 没有工位配置文件时的单工位 id（兼容原来的单产线部署）
+DEFAULT_STATION_ID = "default"
+
+
+class StationConfig:
+    """一个工位的配置：PLC串口、扫码枪输入文件、图片目录、Socket.IO 房间和分配策略"""
+
+    __slots__ = ("station_id", "input_file", "images_dir", "plc_port", "plc_baudrate", "plc_frame",
+                 "plc_handshake", "plc_handshake_response", "plc_cache_file", "room",
+                 "dispatch_policy", "ack_timeout", "inspect_timeout", "product", "archive")
+
+    def __init__(self, station_id, input_file, images_dir, plc_port=None, plc_baudrate=9600, plc_frame=None,
+                 plc_handshake=None, plc_handshake_response=None, plc_cache_file=None, room=None,
+                 dispatch_policy=POLICY_LEAST_LOADED, ack_timeout=DEFAULT_ACK_TIMEOUT,
+                 inspect_timeout=DEFAULT_INSPECT_TIMEOUT, product=None, archive=None):
+        self.station_id = str(station_id)
+        self.input_file = Path(input_file)
+        self.images_dir = Path(images_dir)
+        self.plc_port = plc_port
+        self.plc_baudrate = plc_baudrate
+        self.plc_frame = plc_frame
+        self.plc_handshake = plc_handshake
+        self.plc_handshake_response = plc_handshake_response
+        self.plc_cache_file = plc_cache_file
+        self.room = room or self.station_id
+        self.dispatch_policy = dispatch_policy
+        self.ack_timeout = ack_timeout
+        self.inspect_timeout = inspect_timeout
+        # 本产线默认生产的产品，检测结果未指定产品时使用它的判定参数
+        self.product = product
+        # 旧 OK 图片的归档策略（ArchivePolicy），None 表示不归档
+        self.archive = archive
+
+    @classmethod
+    def from_dict(cls, config, base_dir):
+        """从 YAML 中的一个工位创建，相对路径以 base_dir 为基准
+
+        input_file、images_dir、plc_cache_file 未配置时分别为
+        input/<id>.txt、Images/<id>/、plc_port.<id>.json，plc_frame 见 FrameSpec.from_dict。
+        """
+        config = dict(config or {})
+        if "id" not in config:
+            raise ValueError(f"工位配置缺少 id: {config}")
+        station_id = str(config.pop("id"))
+        unknown = set(config) - set(cls.__slots__[1:])
+        if unknown:
+            raise ValueError(f"工位 {station_id} 的配置项未知: {', '.join(sorted(unknown))}")
+        base_dir = Path(base_dir)
+        defaults = {
+            "input_file": Path("input") / f"{station_id}.txt",
+            "images_dir": Path("Images") / station_id,
+            "plc_cache_file": f"plc_port.{station_id}.json",
+        }
+        for key, default in defaults.items():
+            value = config.get(key) or default
+            config[key] = base_dir / Path(value).expanduser()
+        if config.get("plc_frame") is not None:
+            config["plc_frame"] = FrameSpec.from_dict(config["plc_frame"])
+        for key in ("plc_handshake", "plc_handshake_response"):
+            if isinstance(config.get(key), str):
+                config[key] = config[key].encode("latin-1")
+        if isinstance(config.get("archive"), dict):
+            config["archive"] = ArchivePolicy.from_dict(config["archive"])
+        return cls(station_id, **config)
+
+    def to_dict(self):
+        return {
+            "station_id": self.station_id,
+            "room": self.room,
+            "plc_port": self.plc_port,
+            "input_file": str(self.input_file),
+            "images_dir": str(self.images_dir),
+            "dispatch_policy": self.dispatch_policy,
+            "product": self.product,
+            "archive": self.archive.to_dict() if self.archive else None,
+        }
+
+
+def load_station_configs(path, defaults=None):
+    """读取工位配置文件，defaults 为各工位共用的默认值（会被文件中的 defaults 覆盖）
+
+    配置文件格式：
+
+        defaults:
+          inspect_timeout: 15
+        stations:
+          - id: line1
+            plc_port: /dev/ttyUSB0
+            input_file: input/line1.txt
+            images_dir: Images/line1
+          - id: line2
+            plc_port: /dev/ttyUSB1
+
+    多个工位时每个工位都必须指定 plc_port（自动查找无法区分各条产线的PLC），
+    工位 id、PLC串口、输入文件和图片目录不能重复。
+    """
+    path = Path(path)
+    with open(path, "r", encoding="utf-8") as f:
+        document = yaml.safe_load(f) or {}
+    entries = document.get("stations") or []
+    if not entries:
+        raise ValueError(f"{path} 中没有配置工位")
+    shared = dict(defaults or {})
+    shared.update(document.get("defaults") or {})
+
+    configs = [StationConfig.from_dict({**shared, **entry}, path.parent) for entry in entries]
+    for field in ("station_id", "plc_port", "input_file", "images_dir"):
+        values = [getattr(c, field) for c in configs if getattr(c, field) is not None]
+        duplicates = sorted({str(v) for v in values if values.count(v) > 1})
+        if duplicates:
+            raise ValueError(f"工位配置中 {field} 重复: {', '.join(duplicates)}")
+    if len(configs) > 1:
+        missing = [c.station_id for c in configs if not c.plc_port]
+        if missing:
+            raise ValueError(f"多工位时必须为每个工位指定 plc_port: {', '.join(missing)}")
+    return configs
+
+
+class Station:
+    """一个工位（一条产线）：PLC、扫码枪输入文件、检测结果索引、流水线和检测客户端
+
+    每个工位有自己的文件监控线程、流水线超时线程、客户端超时线程和PLC线程，
+    一条产线的PLC断线或客户端卡住不会影响其他产线；图片写入线程池由所有工位
+    共用。检测客户端连接时指定工位，加入该工位的 Socket.IO 房间，只接收本工位的
+    板卡。send(sid, payload, on_ack) 把 start_detection 发给选中的客户端，
+    broadcast(event, payload, room) 通知房间内的所有客户端（包括只查看的客户端）。
+    """
+
+    def __init__(self, config, send, broadcast=None):
+        self.config = config
+        self.station_id = config.station_id
+        self.room = config.room
+        self.logger = get_logger(f"Station.{self.station_id}")
+        self._broadcast = broadcast
+
+        self.input_file = config.input_file
+        if not self.input_file.exists():
+            self.input_file.parent.mkdir(parents=True, exist_ok=True)
+            self.input_file.touch()
+        self.images_dir = config.images_dir
+        for verdict in (VERDICT_OK, VERDICT_NG):
+            (self.images_dir / verdict).mkdir(parents=True, exist_ok=True)
+        # 检测结果索引，图片按 <images_dir>/<OK|NG>/<年>/<月>/<日>/ 分目录保存
+        self.result_store = ResultStore(self.images_dir / 'results.db', self.images_dir)
+        # 归档后的旧 OK 图片（image_path 为 archive/<段文件>#<序号>）
+        self.image_archive = ImageArchive(self.images_dir / ARCHIVE_DIR_NAME)
+
+        # 板卡周期追踪：从PLC触发到PLC放行各阶段的耗时，通过 /metrics 导出
+        self.tracer = CycleTracer()
+
+        # 文件监控器在服务运行期间一直监控，按行读取条码；锁保护对它的并发访问（记录等待和持有时间）
+        self.file_monitor = None
+        self.monitor_lock = InstrumentedLock(f"Station[{self.station_id}].monitor_lock")
+
+        # 检测客户端登记表：每块板卡只下发给本工位的一个客户端，超时或断开时改派
+        self.client_registry = ClientRegistry(send, policy=config.dispatch_policy,
+                                              ack_timeout=config.ack_timeout,
+                                              inspect_timeout=config.inspect_timeout)
+        # 板卡流水线：扫码与PLC触发配对，上一块板卡检测时下一块可以先扫码排队
+        self.board_pipeline = BoardPipeline(self.dispatch_board, self.release_board,
+                                            on_timeout=lambda job: self.client_registry.cancel(job.job_id))
+        self.plc_manager = None
+
+    def start(self):
+        self.client_registry.start()
+        self.board_pipeline.start()
+        self.start_file_monitoring()
+        # 在后台线程中查找/连接PLC，服务器无需等待，断线后自动重连
+        try:
+            self.plc_manager = PLCManager(port=self.config.plc_port,
+                                          baudrate=self.config.plc_baudrate,
+                                          frame_spec=self.config.plc_frame,
+                                          handlers={FrameType.TRIGGER: self.on_plc_trigger},
+                                          handshake=self.config.plc_handshake,
+                                          handshake_response=self.config.plc_handshake_response,
+                                          cache_file=self.config.plc_cache_file)
+            self.plc_manager.start()
+            self.logger.info("PLC管理器初始化成功")
+        except Exception as e:
+            self.logger.error(f"PLC管理器初始化失败: {e}", exc_info=True)
+            self.plc_manager = None
+
+    def close(self):
+        """停止文件监控、流水线、客户端登记表和PLC"""
+        self.stop_file_monitoring()
+        self.board_pipeline.close()
+        self.client_registry.close()
+        if self.plc_manager:
+            self.plc_manager.close()
+        self.image_archive.close()
+
+    # 扫码枪
+    def on_file_content(self, content):
+        """读到一行条码"""
+        try:
+            self.board_pipeline.on_scan(content)
+        except Exception as e:
+            self.logger.error(f"处理条码时出错: {e}", exc_info=True)
+
+    def start_file_monitoring(self):
+        with self.monitor_lock:
+            if self.file_monitor is None:
+                self.logger.info(f"创建文件监控器: {self.input_file}")
+                # 启动前文件中的条码已经处理过，不能再与新的PLC触发配对
+                self.file_monitor = InputFileMonitor(str(self.input_file), split_lines=True, skip_existing=True)
+            self.file_monitor.start_monitoring(self.on_file_content)
+            self.logger.info("文件监控已启动")
+
+    def stop_file_monitoring(self):
+        self.logger.info("请求停止文件监控")
+        with self.monitor_lock:
+            if self.file_monitor:
+                self.file_monitor.stop_monitoring()
+                self.logger.info("文件监控已停止")
+
+    # PLC
+    def on_plc_trigger(self, frame):
+        """PLC '7' 到位信号：与扫码枪读到的条码配对"""
+        cycle_id = self.tracer.begin(frame.received_at)
+        self.logger.info(f"检测到'7'信号 - 周期: {cycle_id}")
+        self.board_pipeline.on_trigger(cycle_id, frame.received_at)
+
+    def log_plc_result(self, future, description):
+        """PLC命令完成时记录结果（在PLC读取线程中调用）"""
+        error = future.exception()
+        if error is not None:
+            self.logger.error(f"发送{description}失败: {error}")
+        else:
+            self.logger.info(f"已发送{description}")
+
+    def on_plc_signal_done(self, future, description, cycle_id):
+        self.tracer.mark(cycle_id, STAGE_PLC_ACK)
+        self.tracer.finish(cycle_id)
+        self.log_plc_result(future, description)
+
+    def send_result_signal(self, has_defect, cycle_id=None):
+        """根据检测结果发送PLC信号，命令由PLC线程异步发送，不阻塞请求线程"""
+        if self.plc_manager:
+            try:
+                if has_defect:
+                    # NG信号
+                    command = bytes([8])
+                else:
+                    # OK信号
+                    command = bytes([8])
+
+                future = self.plc_manager.send_command(command)
+                self.tracer.mark(cycle_id, STAGE_PLC_SENT)
+                description = f"{'NG' if has_defect else 'OK'}信号到PLC"
+                future.add_done_callback(lambda f: self.on_plc_signal_done(f, description, cycle_id))
+                return future
+            except Exception as e:
+                self.logger.error(f"发送PLC信号失败: {e}", exc_info=True)
+        return None
+
+    def send_release_signal(self):
+        """客户端手动放行"""
+        if self.plc_manager:
+            try:
+                future = self.plc_manager.send_command(bytes([8]))
+                future.add_done_callback(lambda f: self.log_plc_result(f, "PLC放行信号"))
+            except Exception as e:
+                self.logger.error(f"发送PLC放行信号失败: {e}", exc_info=True)
+
+    # 流水线
+    def update_pipeline_capacity(self):
+        """流水线同时检测的板卡数为本工位在线客户端的空位之和（没有客户端时为 1）"""
+        self.board_pipeline.set_max_inflight(max(1, self.client_registry.capacity))
+
+    def dispatch_board(self, job):
+        """流水线下发一块板卡：交给本工位的一个检测客户端开始检测"""
+        self.tracer.mark(job.cycle_id, STAGE_FILE_READ, job.scanned_at)
+        self.tracer.bind_board(job.cycle_id, job.board_id)
+        self.client_registry.submit(job.job_id, {'message': 'START', 'data': job.board_id,
+                                                 'cycle_id': job.cycle_id, 'job_id': job.job_id,
+                                                 'station': self.station_id})
+        self.tracer.mark(job.cycle_id, STAGE_EMITTED)
+
+    def release_board(self, job):
+        """流水线按顺序放行一块板卡，并通知本工位房间内的客户端"""
+        self.tracer.mark(job.cycle_id, STAGE_RESULT, job.result_at)
+        future = self.send_result_signal(job.has_defect, job.cycle_id)
+        if future is None:
+            job.signalled.set_result(False)
+        else:
+            future.add_done_callback(lambda f: job.signalled.set_result(f.exception() is None))
+        if self._broadcast:
+            self._broadcast('board_released', {'station': self.station_id, 'board_id': job.board_id,
+                                               'job_id': job.job_id, 'cycle_id': job.cycle_id,
+                                               'result': 'defect' if job.has_defect else 'normal'}, self.room)
+
+    def on_result(self, board_id, has_defect, cycle_id=None, received_at=None):
+        """收到检测结果，返回 (任务, 是否为新结果, signalled)
+
+        只由流水线按板卡顺序放行：PLC放行信号不带板号，流水线之外多发一次放行会让
+        治具中的板卡与之后的检测结果错位。流水线中没有对应板卡的结果只记录不放行
+        （计入流水线的 unknown_results）。signalled 为放行命令发送到PLC后完成的
+        Future（结果为是否发送成功），这个结果没有触发放行（重复、迟到或未知）时为 None。
+        """
+        received_at = time.monotonic() if received_at is None else received_at
+        job, is_new = self.board_pipeline.on_result(board_id, has_defect, cycle_id, received_at)
+        if job is None:
+            self.logger.warning(f"流水线中没有对应的板卡，不发送PLC信号 - 板号: {board_id}, 周期: {cycle_id}")
+            return None, False, None
+        if not is_new:
+            return job, False, None
+        self.client_registry.complete(job.job_id)
+        return job, True, job.signalled
+
+    def wait_signalled(self, signalled, timeout):
+        """等待 on_result 返回的放行命令发送到PLC，返回是否已成功发送"""
+        if signalled is None:
+            return False
+        try:
+            return signalled.result(timeout)
+        except FutureTimeoutError:
+            return False
+
+    # 检测客户端
+    def register_client(self, sid, name, max_inflight=DEFAULT_CLIENT_INFLIGHT, acks=False):
+        self.client_registry.register(sid, name, max_inflight, acks)
+        self.update_pipeline_capacity()
+
+    def unregister_client(self, sid):
+        self.client_registry.unregister(sid)
+        self.update_pipeline_capacity()
+
+    def plc_stats(self):
+        if not self.plc_manager:
+            return {'connected': False}
+        return self.plc_manager.stats()
+
+    def gauges(self):
+        """/metrics 中按工位导出的组件计数"""
+        lock = self.monitor_lock.stats()
+        gauges = {'pipeline': self.board_pipeline.stats(), 'dispatch': self.client_registry.stats(),
+                  'monitor_lock': {key: lock[key] for key in ('acquisitions', 'contended', 'wait_ms_total',
+                                                              'wait_ms_max', 'hold_ms_max')}}
+        if self.plc_manager:
+            gauges['plc'] = self.plc_manager.stats()
+        return gauges
+
+    def status(self):
+        return {
+            **self.config.to_dict(),
+            'plc_connected': bool(self.plc_manager and self.plc_manager.is_connected),
+            'clients': self.client_registry.client_count,
+            'pipeline': self.board_pipeline.stats(),
+        }
@@ -0,0 +1,282 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from logger_config import get_logger
+
+logger = get_logger("Thumbnails")
+
+# 允许的缩略图边长（像素），请求的尺寸取不小于它的最小一档，避免缓存被任意尺寸撑满
+THUMBNAIL_SIZES = (160, 320, 640)
+DEFAULT_THUMBNAIL_SIZE = 320
+DEFAULT_QUALITY = 80
+DEFAULT_WORKERS = 2
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 1024 * 1024 * 1024
+# 排队和正在生成的缩略图上限，超过时直接返回 ThumbnailBusy，不占用请求线程等待
+DEFAULT_MAX_PENDING = 16
+RENDER_TIMEOUT = 10.0
+# 子进程的 nice 值：生成缩略图让出 CPU 给PLC、文件监控和检测结果处理
+WORKER_NICE = 10
+
+
+class ThumbnailBusy(Exception):
+    """待生成的缩略图过多"""
+
+
+def _init_worker():
+    # Ctrl+C 和 SIGTERM 会发给整个进程组，子进程由服务器关闭时统一停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        os.nice(WORKER_NICE)
+    except OSError:
+        pass
+
+
+def _ping():
+    return os.getpid()
+
+
+def render_thumbnail(source_path, size, quality, cache_path, offset=None, length=None):
+    """在子进程中生成缩略图：写入磁盘缓存并返回 JPEG 字节
+
+    offset/length 不为 None 时原图是归档段文件中的一段。
+    """
+    from PIL import Image
+    if offset is not None:
+        with open(source_path, "rb") as f:
+            source_path = io.BytesIO(os.pread(f.fileno(), length, offset))
+    with Image.open(source_path) as image:
+        # JPEG 解码时直接按 1/2、1/4、1/8 缩小，比解码整幅图再缩放快得多
+        image.draft("RGB", (size, size))
+        thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((size, size), Image.BILINEAR)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=quality)
+    data = buffer.getvalue()
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, cache_path)
+    return data
+
+
+def snap_size(size):
+    """把请求的尺寸归到 THUMBNAIL_SIZES 中的一档"""
+    for allowed in THUMBNAIL_SIZES:
+        if size <= allowed:
+            return allowed
+    return THUMBNAIL_SIZES[-1]
+
+
+class ThumbnailService:
+    """NG 复查用的缩略图服务：进程池生成，磁盘 + 内存两级 LRU 缓存
+
+    缩略图由 workers 个子进程用 Pillow 生成（nice 值 WORKER_NICE），请求线程只等待
+    结果，解码和缩放不会占用PLC、文件监控和检测结果处理的线程，也不受 GIL 影响。
+    缓存键由原图路径、修改时间、大小和缩略图尺寸决定，同时作为 ETag；原图改变后
+    旧缩略图不再命中，由 LRU 淘汰。内存缓存不超过 memory_bytes，磁盘缓存
+    （cache_dir/<前两位>/<键>.jpg）不超过 disk_bytes，启动时扫描已有文件继续使用。
+    同一缩略图的并发请求共用一次生成；排队的生成超过 max_pending 时抛出 ThumbnailBusy。
+
+    子进程以 spawn 方式启动，服务器的其他线程已经运行时重建进程池也不会在子进程中
+    继承它们持有的锁。spawn 会以 __mp_main__ 重新导入主模块，server.py 此时不启动服务
+    （见 server.start_services）。
+    """
+
+    def __init__(self, cache_dir, workers=DEFAULT_WORKERS, memory_bytes=DEFAULT_MEMORY_BYTES,
+                 disk_bytes=DEFAULT_DISK_BYTES, max_pending=DEFAULT_MAX_PENDING, quality=DEFAULT_QUALITY):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = workers
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_pending = max_pending
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk = OrderedDict()
+        self._disk_used = 0
+        self._pending = {}
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "renders": 0, "render_errors": 0, "busy": 0,
+                          "evicted": 0}
+        self._render_seconds = 0.0
+        self._scan_disk_cache()
+        self._executor = None
+        self._start_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker)
+
+    def _start_executor(self):
+        self._executor = self._new_executor()
+        # spawn 方式下每次提交最多创建一个子进程，启动时先创建全部子进程，第一次请求不用等待子进程启动
+        pings = [self._executor.submit(_ping) for _ in range(self.workers)]
+        for ping in pings:
+            ping.result(timeout=RENDER_TIMEOUT)
+
+    def _scan_disk_cache(self):
+        entries = []
+        for path in self.cache_dir.glob("*/*.jpg"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, path.stem, st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_used += size
+        self._evict_disk()
+        if entries:
+            logger.info(f"缩略图磁盘缓存: {len(self._disk)} 个文件, {self._disk_used / 1024 / 1024:.1f} MB")
+
+    def _cache_path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.jpg"
+
+    def etag(self, source, size):
+        """缩略图的 ETag（即缓存键），原图不存在时抛出 FileNotFoundError
+
+        source 为图片路径，或归档段文件中的图片（image_archive.ArchivedImage，段文件只追加，
+        其中的图片不会改变）。
+        """
+        size = snap_size(int(size))
+        if hasattr(source, "segment_path"):
+            origin = f"{os.path.abspath(source.segment_path)}@{source.offset}+{source.length}"
+        else:
+            st = os.stat(source)
+            origin = f"{os.path.abspath(source)}:{st.st_mtime_ns}:{st.st_size}"
+        raw = f"{origin}:{size}:{self.quality}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+
+    def get(self, source, size=DEFAULT_THUMBNAIL_SIZE):
+        """返回 (JPEG 字节, ETag)，source 见 etag()"""
+        size = snap_size(int(size))
+        key = self.etag(source, size)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return data, key
+            on_disk = key in self._disk
+        if on_disk:
+            try:
+                data = self._cache_path(key).read_bytes()
+            except FileNotFoundError:
+                data = None
+            with self._lock:
+                if data is None:
+                    self._disk_used -= self._disk.pop(key, 0)
+                else:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._counters["disk_hits"] += 1
+                    self._remember(key, data)
+                    return data, key
+        return self._render(key, source, size), key
+
+    def _render(self, key, source, size):
+        submitted = False
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                if len(self._pending) >= self.max_pending:
+                    self._counters["busy"] += 1
+                    raise ThumbnailBusy(f"待生成的缩略图已达上限 ({self.max_pending})")
+                if hasattr(source, "segment_path"):
+                    args = (render_thumbnail, str(source.segment_path), size, self.quality,
+                             str(self._cache_path(key)), source.offset, source.length)
+                else:
+                    args = (render_thumbnail, str(source), size, self.quality, str(self._cache_path(key)))
+                try:
+                    future = self._executor.submit(*args)
+                except BrokenProcessPool:
+                    self._restart_executor()
+                    future = self._executor.submit(*args)
+                future.started_at = time.monotonic()
+                self._pending[key] = future
+                submitted = True
+        # 已完成的 future 会在当前线程立即调用回调，因此在锁外注册
+        if submitted:
+            future.add_done_callback(lambda f, key=key: self._finish(key, f))
+        return future.result(timeout=RENDER_TIMEOUT)
+
+    def _finish(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                self._counters["render_errors"] += 1
+                error = "已取消" if future.cancelled() else future.exception()
+                logger.warning(f"生成缩略图失败: {error}")
+                if isinstance(error, BrokenProcessPool):
+                    self._restart_executor()
+                return
+            data = future.result()
+            self._counters["renders"] += 1
+            self._render_seconds += time.monotonic() - future.started_at
+            self._disk_used -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_used += len(data)
+            self._evict_disk()
+            self._remember(key, data)
+
+    def _restart_executor(self):
+        """子进程异常退出后重建进程池（调用方持有锁）"""
+        if self._executor is not None and not getattr(self._executor, "_broken", False):
+            return
+        logger.error("缩略图进程池已损坏，重新创建")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+
+    def _remember(self, key, data):
+        """放入内存缓存（调用方持有锁）"""
+        if len(data) > self.memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= len(previous)
+        self._memory[key] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+
+    def _evict_disk(self):
+        """删除最久未使用的磁盘缓存直到不超过 disk_bytes（调用方持有锁）"""
+        while self._disk_used > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            self._counters["evicted"] += 1
+            try:
+                os.unlink(self._cache_path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._counters)
+            result.update({
+                "pending": len(self._pending),
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_used,
+                "render_ms_avg": round(self._render_seconds / result["renders"] * 1000, 1)
+                if result["renders"] else None,
+            })
+            return result
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
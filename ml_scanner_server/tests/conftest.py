@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 服务器模块以脚本目录为根互相导入（与 bench/ 相同）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'server'))
@@ -0,0 +1,74 @@
+import time
+
+from board_pipeline import BoardPipeline, JOB_DROPPED, JOB_RELEASED, JOB_TIMED_OUT
+
+
+def make_pipeline(**kwargs):
+    released = []
+    dispatched = []
+    pipeline = BoardPipeline(dispatched.append, released.append, **kwargs)
+    return pipeline, dispatched, released
+
+
+def test_result_for_dropped_board_is_late_not_unknown():
+    pipeline, dispatched, released = make_pipeline(pair_timeout=1.0)
+    job = pipeline.on_scan("STALE", at=0.0)
+    pipeline.check_timeouts(now=10.0)
+    assert job.state == JOB_DROPPED
+
+    found, is_new = pipeline.on_result("STALE", False)
+    assert found is job and not is_new
+    assert released == []
+    stats = pipeline.stats()
+    assert stats["late_results"] == 1
+    assert stats["unknown_results"] == 0
+
+
+def test_scans_and_triggers_pair_in_arrival_order():
+    pipeline, dispatched, _ = make_pipeline(max_inflight=3)
+    pipeline.on_trigger(1, at=0.0)
+    pipeline.on_scan("B1", at=0.1)
+    pipeline.on_scan("B2", at=0.2)
+    pipeline.on_scan("B3", at=0.3)
+    pipeline.on_trigger(2, at=0.4)
+    assert [(job.board_id, job.cycle_id) for job in dispatched] == [("B1", 1), ("B2", 2)]
+    assert pipeline.stats()["waiting"] == 1
+
+
+def test_results_are_released_in_conveyor_order():
+    pipeline, dispatched, released = make_pipeline(max_inflight=3)
+    for cycle, board in enumerate(("B1", "B2", "B3"), start=1):
+        pipeline.on_scan(board)
+        pipeline.on_trigger(cycle)
+    assert len(dispatched) == 3
+
+    pipeline.on_result("B3", False, cycle_id=3)
+    assert released == []
+    pipeline.on_result("B1", True, cycle_id=1)
+    assert [job.board_id for job in released] == ["B1"]
+    pipeline.on_result("B2", False, cycle_id=2)
+    assert [(job.board_id, job.has_defect, job.state) for job in released] == [
+        ("B1", True, JOB_RELEASED), ("B2", False, JOB_RELEASED), ("B3", False, JOB_RELEASED)]
+
+
+def test_timed_out_board_is_released_as_reject_before_later_boards():
+    timeouts = []
+    pipeline, dispatched, released = make_pipeline(max_inflight=2, result_timeout=5.0,
+                                                   on_timeout=timeouts.append)
+    pipeline.on_scan("B1")
+    pipeline.on_trigger(1)
+    pipeline.on_scan("B2")
+    pipeline.on_trigger(2)
+    pipeline.on_result("B2", False, cycle_id=2)
+    assert released == []
+
+    pipeline.check_timeouts(now=time.monotonic() + 10.0)
+    assert [job.board_id for job in timeouts] == ["B1"]
+    assert [(job.board_id, job.has_defect, job.state) for job in released] == [
+        ("B1", True, JOB_TIMED_OUT), ("B2", False, JOB_RELEASED)]
+
+    # 超时之后才到达的结果不再放行
+    job, is_new = pipeline.on_result("B1", False, cycle_id=1)
+    assert job is released[0] and not is_new
+    assert len(released) == 2
+    assert pipeline.stats()["late_results"] == 1
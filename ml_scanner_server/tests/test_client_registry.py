@@ -0,0 +1,102 @@
+import time
+
+from client_registry import ClientRegistry
+
+
+def make_registry(**kwargs):
+    sent = []
+    acks = {}
+
+    def send(sid, payload, on_ack):
+        sent.append((sid, payload["job"]))
+        acks[(sid, payload["job"])] = on_ack
+
+    return ClientRegistry(send, **kwargs), sent, acks
+
+
+def test_reassigned_board_waits_for_a_free_slot():
+    registry, sent, _ = make_registry(ack_timeout=None, inspect_timeout=None)
+    registry.register("a")
+    registry.register("b")
+    registry.submit(1, {"job": 1})
+    registry.submit(2, {"job": 2})
+    assert sorted(sent) == [("a", 1), ("b", 2)]
+
+    registry.unregister("a")
+    # b 已有一块板卡且只能同时处理一块：改派的板卡排队，不覆盖 b 当前的板卡
+    assert len(sent) == 2
+    assert registry.stats()["queued"] == 1
+
+    registry.complete(2)
+    assert sent[-1] == ("b", 1)
+    assert {c["sid"]: c["inflight"] for c in registry.clients()} == {"b": 1}
+
+
+def test_boards_queue_until_a_client_connects():
+    registry, sent, _ = make_registry(ack_timeout=None, inspect_timeout=None)
+    registry.submit(1, {"job": 1})
+    registry.submit(2, {"job": 2})
+    assert sent == [] and registry.stats()["queued"] == 2
+
+    registry.register("a", max_inflight=2)
+    assert sent == [("a", 1), ("a", 2)]
+    assert registry.stats()["queued"] == 0
+
+
+def test_capacity_respects_each_clients_pipeline_depth():
+    registry, sent, _ = make_registry(ack_timeout=None, inspect_timeout=None)
+    registry.register("a", max_inflight=2)
+    registry.register("b")
+    assert registry.capacity == 3
+    for job in range(1, 5):
+        registry.submit(job, {"job": job})
+    assert sorted(sent) == [("a", 1), ("a", 3), ("b", 2)]
+    assert registry.stats()["queued"] == 1
+
+    assert registry.complete(2) == "b"
+    assert sent[-1] == ("b", 4)
+    assert {c["sid"]: c["inflight"] for c in registry.clients()} == {"a": 2, "b": 1}
+
+
+def test_unacked_board_is_reassigned_and_late_ack_ignored():
+    registry, sent, acks = make_registry(ack_timeout=1.0, inspect_timeout=None)
+    registry.register("a", acks=True)
+    registry.register("b", acks=True)
+    registry.submit(1, {"job": 1})
+    assert sent == [("a", 1)]
+
+    registry.check_timeouts(now=time.monotonic() + 2.0)
+    assert sent == [("a", 1), ("b", 1)]
+    assert registry.stats()["reassigned"] == 1
+
+    # a 在改派之后才确认，不算作 b 的确认
+    acks[("a", 1)]()
+    clients = {c["sid"]: c for c in registry.clients()}
+    assert clients["a"]["acked"] == 0 and clients["a"]["reassigned"] == 1
+    acks[("b", 1)]()
+    assert {c["sid"]: c["acked"] for c in registry.clients()} == {"a": 0, "b": 1}
+
+
+def test_clients_without_acks_are_not_reassigned_on_ack_timeout():
+    registry, sent, _ = make_registry(ack_timeout=1.0, inspect_timeout=10.0)
+    registry.register("a")
+    registry.register("b")
+    registry.submit(1, {"job": 1})
+    registry.check_timeouts(now=time.monotonic() + 2.0)
+    assert sent == [("a", 1)]
+
+    registry.check_timeouts(now=time.monotonic() + 11.0)
+    assert sent == [("a", 1), ("b", 1)]
+
+
+def test_board_is_abandoned_after_max_attempts():
+    registry, sent, _ = make_registry(ack_timeout=None, inspect_timeout=1.0, max_attempts=2)
+    registry.register("a")
+    registry.register("b")
+    registry.submit(1, {"job": 1})
+    registry.check_timeouts(now=time.monotonic() + 2.0)
+    registry.check_timeouts(now=time.monotonic() + 4.0)
+    assert sent == [("a", 1), ("b", 1)]
+    stats = registry.stats()
+    assert stats["abandoned"] == 1 and stats["inflight"] == 0 and stats["queued"] == 0
+    assert registry.complete(1) is None
@@ -0,0 +1,51 @@
+import threading
+import time
+
+from file_monitor import InputFileMonitor
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def test_skip_existing_does_not_replay_old_barcodes(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("OLD1\nOLD2\nOLD3\n", encoding="utf-8")
+    received = []
+    lock = threading.Lock()
+
+    def on_line(line):
+        with lock:
+            received.append(line)
+
+    monitor = InputFileMonitor(str(path), watcher_backend="polling", poll_interval=0.02, fallback_interval=0.05,
+                               split_lines=True, skip_existing=True)
+    monitor.start_monitoring(on_line)
+    try:
+        time.sleep(0.2)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("NEW1\n")
+        assert wait_for(lambda: received)
+        time.sleep(0.1)
+        assert received == ["NEW1"]
+    finally:
+        monitor.stop_monitoring()
+
+
+def test_without_skip_existing_reads_whole_file(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("A\nB\n", encoding="utf-8")
+    received = []
+    monitor = InputFileMonitor(str(path), watcher_backend="polling", poll_interval=0.02, fallback_interval=0.05,
+                               split_lines=True)
+    monitor.start_monitoring(received.append)
+    try:
+        assert wait_for(lambda: len(received) == 2)
+        assert received == ["A", "B"]
+    finally:
+        monitor.stop_monitoring()
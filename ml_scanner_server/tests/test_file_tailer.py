@@ -0,0 +1,95 @@
+import os
+
+from file_tailer import FileTailer, TAIL_MARKER_SIZE
+
+
+def append(path, text):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_reads_only_appended_content(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("A1\n", encoding="utf-8")
+    tailer = FileTailer(str(path))
+    assert tailer.read_new() == ("A1\n", "first")
+    assert tailer.read_new() == ("", None)
+
+    append(path, "A2\nA3\n")
+    assert tailer.read_new() == ("A2\nA3\n", "appended")
+    assert tailer.offset == path.stat().st_size
+
+
+def test_rotation_reads_new_file_from_start(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("OLD1\nOLD2\n", encoding="utf-8")
+    tailer = FileTailer(str(path))
+    tailer.read_new()
+
+    # 原子替换：新文件比读取偏移长，也必须从头读取
+    replacement = tmp_path / "input.txt.new"
+    replacement.write_text("NEW1\nNEW2\nNEW3\n", encoding="utf-8")
+    os.replace(replacement, path)
+    assert tailer.read_new() == ("NEW1\nNEW2\nNEW3\n", "rotated")
+
+    append(path, "NEW4\n")
+    assert tailer.read_new() == ("NEW4\n", "appended")
+
+
+def test_truncation_reads_from_start(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("B1\nB2\nB3\n", encoding="utf-8")
+    tailer = FileTailer(str(path))
+    tailer.read_new()
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("C1\n")
+    assert tailer.read_new() == ("C1\n", "truncated")
+
+
+def test_in_place_rewrite_is_detected(tmp_path):
+    path = tmp_path / "input.txt"
+    first = "X" * TAIL_MARKER_SIZE + "\n"
+    path.write_text(first, encoding="utf-8")
+    tailer = FileTailer(str(path))
+    tailer.read_new()
+
+    # 同一个文件，长度没有变小，但已读的部分被改写
+    rewritten = "Y" * TAIL_MARKER_SIZE + "\nD1\n"
+    with open(path, "r+", encoding="utf-8") as f:
+        f.write(rewritten)
+    assert tailer.read_new() == (rewritten, "rewritten")
+
+
+def test_large_append_is_read_in_chunks(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("", encoding="utf-8")
+    tailer = FileTailer(str(path), max_read_bytes=16)
+    tailer.read_new()
+
+    content = "".join(f"BOARD{i:04d}\n" for i in range(10))
+    append(path, content)
+    chunks = []
+    while True:
+        text, _ = tailer.read_new()
+        chunks.append(text)
+        if not tailer.has_pending:
+            break
+    assert "".join(chunks) == content
+    assert all(len(chunk) <= 16 for chunk in chunks)
+
+
+def test_seek_to_end_skips_existing_but_detects_rotation(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("OLD1\nOLD2\n", encoding="utf-8")
+    tailer = FileTailer(str(path))
+    tailer.seek_to_end()
+    assert tailer.read_new() == ("", None)
+
+    append(path, "NEW1\n")
+    assert tailer.read_new() == ("NEW1\n", "appended")
+
+    replacement = tmp_path / "input.txt.new"
+    replacement.write_text("R1\n", encoding="utf-8")
+    os.replace(replacement, path)
+    assert tailer.read_new() == ("R1\n", "rotated")
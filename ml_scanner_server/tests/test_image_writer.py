@@ -0,0 +1,38 @@
+import threading
+import time
+
+from image_writer import ImageWriterPool, OVERFLOW_DROP_NEWEST
+
+
+def test_shutdown_with_full_queue_does_not_block(tmp_path):
+    pool = ImageWriterPool(num_workers=1, max_queue=1, overflow_policy=OVERFLOW_DROP_NEWEST, fsync_batch=1)
+    unblock = threading.Event()
+    started = threading.Event()
+
+    def stuck(filepath, error):
+        started.set()
+        unblock.wait(10)
+
+    # 工作线程卡在第一个任务的回调里，第二个任务占满队列
+    assert pool.submit(tmp_path / "a.jpg", data=b"a", on_done=stuck)
+    assert started.wait(5)
+    assert pool.submit(tmp_path / "b.jpg", data=b"b")
+
+    begin = time.monotonic()
+    assert pool.shutdown(timeout=0.3) is False
+    assert time.monotonic() - begin < 2
+    stats = pool.stats()
+    assert stats["dropped"] == 1 and stats["queue_depth"] == 0
+    assert not (tmp_path / "b.jpg").exists()
+
+    unblock.set()
+    assert pool.submit(tmp_path / "c.jpg", data=b"c") is False
+
+
+def test_shutdown_writes_queued_jobs(tmp_path):
+    pool = ImageWriterPool(num_workers=2, max_queue=8)
+    for i in range(5):
+        assert pool.submit(tmp_path / f"{i}.jpg", data=b"x" * i)
+    assert pool.shutdown(timeout=5) is True
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"{i}.jpg" for i in range(5)]
+    assert pool.stats()["written"] == 5
@@ -0,0 +1,15 @@
+import math
+
+import pytest
+
+from introspection import SamplingProfiler
+
+
+@pytest.mark.parametrize("seconds, interval", [(math.nan, 0.01), (0.1, math.nan), (math.inf, 0.01)])
+def test_profile_rejects_non_finite_arguments(seconds, interval):
+    profiler = SamplingProfiler()
+    with pytest.raises(ValueError):
+        profiler.profile(seconds, interval)
+    # 被拒绝的请求不能占住采样锁
+    result = profiler.profile(0.05, 0.01)
+    assert result is not None and result["samples"] >= 1
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from plc_manager import PLCManager
+from plc_protocol import FrameParser, FrameSpec, FrameType, FrameDispatcher, MODE_FIXED, MODE_LENGTH
+
+
+def test_only_complete_trigger_frames_trigger():
+    parser = FrameParser()
+    frames = parser.feed(b"7 17 77 7\r\n7", now=100.0)
+    assert [(f.type, f.payload) for f in frames] == [
+        (FrameType.TRIGGER, b"7"), (FrameType.UNKNOWN, b"17"), (FrameType.UNKNOWN, b"77"),
+        (FrameType.TRIGGER, b"7")]
+    # 最后的 '7' 没有结束符，超过 idle_gap 没有新字节后才作为一帧
+    assert parser.flush_idle(now=100.0) == []
+    frames = parser.flush_idle(now=100.0 + 2 * parser.spec.idle_gap)
+    assert [(f.type, f.payload) for f in frames] == [(FrameType.TRIGGER, b"7")]
+
+
+def test_frame_split_across_reads():
+    parser = FrameParser()
+    assert parser.feed(b"7", now=0.0) == []
+    frames = parser.feed(b" ", now=0.001)
+    assert [f.type for f in frames] == [FrameType.TRIGGER]
+    assert frames[0].received_at == 0.001
+
+
+def test_checksum_and_length_modes():
+    spec = FrameSpec(mode=MODE_LENGTH, checksum="sum8", codes={b"\x07": FrameType.TRIGGER})
+    parser = FrameParser(spec)
+    good = bytes([2, 0x07, 0x07])
+    bad = bytes([2, 0x07, 0x08])
+    frames = parser.feed(good + bad)
+    assert [(f.type, f.payload) for f in frames] == [(FrameType.TRIGGER, b"\x07")]
+    assert parser.invalid_frames == 1
+
+    fixed = FrameParser(FrameSpec(mode=MODE_FIXED, length=2, codes={b"OK": FrameType.ACK}))
+    assert [f.type for f in fixed.feed(b"OKNG")] == [FrameType.ACK, FrameType.UNKNOWN]
+
+
+def test_expected_response_ignores_delimiters():
+    parser = FrameParser()
+    parser.expect_response(3)
+    frames = parser.feed(b"7 \n7 ")
+    assert [(f.type, f.payload) for f in frames] == [(FrameType.ACK, b"7 \n"), (FrameType.TRIGGER, b"7")]
+
+
+def test_dispatcher_isolates_handler_errors():
+    calls = []
+
+    def broken(frame):
+        raise RuntimeError("boom")
+
+    dispatcher = FrameDispatcher({FrameType.TRIGGER: broken})
+    dispatcher.register(FrameType.TRIGGER, calls.append)
+    frame = FrameParser().feed(b"7 ")[0]
+    dispatcher.dispatch(frame)
+    assert calls == [frame]
+    assert dispatcher.counts[FrameType.TRIGGER] == 1
+
+
+def test_manager_dispatches_triggers_from_serial_port():
+    triggers = []
+    received = threading.Event()
+
+    def on_trigger(frame):
+        triggers.append(frame.payload)
+        if len(triggers) == 2:
+            received.set()
+
+    manager = PLCManager(port="loop://", handlers={FrameType.TRIGGER: on_trigger})
+    assert manager.connect("loop://")
+    try:
+        # loop:// 把写出的字节原样读回，相当于PLC连续发送两次 '7 '
+        assert manager.send_command(b"7 7 ").result(timeout=2) == b""
+        assert received.wait(2)
+        assert triggers == [b"7", b"7"]
+        assert manager.stats()["completed"] == 1
+    finally:
+        manager.close()
+
+
+def test_command_not_connected_fails_immediately():
+    manager = PLCManager(port="loop://")
+    with pytest.raises(ConnectionError):
+        manager.send_command(b"\x01").result(timeout=1)
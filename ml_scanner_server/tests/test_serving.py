@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from serving import PooledWSGIServer
+
+
+def make_server(**kwargs):
+    """普通请求在 release 设置前一直占用工作线程；/socket.io/ 下的请求同样阻塞，模拟长连接"""
+    release = threading.Event()
+
+    def app(environ, start_response):
+        release.wait(10)
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [environ["PATH_INFO"].encode()]
+
+    httpd = PooledWSGIServer("127.0.0.1", 0, app, **kwargs)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, release, f"http://127.0.0.1:{httpd.server_port}"
+
+
+def get_in_background(url):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(requests.get(url, timeout=10)))
+    thread.start()
+    return thread, results
+
+
+@pytest.fixture
+def servers():
+    started = []
+    yield started
+    for httpd, release in started:
+        release.set()
+        httpd.shutdown()
+        httpd.server_close()
+        httpd.drain(5)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_saturated_server_returns_503(servers):
+    httpd, release, base_url = make_server(workers=1, max_queued=1, socketio_workers=1)
+    servers.append((httpd, release))
+    busy = [get_in_background(base_url + f"/busy{i}") for i in range(2)]
+    assert wait_for(lambda: httpd.stats()["pending"] == 2)
+
+    response = requests.get(base_url + "/detection_result", timeout=5)
+    assert response.status_code == 503
+    assert httpd.stats()["rejected"] == 1
+
+    release.set()
+    for thread, results in busy:
+        thread.join(10)
+        assert results[0].status_code == 200
+
+
+def test_socketio_connections_do_not_use_request_workers(servers):
+    httpd, release, base_url = make_server(workers=1, max_queued=0, socketio_workers=2)
+    servers.append((httpd, release))
+    long_lived = []
+    for i in range(2):
+        long_lived.append(get_in_background(base_url + f"/socket.io/?EIO=4&transport=polling&n={i}"))
+        assert wait_for(lambda: httpd.stats()["socketio_connections"] == i + 1 and httpd.stats()["pending"] == 0)
+
+    # 长连接已满时新的 Socket.IO 连接被拒绝，普通请求仍有线程可用
+    assert requests.get(base_url + "/socket.io/?EIO=4&transport=polling", timeout=5).status_code == 503
+    normal, results = get_in_background(base_url + "/detection_result")
+    assert wait_for(lambda: httpd.stats()["pending"] == 1)
+    release.set()
+    normal.join(10)
+    assert results[0].status_code == 200
+    for thread, _ in long_lived:
+        thread.join(10)
@@ -0,0 +1,114 @@
+from concurrent.futures import Future
+
+import pytest
+
+from station import Station, StationConfig, load_station_configs
+
+
+class FakePLC:
+    def __init__(self):
+        self.commands = []
+
+    def send_command(self, command):
+        self.commands.append(command)
+        future = Future()
+        future.set_result(b"")
+        return future
+
+    def close(self):
+        pass
+
+
+def make_station(tmp_path):
+    config = StationConfig(tmp_path.name, tmp_path / "input.txt", tmp_path / "Images")
+    station = Station(config, send=lambda sid, payload, on_ack: None)
+    station.plc_manager = FakePLC()
+    return station
+
+
+def test_unknown_result_is_not_released_outside_the_pipeline(tmp_path):
+    station = make_station(tmp_path)
+    try:
+        job, is_new, signalled = station.on_result("NOT-IN-PIPELINE", True)
+        assert (job, is_new, signalled) == (None, False, None)
+        assert station.plc_manager.commands == []
+        assert station.board_pipeline.stats()["unknown_results"] == 1
+    finally:
+        station.close()
+
+
+def test_pipeline_result_releases_once(tmp_path):
+    station = make_station(tmp_path)
+    try:
+        station.register_client("sid", "client")
+        station.board_pipeline.on_scan("B1")
+        station.board_pipeline.on_trigger(1)
+        job, is_new, signalled = station.on_result("B1", False, cycle_id=1)
+        assert is_new and station.wait_signalled(signalled, 1.0)
+        assert station.plc_manager.commands == [bytes([8])]
+        station.on_result("B1", False, cycle_id=1)
+        assert station.plc_manager.commands == [bytes([8])]
+    finally:
+        station.close()
+
+
+def write_config(tmp_path, text):
+    path = tmp_path / "stations.yaml"
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def test_station_config_defaults_and_relative_paths(tmp_path):
+    path = write_config(tmp_path, """
+defaults:
+  inspect_timeout: 7
+stations:
+  - id: line1
+    plc_port: /dev/ttyUSB0
+  - id: line2
+    plc_port: /dev/ttyUSB1
+    input_file: scans/line2.txt
+    inspect_timeout: 3
+""")
+    line1, line2 = load_station_configs(path, defaults={"ack_timeout": 2})
+    assert line1.input_file == tmp_path / "input" / "line1.txt"
+    assert line1.images_dir == tmp_path / "Images" / "line1"
+    assert (line1.inspect_timeout, line1.ack_timeout, line1.room) == (7, 2, "line1")
+    assert line2.input_file == tmp_path / "scans" / "line2.txt"
+    assert line2.inspect_timeout == 3
+
+
+@pytest.mark.parametrize("text, message", [
+    ("stations:\n  - id: a\n    plc_port: COM1\n  - id: b\n    plc_port: COM1\n", "plc_port"),
+    ("stations:\n  - id: a\n    plc_port: COM1\n  - id: a\n    plc_port: COM2\n", "station_id"),
+    ("stations:\n  - id: a\n    plc_port: COM1\n  - id: b\n", "plc_port"),
+    ("stations:\n  - id: a\n    plc_prot: COM1\n", "plc_prot"),
+    ("stations: []\n", "没有配置工位"),
+])
+def test_invalid_station_configs_are_rejected(tmp_path, text, message):
+    with pytest.raises(ValueError, match=message):
+        load_station_configs(write_config(tmp_path, text))
+
+
+def test_stations_pair_and_release_independently(tmp_path):
+    line1 = make_station(tmp_path / "line1")
+    line2 = make_station(tmp_path / "line2")
+    try:
+        for station in (line1, line2):
+            station.register_client("sid", "client")
+        line1.board_pipeline.on_scan("L1-B1")
+        line2.board_pipeline.on_scan("L2-B1")
+        line2.board_pipeline.on_trigger(1)
+        line1.board_pipeline.on_trigger(1)
+
+        # 同一个周期 id 在两个工位各自独立；其他工位的板号在本工位是未知结果
+        job, is_new, _ = line2.on_result("L1-B1", False)
+        assert job is None and not is_new
+        job, is_new, signalled = line2.on_result("L2-B1", False, cycle_id=1)
+        assert job.board_id == "L2-B1" and line2.wait_signalled(signalled, 1.0)
+        assert line1.plc_manager.commands == []
+        assert line1.board_pipeline.stats()["inflight"] == 1
+        assert line2.plc_manager.commands == [bytes([8])]
+    finally:
+        line1.close()
+        line2.close()